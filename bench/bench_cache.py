@@ -0,0 +1,192 @@
+'''
+Persistent on-disk cache of parsed bench data files.
+
+Parsing large bench logs dominates the run time of check_bench_regressions.py,
+gen_bench_expectations.py and tile_analyze.py, while the logs of a revision
+never change once uploaded. BenchCache stores the data points parsed from each
+log in a compact binary file named after the log's content hash, so later runs
+skip parsing entirely.
+'''
+
+import bench_util
+import hashlib
+import marshal
+import os
+import tempfile
+
+from array import array
+
+# Bump when the layout of cache entries changes.
+CACHE_FORMAT_VERSION = 1
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.skia_bench_cache')
+
+# Least recently used entries are evicted beyond this total size.
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# Eviction trims the cache to this fraction of its maximum size, so that a
+# full cache is not listed again on every store.
+EVICTION_TARGET_RATIO = 0.9
+
+CACHE_FILE_SUFFIX = '.bench'
+
+# Size of the chunks in which bench logs are read for hashing.
+READ_CHUNK_BYTES = 1024 * 1024
+
+
+class BenchCache(object):
+    """Cache of parsed bench data, keyed by content hash, parser version,
+    representation algorithm and parse settings.
+
+    Entries are marshaled tuples of strings, settings dictionaries and
+    array('d') buffers. Hits refresh the entry's modification time, which
+    orders entries for LRU eviction once the cache grows over max_bytes.
+
+    The size of the cache is scanned once, when it is created, and then
+    counted up as entries are stored, so the directory is only listed again
+    when the count goes over max_bytes. Copies of the cache handed to worker
+    processes count their own entries only; anything they leave over the
+    limit is evicted by the next run.
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR,
+                 max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._total_bytes = sum(size for _, size, _ in self._entries())
+        if self._total_bytes > max_bytes:
+            self.evict()
+
+    def _entries(self):
+        """Returns (mtime, size, path) of every entry of the cache."""
+        entries = []
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return entries
+        for name in names:
+            if not name.endswith(CACHE_FILE_SUFFIX):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _path(self, content_digest, settings, representation):
+        key = hashlib.sha1('\0'.join([content_digest,
+                                      str(CACHE_FORMAT_VERSION),
+                                      str(bench_util.PARSER_VERSION),
+                                      str(representation),
+                                      repr(sorted((settings or {}).items()))]))
+        return os.path.join(self.cache_dir,
+                            key.hexdigest() + CACHE_FILE_SUFFIX)
+
+    def _parse_cached(self, path, parser, settings, lines, representation):
+        data_points = self._load(path)
+        if data_points is None:
+            data_points = parser(settings, lines, representation)
+            self._store(path, data_points)
+        return data_points
+
+    def parse(self, settings, content, representation=None):
+        """Returns bench_util.parse(settings, content lines, representation),
+        from the cache when possible.
+
+        content: the whole text of a bench log.
+        """
+        path = self._path(hashlib.sha1(content).hexdigest(), settings,
+                          representation)
+        return self._parse_cached(path, bench_util.parse, settings,
+                                  content.splitlines(True), representation)
+
+    def parse_file(self, path, settings, representation=None):
+        """Like parse(), for the bench log at path. The log is hashed and, on a
+        cache miss, parsed without reading it into memory as a whole. Files
+        ending with bench_util.JSON_FILE_SUFFIX are parsed as nanobench JSON.
+        """
+        if path.endswith(bench_util.JSON_FILE_SUFFIX):
+            parser = bench_util.parse_json
+        else:
+            parser = bench_util.parse
+        content_digest = hashlib.sha1()
+        with open(path, 'r') as file_handle:
+            for chunk in iter(lambda: file_handle.read(READ_CHUNK_BYTES), ''):
+                content_digest.update(chunk)
+            file_handle.seek(0)
+            return self._parse_cached(
+                self._path(content_digest.hexdigest(), settings,
+                           representation),
+                parser, settings, file_handle, representation)
+
+    def _load(self, path):
+        try:
+            with open(path, 'rb') as file_handle:
+                entry = marshal.load(file_handle)
+        except (IOError, EOFError, ValueError, TypeError):
+            return None
+        try:
+            os.utime(path, None)  # Marks the entry as recently used.
+        except OSError:
+            pass
+        settings_table, rows = entry
+        data_points = []
+        for (bench, config, time_type, time, settings_id, tile_layout,
+             per_tile_values, per_iter_time) in rows:
+            data_points.append(bench_util.BenchDataPoint(
+                bench, config, time_type, time, settings_table[settings_id],
+                tile_layout, array('d', per_tile_values).tolist(),
+                array('d', per_iter_time).tolist()))
+        return data_points
+
+    def _store(self, path, data_points):
+        settings_table = []
+        settings_ids = {}  # id(settings) -> index into settings_table
+        rows = []
+        for point in data_points:
+            settings_id = settings_ids.get(id(point.settings))
+            if settings_id is None:
+                settings_id = settings_ids[id(point.settings)] = len(
+                    settings_table)
+                settings_table.append(point.settings)
+            rows.append((point.bench, point.config, point.time_type,
+                         point.time, settings_id, point.tile_layout,
+                         array('d', point.per_tile_values).tostring(),
+                         array('d', point.per_iter_time).tostring()))
+        temp_path = None
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            # Writes to a temporary file first so that concurrent readers
+            # never see a partial entry.
+            fd, temp_path = tempfile.mkstemp('.tmp', dir=self.cache_dir)
+            with os.fdopen(fd, 'wb') as file_handle:
+                marshal.dump((settings_table, rows), file_handle)
+                entry_bytes = file_handle.tell()
+            os.rename(temp_path, path)
+        except (OSError, IOError, ValueError):
+            # A cache that cannot be written only costs speed.
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        self._total_bytes += entry_bytes
+        if self._total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Removes least recently used entries until under
+        EVICTION_TARGET_RATIO of max_bytes."""
+        entries = self._entries()
+        total_bytes = sum(size for _, size, _ in entries)
+        target_bytes = self.max_bytes * EVICTION_TARGET_RATIO
+        entries.sort()
+        for _, size, path in entries:
+            if total_bytes <= target_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_bytes -= size
+        self._total_bytes = total_bytes
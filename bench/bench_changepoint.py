@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# Copyright (c) 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+'''
+Incremental change-point detection over bench histories.
+
+check_bench_regressions.py compares a revision against static ranges.
+ChangePointDetector instead follows every bench over successive revisions
+with a two-sided CUSUM and reports the first revision of each step in its
+time. The state of a bench is a handful of numbers in array('d') columns, so
+appending a revision costs O(1) per bench however long the history is.
+
+For each bench, a baseline mean and standard deviation are estimated from the
+revisions since the last change point. Each new value is standardized
+against the baseline, z = (value - mean) / sigma, and accumulated in
+  upper = max(0, upper + z - drift)
+  lower = max(0, lower - z - drift)
+A sum exceeding threshold signals a step up or down. The step is placed at
+the revision where that sum last left zero, and the baseline then restarts
+at the mean of the values since that revision.
+'''
+
+import argparse
+import bench_cache
+import bench_util
+import math
+
+from array import array
+
+# Allowed drift of values from the baseline before it counts towards a step,
+# in baseline standard deviations.
+DEFAULT_DRIFT = 1.0
+
+# Cumulative standardized deviation that signals a step.
+DEFAULT_THRESHOLD = 8.0
+
+# Revisions needed for a baseline before steps are looked for. Its standard
+# deviation takes at least two.
+DEFAULT_MIN_SAMPLES = 10
+MIN_SAMPLES_LOWER_BOUND = 2
+
+# Lower bound of the baseline standard deviation, relative to its mean, so
+# that benches with very stable times do not flag tiny changes.
+MIN_RELATIVE_SIGMA = 0.01
+
+STEP_UP = 1
+STEP_DOWN = -1
+
+
+class ChangePointDetector(object):
+    """Two-sided CUSUM change-point detector for many benches at once.
+
+    Benches are identified by arbitrary keys, e.g. (bench, config, time_type),
+    mapped to indexes into the state columns. Detected change points are
+    tuples of (key, revision, direction, mean_before, mean_after), where
+    revision is the first revision after the step, direction is STEP_UP or
+    STEP_DOWN, and mean_after is the mean of the values from revision to the
+    detection.
+    """
+    def __init__(self, drift=DEFAULT_DRIFT, threshold=DEFAULT_THRESHOLD,
+                 min_samples=DEFAULT_MIN_SAMPLES):
+        if min_samples < MIN_SAMPLES_LOWER_BOUND:
+            raise ValueError('min_samples must be at least %d, got %d' % (
+                MIN_SAMPLES_LOWER_BOUND, min_samples))
+        self.drift = drift
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.keys = []
+        self.indexes = {}  # key -> index into the state columns
+        self.change_points = []
+        # Baseline count, mean and sum of squared deviations (Welford).
+        self._count = array('d')
+        self._mean = array('d')
+        self._m2 = array('d')
+        # Upper and lower cumulative sums, with the revision at which each
+        # last left zero and the count and sum of the values since then.
+        self._upper = array('d')
+        self._lower = array('d')
+        self._upper_start = []
+        self._lower_start = []
+        self._upper_count = array('d')
+        self._lower_count = array('d')
+        self._upper_sum = array('d')
+        self._lower_sum = array('d')
+
+    def __len__(self):
+        return len(self.keys)
+
+    def index(self, key):
+        """Returns the index of the bench key, adding it if new."""
+        index = self.indexes.get(key)
+        if index is None:
+            index = self.indexes[key] = len(self.keys)
+            self.keys.append(key)
+            for column in (self._count, self._mean, self._m2, self._upper,
+                           self._lower, self._upper_count, self._lower_count,
+                           self._upper_sum, self._lower_sum):
+                column.append(0.0)
+            self._upper_start.append(None)
+            self._lower_start.append(None)
+        return index
+
+    def _reset(self, index, mean):
+        """Restarts the baseline of a bench at mean after a step. Its spread is
+        estimated anew, from min_samples values, before looking for steps."""
+        self._count[index] = 1
+        self._mean[index] = mean
+        self._m2[index] = 0.0
+        self._upper[index] = self._lower[index] = 0.0
+        self._upper_start[index] = self._lower_start[index] = None
+        self._upper_count[index] = self._lower_count[index] = 0.0
+        self._upper_sum[index] = self._lower_sum[index] = 0.0
+
+    def append(self, index, revision, value):
+        """Adds the value of the bench at index at revision, which must follow
+        the revisions added before.
+
+        Returns the change point detected, or None.
+        """
+        count = self._count[index]
+        mean = self._mean[index]
+        if count >= self.min_samples:
+            sigma = max(math.sqrt(self._m2[index] / (count - 1)),
+                        MIN_RELATIVE_SIGMA * abs(mean))
+            if sigma > 0:
+                z = (value - mean) / sigma
+                change_point = (self._accumulate(index, revision, value, z,
+                                                 True) or
+                                self._accumulate(index, revision, value, -z,
+                                                 False))
+                if change_point:
+                    self.change_points.append(change_point)
+                    return change_point
+        # Welford update of the baseline.
+        count += 1
+        delta = value - mean
+        mean += delta / count
+        self._count[index] = count
+        self._mean[index] = mean
+        self._m2[index] += delta * (value - mean)
+        return None
+
+    def _accumulate(self, index, revision, value, z, upper):
+        """Updates the upper (or lower) sum with standardized deviation z."""
+        if upper:
+            sums, starts = self._upper, self._upper_start
+            counts, totals = self._upper_count, self._upper_sum
+        else:
+            sums, starts = self._lower, self._lower_start
+            counts, totals = self._lower_count, self._lower_sum
+        total = sums[index] + z - self.drift
+        if total <= 0:
+            sums[index] = 0.0
+            starts[index] = None
+            counts[index] = totals[index] = 0.0
+            return None
+        if starts[index] is None:
+            starts[index] = revision
+        sums[index] = total
+        counts[index] += 1
+        totals[index] += value
+        if total <= self.threshold:
+            return None
+        change_point = (self.keys[index], starts[index],
+                        STEP_UP if upper else STEP_DOWN, self._mean[index],
+                        totals[index] / counts[index])
+        self._reset(index, change_point[4])
+        return change_point
+
+    def append_revision(self, revision, values):
+        """Adds the values of all benches at revision.
+
+        values: a sequence of values aligned with the bench indexes, with None
+          or NaN for benches without a value at revision, or a dictionary
+          mapping bench keys to values, adding new keys as needed.
+
+        Returns the list of change points detected at this revision.
+        """
+        if isinstance(values, dict):
+            items = ((self.index(key), value)
+                     for key, value in values.iteritems())
+        else:
+            items = enumerate(values)
+        detected = []
+        append = self.append
+        for index, value in items:
+            if value is not None and value == value:  # NaN != NaN
+                change_point = append(index, revision, value)
+                if change_point:
+                    detected.append(change_point)
+        return detected
+
+
+def iter_revision_values(directory, revisions, representation,
+                         processes=1, cache=None):
+    """Yields (revision, values) of each revision with bench data, where values
+    maps (bench, config, time_type) to the representation value of the bench,
+    as parsed by bench_util.parse_skp_bench_data().
+    """
+    for revision in revisions:
+        values = {}
+        for point in bench_util.parse_skp_bench_data(
+                directory, revision, representation,
+                store=bench_util.BenchDataStore(), processes=processes,
+                cache=cache):
+            values[(point.bench, point.config, point.time_type)] = point.time
+        if values:
+            yield (revision, values)
+
+
+def _min_samples(text):
+    """argparse type of --min_samples."""
+    min_samples = int(text)
+    if min_samples < MIN_SAMPLES_LOWER_BOUND:
+        raise argparse.ArgumentTypeError('must be at least %d' %
+                                         MIN_SAMPLES_LOWER_BOUND)
+    return min_samples
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Finds the revisions at which bench times stepped up or '
+                    'down.')
+    parser.add_argument(
+        '-d', '--input_dir', required=True,
+        help='a directory containing bench data files of all revisions.')
+    parser.add_argument(
+        '-r', '--revisions', required=True,
+        help='comma-separated revisions to analyze, oldest first.')
+    parser.add_argument(
+        '-a', '--representation_alg', default='25th',
+        help='bench representation algorithm to use, see bench_util.py.')
+    parser.add_argument(
+        '--drift', type=float, default=DEFAULT_DRIFT,
+        help='allowed drift from the baseline in standard deviations.')
+    parser.add_argument(
+        '--threshold', type=float, default=DEFAULT_THRESHOLD,
+        help='cumulative deviation in standard deviations that signals a '
+             'step.')
+    parser.add_argument(
+        '--min_samples', type=_min_samples, default=DEFAULT_MIN_SAMPLES,
+        help='revisions needed for a baseline before detecting steps, at '
+             'least %d.' % MIN_SAMPLES_LOWER_BOUND)
+    parser.add_argument(
+        '-j', '--processes', type=int, default=1,
+        help='the number of processes used to parse bench data files.')
+    parser.add_argument(
+        '--no-cache', action='store_true',
+        help='do not use or update the parsed bench data cache.')
+    args = parser.parse_args()
+
+    detector = ChangePointDetector(args.drift, args.threshold,
+                                   args.min_samples)
+    cache = None if args.no_cache else bench_cache.BenchCache()
+    for revision, values in iter_revision_values(
+            args.input_dir, args.revisions.split(','),
+            args.representation_alg, args.processes, cache):
+        detector.append_revision(revision, values)
+
+    for (bench, config, time_type), revision, direction, before, after in (
+            detector.change_points):
+        print '%s_%s_%s: step %s at %s, %.2f -> %.2f' % (
+            bench, config, time_type, 'up' if direction == STEP_UP else 'down',
+            revision, before, after)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/python
+
+# Copyright 2015 Google Inc.
+#
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+Test bench_changepoint.
+"""
+
+import bench_changepoint
+import random
+import unittest
+
+
+def noisy_series(levels, seed=0):
+    """Returns values around each of levels, given as (count, mean) tuples."""
+    rand = random.Random(seed)
+    values = []
+    for count, mean in levels:
+        values.extend(rand.gauss(mean, mean * 0.01) for _ in range(count))
+    return values
+
+
+def detect(values, **kwargs):
+    detector = bench_changepoint.ChangePointDetector(**kwargs)
+    index = detector.index('bench')
+    for revision, value in enumerate(values):
+        detector.append(index, revision, value)
+    return detector.change_points
+
+
+class ChangePointDetectorTest(unittest.TestCase):
+
+    def test_no_step(self):
+        self.assertEqual(detect(noisy_series([(500, 100.0)])), [])
+
+    def test_step_up(self):
+        [(key, revision, direction, before, after)] = detect(
+            noisy_series([(30, 100.0), (20, 130.0)]))
+        self.assertEqual(key, 'bench')
+        self.assertEqual(revision, 30)
+        self.assertEqual(direction, bench_changepoint.STEP_UP)
+        self.assertAlmostEqual(before, 100.0, delta=2.0)
+        self.assertAlmostEqual(after, 130.0, delta=5.0)
+
+    def test_step_down_after_step_up(self):
+        change_points = detect(
+            noisy_series([(30, 100.0), (30, 130.0), (30, 80.0)]))
+        self.assertEqual([direction for _, _, direction, _, _ in change_points],
+                         [bench_changepoint.STEP_UP,
+                          bench_changepoint.STEP_DOWN])
+        # A sum may leave zero on noise just before the step.
+        for (_, revision, _, _, _), step in zip(change_points, (30, 60)):
+            self.assertTrue(step - 1 <= revision <= step)
+
+    def test_constant_values(self):
+        # The baseline spread is zero; MIN_RELATIVE_SIGMA keeps the step
+        # detectable.
+        change_points = detect([10.0] * 20 + [12.0] * 20)
+        self.assertEqual([revision for _, revision, _, _, _ in change_points],
+                         [20])
+        self.assertEqual(detect([0.0] * 40), [])
+
+    def test_min_samples(self):
+        self.assertEqual(detect([100.0, 200.0] * 5, min_samples=20), [])
+        self.assertEqual(
+            [revision for _, revision, _, _, _ in detect(
+                [100.0, 101.0, 100.0] + [150.0] * 5, min_samples=2)],
+            [3])
+        for min_samples in (-1, 0, 1):
+            self.assertRaises(ValueError,
+                              bench_changepoint.ChangePointDetector,
+                              min_samples=min_samples)
+
+    def test_append_revision(self):
+        series = {'a': noisy_series([(30, 100.0), (20, 150.0)], seed=1),
+                  'b': noisy_series([(50, 10.0)], seed=2),
+                  'c': noisy_series([(40, 50.0), (10, 30.0)], seed=3)}
+        detector = bench_changepoint.ChangePointDetector()
+        detected = []
+        for revision in range(50):
+            values = dict((key, values[revision])
+                          for key, values in series.iteritems())
+            if revision % 7 == 0:
+                values['b'] = float('nan')
+            if revision % 5 == 0:
+                del values['c']
+            detected.extend(detector.append_revision(revision, values))
+        self.assertEqual(sorted(detector.keys), ['a', 'b', 'c'])
+        self.assertEqual(sorted(detected), sorted(detector.change_points))
+        self.assertEqual(
+            sorted((key, revision, direction)
+                   for key, revision, direction, _, _ in detected),
+            [('a', 30, bench_changepoint.STEP_UP),
+             # 'c' has no value at revision 40.
+             ('c', 41, bench_changepoint.STEP_DOWN)])
+
+    def test_aligned_values(self):
+        detector = bench_changepoint.ChangePointDetector(min_samples=3)
+        for key in ('a', 'b'):
+            detector.index(key)
+        for revision in range(5):
+            self.assertEqual(
+                detector.append_revision(revision, [10.0, None]), [])
+        self.assertEqual(
+            [key for key, _, _, _, _ in
+             detector.append_revision(5, [20.0, 20.0])],
+            ['a'])
+
+
+if __name__ == '__main__':
+    unittest.main()
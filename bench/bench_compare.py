@@ -6,13 +6,22 @@ Created on May 16, 2011
 '''
 import sys
 import getopt
+import glob
+import multiprocessing
+import bench_stats
 import bench_util
 
+from array import array
+
 def usage():
     """Prints simple usage information."""
 
     print '-o <file> the old bench output file.'
     print '-n <file> the new bench output file.'
+    print '   -o and -n can be repeated and take glob patterns. Per-iteration'
+    print '   times of each bench are then pooled across all files of a side.'
+    print '-j <processes> number of processes loading multiple files.'
+    print '   Defaults to 1.'
     print '-h causes headers to be output.'
     print '-s <stat> the type of statistical analysis used'
     print '   Not specifying is the same as -s "avg".'
@@ -20,8 +29,12 @@ def usage():
     print '  min: minimum of all data points'
     print '  med: median of all data points'
     print '  25th: twenty-fifth percentile for all data points'
+    print '  75th: seventy-fifth percentile for all data points'
+    print '  90th: ninetieth percentile for all data points'
+    print '  trim: average without the lowest and highest 10% of data points'
     print '-f <fieldSpec> which fields to output and in what order.'
-    print '   Not specifying is the same as -f "bctondp".'
+    print '   Not specifying is the same as -f "bctondp", or -f "bctondpvlu"'
+    print '   with --stat-test.'
     print '  b: bench'
     print '  c: config'
     print '  t: time type'
@@ -29,53 +42,184 @@ def usage():
     print '  n: new time'
     print '  d: diff'
     print '  p: percent diff'
+    print '  v: p-value of the difference (needs --stat-test)'
+    print '  l: lower bound of the old - new time shift (needs --stat-test)'
+    print '  u: upper bound of the old - new time shift (needs --stat-test)'
     print '-t use tab delimited format for output.'
+    print '-u output rows unsorted, as soon as they are compared.'
     print '--match <bench> only matches benches which begin with <bench>.'
+    print '--missing also lists benches found in only one of the files.'
+    print '--stat-test tests the per-iteration times of each bench for a'
+    print '   significant difference (Mann-Whitney U), and estimates a 95%'
+    print '   confidence interval of the time shift (Hodges-Lehmann). Adds'
+    print '   "vlu" to the default fields.'
+
+def _BenchKey(point):
+    """Returns the (bench, config, time_type) key matching data points."""
+    return (point.bench, point.config, point.time_type)
+
+def _DiffRow(key, old_time, new_time):
+    """Returns one output row: (diffp, bench, config, time_type, old_time,
+    new_time, diff). Rows sort by percent difference, then by key."""
+    diff = old_time - new_time
+    diffp = 0
+    if old_time != 0:
+        diffp = diff / old_time
+    return (diffp,) + key + (old_time, new_time, diff)
+
+def _StatColumns(old_samples, new_samples):
+    """Returns (p-value, shift lower bound, shift upper bound) comparing the
+    per-iteration samples, or Nones if either side has no samples, as is the
+    case for per-tile benches."""
+    interval = bench_stats.hodges_lehmann_interval(old_samples, new_samples)
+    if interval is None:
+        return (None, None, None)
+    _, p_value = bench_stats.mann_whitney_u(old_samples, new_samples)
+    return (p_value, interval[1], interval[2])
+
+def index_benches(points, match_bench=None, keep_samples=False):
+    """Indexes data points by (bench, config, time_type).
+
+    Only the first point of each key is kept, and only benches beginning with
+    match_bench if given. Returns {(bench, config, time_type): (time, samples)}
+    where samples is an array of the per-iteration times if keep_samples is
+    set, or None."""
+    index = {}
+    for point in points:
+        if match_bench and not point.bench.startswith(match_bench):
+            continue
+        key = _BenchKey(point)
+        if key not in index:
+            samples = None
+            if keep_samples:
+                samples = array('d', point.per_iter_time)
+            index[key] = (point.time, samples)
+    return index
+
+def iter_diff_rows(old_points, new_index, match_bench=None, unmatched=None,
+                   stat_test=False):
+    """Yields a row (see _DiffRow) for each old point with a new counterpart.
+
+    old_points is consumed as it is iterated, so it can be a stream such as
+    bench_util.iter_parse(). Keys matched are removed from new_index, leaving
+    the added benches there; keys of old points without a new counterpart are
+    appended to the unmatched list if given. If stat_test is set, rows are
+    extended with the columns of _StatColumns(); new_index must then hold
+    samples."""
+    seen = set()
+    for old_point in old_points:
+        #filter benches by the match criteria
+        if match_bench and not old_point.bench.startswith(match_bench):
+            continue
+        key = _BenchKey(old_point)
+        if key in seen:
+            continue
+        seen.add(key)
+        new_entry = new_index.pop(key, None)
+        if new_entry is None:
+            if unmatched is not None:
+                unmatched.append(key)
+            continue
+        new_time, new_samples = new_entry
+        row = _DiffRow(key, old_point.time, new_time)
+        if stat_test:
+            row += _StatColumns(old_point.per_iter_time, new_samples)
+        yield row
+
+def _AccumulateFile(args):
+    """Collects the samples of one bench file. Runs in pool workers, so takes
+    one tuple.
 
-class BenchDiff:
-    """A compare between data points produced by bench.
-
-    (BenchDataPoint, BenchDataPoint)"""
-    def __init__(self, old, new):
-        self.old = old
-        self.new = new
-        self.diff = old.time - new.time
-        diffp = 0
-        if old.time != 0:
-            diffp = self.diff / old.time
-        self.diffp = diffp
-
-    def __repr__(self):
-        return "BenchDiff(%s, %s)" % (
-                   str(self.new),
-                   str(self.old),
-               )
+    args: tuple of (file path, stat type, match_bench).
+    Returns {(bench, config, time_type): array of samples}. Samples are the
+    per-iteration times, or the bench time of per-tile benches, which have
+    none.
+    """
+    path, stat_type, match_bench = args
+    samples = {}
+    with open(path, 'r') as file_handle:
+        for point in bench_util.iter_parse({}, file_handle, stat_type):
+            if match_bench and not point.bench.startswith(match_bench):
+                continue
+            samples.setdefault(_BenchKey(point), array('d')).extend(
+                point.per_iter_time or [point.time])
+    return samples
+
+def _MergeSamples(file_samples):
+    pooled = {}
+    for samples in file_samples:
+        for key, values in samples.iteritems():
+            if key in pooled:
+                pooled[key].extend(values)
+            else:
+                pooled[key] = values
+    return pooled
+
+def accumulate_samples(paths, stat_type, match_bench=None, processes=1):
+    """Pools the samples of each (bench, config, time_type) over many files.
+
+    Files are read by up to processes workers. Only one accumulator per key is
+    kept, and samples are appended in the order of paths.
+    Returns {(bench, config, time_type): array of samples}."""
+    jobs = [(path, stat_type, match_bench) for path in paths]
+    if processes > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(processes, len(jobs)))
+        try:
+            file_samples = pool.imap(_AccumulateFile, jobs)
+            pooled = _MergeSamples(file_samples)
+        finally:
+            pool.close()
+            pool.join()
+        return pooled
+    return _MergeSamples(_AccumulateFile(job) for job in jobs)
+
+def iter_pooled_points(pooled, stat_type):
+    """Yields a BenchDataPoint per key of pooled samples, with the time
+    computed over all of them, in key order."""
+    for key in sorted(pooled):
+        samples = pooled[key]
+        time = bench_util.compute_representations(
+            samples, [0, len(samples)], stat_type)[0]
+        yield bench_util.BenchDataPoint(key[0], key[1], key[2], time, {},
+                                        per_iter_time=samples.tolist())
+
+def _ExpandPaths(patterns):
+    """Expands glob patterns, keeping patterns matching no file as is."""
+    paths = []
+    for pattern in patterns:
+        paths.extend(sorted(glob.glob(pattern)) or [pattern])
+    return paths
 
 def main():
     """Parses command line and writes output."""
 
     try:
-        opts, _ = getopt.getopt(sys.argv[1:], "f:o:n:s:ht", ['match='])
+        opts, _ = getopt.getopt(sys.argv[1:], "f:o:n:s:j:htu",
+                                ['match=', 'missing', 'stat-test'])
     except getopt.GetoptError, err:
         print str(err) 
         usage()
         sys.exit(2)
 
-    old = None
-    new = None
+    old = []
+    new = []
     column_format = ""
     header_format = ""
-    columns = 'bctondp'
+    columns = None
     header = False
     stat_type = "avg"
     use_tabs = False
     match_bench = None;
+    unsorted = False
+    show_missing = False
+    stat_test = False
+    processes = 1
 
     for option, value in opts:
         if option == "-o":
-            old = value
+            old.append(value)
         elif option == "-n":
-            new = value
+            new.append(value)
         elif option == "-h":
             header = True
         elif option == "-f":
@@ -84,34 +228,47 @@ def main():
             stat_type = value
         elif option == "-t":
             use_tabs = True
+        elif option == "-j":
+            processes = int(value)
+        elif option == "-u":
+            unsorted = True
         elif option == "--match":
             match_bench = value
+        elif option == "--missing":
+            show_missing = True
+        elif option == "--stat-test":
+            stat_test = True
         else:
             usage()
             assert False, "unhandled option"
 
-    if old is None or new is None:
+    if not old or not new:
         usage()
         sys.exit(2)
 
-    old_benches = bench_util.parse({}, open(old, 'r'), stat_type)
-    new_benches = bench_util.parse({}, open(new, 'r'), stat_type)
-
-    bench_diffs = []
-    for old_bench in old_benches:
-        #filter benches by the match criteria
-        if match_bench and not old_bench.bench.startswith(match_bench):
-            continue
+    if columns is None:
+        columns = 'bctondpvlu' if stat_test else 'bctondp'
+    if not stat_test and set(columns) & set('vlu'):
+        usage()
+        sys.exit(2)
 
-        #filter new_benches for benches that match old_bench
-        new_bench_match = [bench for bench in new_benches
-            if old_bench.bench == bench.bench and
-               old_bench.config == bench.config and
-               old_bench.time_type == bench.time_type
-        ]
-        if (len(new_bench_match) < 1):
-            continue
-        bench_diffs.append(BenchDiff(old_bench, new_bench_match[0]))
+    old = _ExpandPaths(old)
+    new = _ExpandPaths(new)
+    if len(old) == 1 and len(new) == 1:
+        # Only the new side is indexed; the old side is streamed against it.
+        new_points = bench_util.iter_parse({}, open(new[0], 'r'), stat_type)
+        old_points = bench_util.iter_parse({}, open(old[0], 'r'), stat_type)
+    else:
+        new_points = iter_pooled_points(accumulate_samples(
+            new, stat_type, match_bench, processes), stat_type)
+        old_points = iter_pooled_points(accumulate_samples(
+            old, stat_type, match_bench, processes), stat_type)
+    new_index = index_benches(new_points, match_bench, stat_test)
+    removed = []
+    diff_rows = iter_diff_rows(old_points, new_index, match_bench, removed,
+                               stat_test)
+    if not unsorted:
+        diff_rows = sorted(diff_rows)
 
     if use_tabs:
         column_formats = {
@@ -122,6 +279,9 @@ def main():
             'n' : '{new_time: 0.2f}\t',
             'd' : '{diff: 0.2f}\t',
             'p' : '{diffp: 0.1%}\t',
+            'v' : '{p_value}\t',
+            'l' : '{shift_lower}\t',
+            'u' : '{shift_upper}\t',
         }
         header_formats = {
             'b' : '{bench}\t',
@@ -131,10 +291,19 @@ def main():
             'n' : '{new_time}\t',
             'd' : '{diff}\t',
             'p' : '{diffp}\t',
+            'v' : '{p_value}\t',
+            'l' : '{shift_lower}\t',
+            'u' : '{shift_upper}\t',
         }
     else:
-        bench_max_len = max(map(lambda b: len(b.old.bench), bench_diffs))
-        config_max_len = max(map(lambda b: len(b.old.config), bench_diffs))
+        # Streamed rows are not known in advance, but every row matches a key
+        # of the new side, so its widths bound theirs.
+        if unsorted:
+            width_keys = new_index.keys()
+        else:
+            width_keys = [row[1:4] for row in diff_rows]
+        bench_max_len = max([len(key[0]) for key in width_keys] or [0])
+        config_max_len = max([len(key[1]) for key in width_keys] or [0])
         column_formats = {
             'b' : '{bench: >%d} ' % (bench_max_len),
             'c' : '{config: <%d} ' % (config_max_len),
@@ -143,6 +312,9 @@ def main():
             'n' : '{new_time: >10.2f} ',
             'd' : '{diff: >+10.2f} ',
             'p' : '{diffp: >+8.1%} ',
+            'v' : '{p_value: >8} ',
+            'l' : '{shift_lower: >10} ',
+            'u' : '{shift_upper: >10} ',
         }
         header_formats = {
             'b' : '{bench: >%d} ' % (bench_max_len),
@@ -152,6 +324,9 @@ def main():
             'n' : '{new_time: >10} ',
             'd' : '{diff: >10} ',
             'p' : '{diffp: >8} ',
+            'v' : '{p_value: >8} ',
+            'l' : '{shift_lower: >10} ',
+            'u' : '{shift_upper: >10} ',
         }
 
     for column_char in columns:
@@ -171,23 +346,41 @@ def main():
             , new_time='new'
             , diff='diff'
             , diffp='diffP'
+            , p_value='p'
+            , shift_lower='shiftLo'
+            , shift_upper='shiftHi'
         )
 
-    bench_diffs.sort(key=lambda d : [d.diffp,
-                                     d.old.bench,
-                                     d.old.config,
-                                     d.old.time_type,
-                                    ])
-    for bench_diff in bench_diffs:
+    for row in diff_rows:
+        (diffp, bench, config, time_type, old_time, new_time, diff) = row[:7]
+        # Statistics are preformatted as they are missing for some benches.
+        stats = row[7:] or (None, None, None)
+        (p_value, shift_lower, shift_upper) = [
+            '-' if stat is None else fmt % stat
+            for fmt, stat in zip(['%.4f', '%+.2f', '%+.2f'], stats)]
         print column_format.format(
-            bench=bench_diff.old.bench.strip()
-            , config=bench_diff.old.config.strip()
-            , time_type=bench_diff.old.time_type
-            , old_time=bench_diff.old.time
-            , new_time=bench_diff.new.time
-            , diff=bench_diff.diff
-            , diffp=bench_diff.diffp
+            bench=bench.strip()
+            , config=config.strip()
+            , time_type=time_type
+            , old_time=old_time
+            , new_time=new_time
+            , diff=diff
+            , diffp=diffp
+            , p_value=p_value
+            , shift_lower=shift_lower
+            , shift_upper=shift_upper
         )
 
+    if show_missing:
+        # Matched keys were popped from new_index while comparing.
+        for title, keys in [('Removed benches (only in old file):', removed),
+                            ('Added benches (only in new file):',
+                             new_index.keys())]:
+            if keys:
+                print
+                print title
+                for key in sorted(keys):
+                    print '  %s %s %s' % key
+
 if __name__ == "__main__":
     main()
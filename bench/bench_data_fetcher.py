@@ -0,0 +1,326 @@
+'''
+Concurrent, resumable fetching of bench data files.
+
+gen_bench_expectations.py backfills bench_<commit>_data_<suffix> files of many
+commits. BenchDataFetcher downloads them with a bounded pool of threads, each
+reusing one keep-alive connection per host. Files are written to a '.part'
+file that is renamed into place once complete, so an interrupted run never
+leaves a truncated data file behind and the next run resumes the partial one.
+
+Files that the server fails to serve, e.g. with a 403 or 5xx status or a
+dropped connection, are reported as warnings and count as not downloaded, as
+missing files do, so one bad file does not abort a batch. Only local errors,
+such as a full disk, are raised.
+
+Where files come from is up to a backend:
+  HttpBackend:           files served over HTTP(S), e.g. Google Storage.
+  LocalDirectoryBackend: files under <root>/<builder>/, e.g. a local mirror.
+LocalBenchServer serves such a directory over HTTP, with keep-alive and Range
+support, to exercise HttpBackend without network access.
+'''
+
+import BaseHTTPServer
+import httplib
+import os
+import Queue
+import shutil
+import SocketServer
+import sys
+import threading
+import urlparse
+
+# URL of bench data files, formatted with the builder and file name.
+GS_URL_FORMAT = 'http://storage.googleapis.com/chromium-skia-gm/perfdata/%s/%s'
+
+DEFAULT_NUM_THREADS = 8
+
+# Size of the chunks in which files are copied.
+CHUNK_BYTES = 64 * 1024
+
+PART_SUFFIX = '.part'
+
+# Seconds to wait on a stalled connection.
+TIMEOUT_SECONDS = 60
+
+
+class FetchError(Exception):
+  """A file could not be fetched from its server; local errors are raised
+  as they are."""
+  pass
+
+
+class KeepAliveConnections(object):
+  """Persistent HTTP(S) connections of many threads.
+
+  Each thread keeps one connection per host, which is reopened once if the
+  server closed it between requests. Also used by
+  tools/skpdiff/skpdiff_server.py.
+  """
+  def __init__(self, timeout=TIMEOUT_SECONDS):
+    self.timeout = timeout
+    self._local = threading.local()
+
+  def _connection(self, scheme, netloc, reconnect=False):
+    connections = self._local.__dict__.setdefault('connections', {})
+    connection = connections.get((scheme, netloc))
+    if connection is not None and reconnect:
+      connection.close()
+      connection = None
+    if connection is None:
+      if scheme == 'https':
+        connection = httplib.HTTPSConnection(netloc, timeout=self.timeout)
+      else:
+        connection = httplib.HTTPConnection(netloc, timeout=self.timeout)
+      connections[(scheme, netloc)] = connection
+    return connection
+
+  def request(self, url, headers=None):
+    """Sends a GET request for url on the calling thread's connection.
+
+    Returns:
+      the httplib.HTTPResponse, to be read and closed before the next request
+      of the thread to the same host.
+    """
+    url = urlparse.urlsplit(url)
+    path = url.path + ('?' + url.query if url.query else '')
+    for reconnect in (False, True):
+      connection = self._connection(url.scheme, url.netloc, reconnect)
+      try:
+        connection.request('GET', path, headers=headers or {})
+        return connection.getresponse()
+      except (httplib.HTTPException, IOError):
+        if reconnect:
+          raise
+
+
+def _content_range_size(response):
+  """Returns the complete size of the file from the Content-Range header of
+  a response, e.g. 'bytes */1234', or None if it is not given."""
+  content_range = response.getheader('Content-Range', '')
+  size = content_range.rpartition('/')[2]
+  if not content_range.startswith('bytes ') or not size.isdigit():
+    return None
+  return int(size)
+
+
+class HttpBackend(object):
+  """Fetches bench data files over HTTP(S), on KeepAliveConnections."""
+  def __init__(self, url_format=GS_URL_FORMAT, timeout=TIMEOUT_SECONDS):
+    self.url_format = url_format
+    self._connections = KeepAliveConnections(timeout)
+
+  def fetch(self, builder, file_name, dest, offset=0):
+    """Appends the bytes of the file from offset on to dest.
+
+    Returns:
+      the number of bytes the file had before offset, which is less than
+      offset if the server ignored the requested range or dest is not a
+      prefix of the file, and dest needs to be truncated first (this is done
+      here), or None if the file does not exist.
+
+    Raises:
+      FetchError if the server failed to send the file. What was received is
+      kept in dest.
+    """
+    url = self.url_format % (builder, file_name)
+    headers = {}
+    if offset:
+      headers['Range'] = 'bytes=%d-' % offset
+    try:
+      response = self._connections.request(url, headers)
+    except (httplib.HTTPException, IOError) as e:
+      raise FetchError('%s: %s' % (url, e))
+    try:
+      if response.status == httplib.NOT_FOUND:
+        response.read()
+        return None
+      if response.status == httplib.REQUESTED_RANGE_NOT_SATISFIABLE:
+        response.read()
+        if _content_range_size(response) == offset:
+          return offset  # The partial file is already complete.
+        # dest is longer than the file, e.g. the file was replaced since, so
+        # the whole file is fetched again.
+        response.close()
+        dest.seek(0)
+        dest.truncate()
+        return self.fetch(builder, file_name, dest)
+      if response.status == httplib.PARTIAL_CONTENT:
+        start = offset
+      elif response.status == httplib.OK:
+        start = 0
+        dest.seek(0)
+        dest.truncate()
+      else:
+        response.read()
+        raise FetchError('%s: HTTP %d %s' % (url, response.status,
+                                              response.reason))
+      while True:
+        try:
+          chunk = response.read(CHUNK_BYTES)
+        except (httplib.HTTPException, IOError) as e:
+          raise FetchError('%s: %s' % (url, e))
+        if not chunk:
+          return start
+        dest.write(chunk)
+    finally:
+      response.close()
+
+
+class LocalDirectoryBackend(object):
+  """Fetches bench data files from <root>/<builder>/<file name>."""
+  def __init__(self, root):
+    self.root = root
+
+  def fetch(self, builder, file_name, dest, offset=0):
+    """See HttpBackend.fetch()."""
+    path = os.path.join(self.root, builder, file_name)
+    if not os.path.isfile(path):
+      return None
+    if offset > os.path.getsize(path):
+      dest.seek(0)
+      dest.truncate()
+      offset = 0
+    with open(path, 'rb') as source:
+      source.seek(offset)
+      shutil.copyfileobj(source, dest, CHUNK_BYTES)
+    return offset
+
+
+class BenchDataFetcher(object):
+  """Downloads bench data files concurrently through a backend."""
+  def __init__(self, backend, num_threads=DEFAULT_NUM_THREADS):
+    self.backend = backend
+    self.num_threads = num_threads
+
+  def fetch_file(self, builder, file_name, directory):
+    """Downloads one file into directory, resuming a partial download.
+
+    Returns:
+      whether the file was downloaded; False if it already exists in
+      directory or is not available from the backend.
+
+    Raises:
+      FetchError if the backend failed to send the file; the partial file is
+      kept to be resumed.
+    """
+    dest_path = os.path.join(directory, file_name)
+    if os.path.exists(dest_path):
+      return False
+    part_path = dest_path + PART_SUFFIX
+    with open(part_path, 'ab+') as dest:
+      dest.seek(0, os.SEEK_END)
+      if self.backend.fetch(builder, file_name, dest, dest.tell()) is None:
+        found = False
+      else:
+        found = True
+    if not found:
+      os.remove(part_path)
+      return False
+    os.rename(part_path, dest_path)
+    return True
+
+  def fetch(self, requests):
+    """Downloads files concurrently.
+
+    Args:
+      requests: a list of (builder, file name, directory) tuples.
+
+    Returns:
+      a list of booleans, whether each file of requests was downloaded.
+      Files the backend failed to send are printed as warnings and not
+      downloaded.
+
+    Raises:
+      the first local error of a download, after all other downloads
+      finished. Partial files stay in place to be resumed.
+    """
+    results = [False] * len(requests)
+    errors = []
+    queue = Queue.Queue()
+    for index, request in enumerate(requests):
+      queue.put((index, request))
+
+    def worker():
+      while True:
+        try:
+          index, (builder, file_name, directory) = queue.get_nowait()
+        except Queue.Empty:
+          return
+        try:
+          results[index] = self.fetch_file(builder, file_name, directory)
+        except FetchError as e:
+          print >> sys.stderr, 'Warning: skipping %s: %s' % (file_name, e)
+        except Exception as e:
+          errors.append(e)
+
+    threads = [threading.Thread(target=worker)
+               for _ in xrange(min(self.num_threads, len(requests)))]
+    for thread in threads:
+      thread.daemon = True
+      thread.start()
+    for thread in threads:
+      thread.join()
+    if errors:
+      raise errors[0]
+    return results
+
+
+class _BenchRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'  # Keeps connections alive.
+
+  def do_GET(self):
+    path = os.path.join(self.server.root,
+                        *urlparse.urlsplit(self.path).path.split('/'))
+    if not os.path.isfile(path):
+      self.send_response(httplib.NOT_FOUND)
+      self.send_header('Content-Length', '0')
+      self.end_headers()
+      return
+    size = os.path.getsize(path)
+    start = 0
+    range_header = self.headers.get('Range', '')
+    if range_header.startswith('bytes=') and range_header.endswith('-'):
+      start = int(range_header[len('bytes='):-1])
+      if start >= size:
+        self.send_response(httplib.REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.send_header('Content-Range', 'bytes */%d' % size)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        return
+      self.send_response(httplib.PARTIAL_CONTENT)
+      self.send_header('Content-Range',
+                       'bytes %d-%d/%d' % (start, size - 1, size))
+    else:
+      self.send_response(httplib.OK)
+    self.send_header('Content-Length', str(size - start))
+    self.end_headers()
+    with open(path, 'rb') as source:
+      source.seek(start)
+      shutil.copyfileobj(source, self.wfile, CHUNK_BYTES)
+
+  def log_message(self, *args):
+    pass
+
+
+class LocalBenchServer(SocketServer.ThreadingMixIn,
+                       BaseHTTPServer.HTTPServer):
+  """Serves <root>/<builder>/<file name> on localhost, for tests.
+
+  Use url_format as the url_format of an HttpBackend.
+  """
+  daemon_threads = True
+
+  def __init__(self, root, port=0):
+    BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port),
+                                       _BenchRequestHandler)
+    self.root = root
+    self.url_format = 'http://127.0.0.1:%d/%%s/%%s' % self.server_address[1]
+
+  def start(self):
+    thread = threading.Thread(target=self.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+  def stop(self):
+    self.shutdown()
+    self.server_close()
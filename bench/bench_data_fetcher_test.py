@@ -0,0 +1,147 @@
+#!/usr/bin/python
+
+# Copyright 2015 Google Inc.
+#
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+Test bench_data_fetcher.
+"""
+
+import StringIO
+import bench_data_fetcher
+import httplib
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+
+BUILDER = 'Perf-Ubuntu12-ShuttleA-GTX660-x86-Release'
+
+
+class _FailingRequestHandler(bench_data_fetcher._BenchRequestHandler):
+  """Answers requests for files named 'forbidden*' with a 403."""
+
+  def do_GET(self):
+    if os.path.basename(self.path).startswith('forbidden'):
+      self.send_response(httplib.FORBIDDEN)
+      self.send_header('Content-Length', '0')
+      self.end_headers()
+      return
+    bench_data_fetcher._BenchRequestHandler.do_GET(self)
+
+
+class BenchDataFetcherTest(unittest.TestCase):
+
+  def setUp(self):
+    self._temp_dir = tempfile.mkdtemp()
+    self._root = os.path.join(self._temp_dir, 'root')
+    self._dest = os.path.join(self._temp_dir, 'dest')
+    os.makedirs(os.path.join(self._root, BUILDER))
+    os.makedirs(self._dest)
+    self._server = bench_data_fetcher.LocalBenchServer(self._root)
+    self._server.RequestHandlerClass = _FailingRequestHandler
+    self._server.start()
+    self._fetcher = bench_data_fetcher.BenchDataFetcher(
+        bench_data_fetcher.HttpBackend(self._server.url_format),
+        num_threads=2)
+
+  def tearDown(self):
+    self._server.stop()
+    shutil.rmtree(self._temp_dir)
+
+  def _serve(self, file_name, content):
+    with open(os.path.join(self._root, BUILDER, file_name), 'wb') as f:
+      f.write(content)
+
+  def _read(self, file_name):
+    with open(os.path.join(self._dest, file_name), 'rb') as f:
+      return f.read()
+
+  def _fetch(self, file_names):
+    stderr = sys.stderr
+    sys.stderr = StringIO.StringIO()
+    try:
+      results = self._fetcher.fetch(
+          [(BUILDER, file_name, self._dest) for file_name in file_names])
+      return results, sys.stderr.getvalue()
+    finally:
+      sys.stderr = stderr
+
+  def test_fetch(self):
+    contents = dict(('bench_%d_data' % i, 'x' * (i * 100000))
+                    for i in range(5))
+    for file_name, content in contents.iteritems():
+      self._serve(file_name, content)
+    results, warnings = self._fetch(sorted(contents))
+    self.assertEqual(results, [True] * len(contents))
+    self.assertEqual(warnings, '')
+    for file_name, content in contents.iteritems():
+      self.assertEqual(self._read(file_name), content)
+    # Files already downloaded are not fetched again.
+    self.assertEqual(self._fetch(sorted(contents))[0],
+                     [False] * len(contents))
+
+  def test_missing_file(self):
+    self._serve('bench_a_data', 'a')
+    results, warnings = self._fetch(['bench_missing_data', 'bench_a_data'])
+    self.assertEqual(results, [False, True])
+    self.assertEqual(warnings, '')
+    self.assertEqual(os.listdir(self._dest), ['bench_a_data'])
+
+  def test_server_error_skips_file(self):
+    self._serve('forbidden_data', 'f')
+    self._serve('bench_a_data', 'a')
+    self._serve('bench_b_data', 'b')
+    results, warnings = self._fetch(['bench_a_data', 'forbidden_data',
+                                     'bench_b_data'])
+    self.assertEqual(results, [True, False, True])
+    self.assertTrue('forbidden_data' in warnings)
+    self.assertTrue('403' in warnings)
+    self.assertEqual(self._read('bench_b_data'), 'b')
+
+  def test_resume(self):
+    content = ''.join(chr(i % 256) for i in range(300000))
+    self._serve('bench_a_data', content)
+    with open(os.path.join(self._dest, 'bench_a_data' +
+                           bench_data_fetcher.PART_SUFFIX), 'wb') as f:
+      f.write(content[:123456])
+    self.assertEqual(self._fetch(['bench_a_data'])[0], [True])
+    self.assertEqual(self._read('bench_a_data'), content)
+
+  def test_resume_complete_part(self):
+    self._serve('bench_a_data', 'abc')
+    with open(os.path.join(self._dest, 'bench_a_data' +
+                           bench_data_fetcher.PART_SUFFIX), 'wb') as f:
+      f.write('abc')
+    self.assertEqual(self._fetch(['bench_a_data'])[0], [True])
+    self.assertEqual(self._read('bench_a_data'), 'abc')
+
+  def test_resume_oversized_part(self):
+    # The part is longer than the file, e.g. as the file was replaced.
+    self._serve('bench_a_data', 'abc')
+    with open(os.path.join(self._dest, 'bench_a_data' +
+                           bench_data_fetcher.PART_SUFFIX), 'wb') as f:
+      f.write('abcdef')
+    self.assertEqual(self._fetch(['bench_a_data'])[0], [True])
+    self.assertEqual(self._read('bench_a_data'), 'abc')
+
+  def test_local_directory_backend(self):
+    self._serve('bench_a_data', 'abcdef')
+    with open(os.path.join(self._dest, 'bench_a_data' +
+                           bench_data_fetcher.PART_SUFFIX), 'wb') as f:
+      f.write('abc')
+    fetcher = bench_data_fetcher.BenchDataFetcher(
+        bench_data_fetcher.LocalDirectoryBackend(self._root))
+    self.assertEqual(
+        fetcher.fetch([(BUILDER, 'bench_a_data', self._dest),
+                       (BUILDER, 'bench_missing_data', self._dest)]),
+        [True, False])
+    self.assertEqual(self._read('bench_a_data'), 'abcdef')
+
+
+if __name__ == '__main__':
+  unittest.main()
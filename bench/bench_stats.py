@@ -0,0 +1,149 @@
+'''
+Statistics helpers for comparing bench samples.
+
+Nonparametric methods are used throughout because bench times are skewed and
+often multimodal, so their distributions are far from normal.
+'''
+
+import math
+import random
+
+# Two-sided confidence level of the intervals computed here, and its standard
+# normal quantile.
+CONFIDENCE = 0.95
+Z_CONFIDENCE = 1.959963984540054
+
+# Up to this many pairwise differences, hodges_lehmann_interval() sorts them
+# all, which is fastest for the few samples of a single run. Pooled runs are
+# selected from without materializing the differences.
+MAX_SORTED_DIFFERENCES = 10000
+
+
+def _ranks(values):
+    """Returns the 1-based ranks of values, averaging ranks of ties, and the
+    tie correction term sum(t^3 - t) over groups of t tied values."""
+    order = sorted(range(len(values)), key=values.__getitem__)
+    ranks = [0.0] * len(values)
+    tie_term = 0.0
+    i = 0
+    while i < len(order):
+        j = i
+        while j + 1 < len(order) and values[order[j + 1]] == values[order[i]]:
+            j += 1
+        rank = (i + j) / 2.0 + 1
+        for k in range(i, j + 1):
+            ranks[order[k]] = rank
+        ties = j - i + 1
+        tie_term += ties ** 3 - ties
+        i = j + 1
+    return ranks, tie_term
+
+
+def mann_whitney_u(x, y):
+    """Two-sided Mann-Whitney U test of samples x against samples y.
+
+    Uses the normal approximation with tie and continuity corrections, which
+    is accurate for the 10+ samples a bench usually records.
+
+    Returns (u, p_value), where u is the U statistic of x. p_value is 1.0 when
+    either sample is empty or all values are tied.
+    """
+    n = len(x)
+    m = len(y)
+    if not n or not m:
+        return (0.0, 1.0)
+    ranks, tie_term = _ranks(list(x) + list(y))
+    u = sum(ranks[:n]) - n * (n + 1) / 2.0
+    mean_u = n * m / 2.0
+    total = n + m
+    var_u = n * m / 12.0 * ((total + 1) - tie_term / (total * (total - 1.0)))
+    if var_u <= 0:
+        return (u, 1.0)
+    z = (abs(u - mean_u) - 0.5) / math.sqrt(var_u)
+    return (u, min(1.0, math.erfc(max(z, 0.0) / math.sqrt(2))))
+
+
+def _count_differences_below(x, y, pivot, strict):
+    """Returns, for each x[i], how many x[i] - y[j] are below pivot (or not
+    above it, if not strict), with x sorted and y sorted in decreasing order.
+
+    Differences increase along both x and y, so the counts are found by one
+    walk down y as x increases, in O(n + m).
+    """
+    counts = []
+    j = len(y)
+    for a in x:
+        if strict:
+            while j > 0 and a - y[j - 1] >= pivot:
+                j -= 1
+        else:
+            while j > 0 and a - y[j - 1] > pivot:
+                j -= 1
+        counts.append(j)
+    return counts
+
+
+def _select_difference(x, y, k):
+    """Returns the k-th smallest (0-based) of all pairwise differences
+    x[i] - y[j], with x sorted and y sorted in decreasing order.
+
+    The n * m differences form a matrix sorted along rows and columns, which
+    is searched without building it: each row keeps a window of candidate
+    columns, and a random candidate pivot narrows all windows by its rank.
+    This takes O((n + m) log(n m)) expected time and O(n + m) memory.
+    """
+    low = [0] * len(x)
+    high = [len(y)] * len(x)
+    while True:
+        candidates = sum(high) - sum(low)
+        pick = random.randrange(candidates)
+        for i in xrange(len(x)):
+            width = high[i] - low[i]
+            if pick < width:
+                pivot = x[i] - y[low[i] + pick]
+                break
+            pick -= width
+        below = _count_differences_below(x, y, pivot, True)
+        if k < sum(below):
+            high = [min(h, b) for h, b in zip(high, below)]
+            continue
+        not_above = _count_differences_below(x, y, pivot, False)
+        if k >= sum(not_above):
+            low = [max(l, b) for l, b in zip(low, not_above)]
+            continue
+        return pivot
+
+
+def hodges_lehmann_interval(x, y):
+    """Estimates the shift between samples x and y, i.e. the typical x - y.
+
+    The estimate is the median of all pairwise differences, and the CONFIDENCE
+    interval is read off the sorted differences at the ranks given by the
+    normal approximation of the Mann-Whitney U distribution. Beyond
+    MAX_SORTED_DIFFERENCES, the differences at those ranks are selected in
+    O((n + m) log(n m)) without listing the differences; see
+    _select_difference().
+
+    Returns (estimate, lower_bound, upper_bound), or None if a sample is empty.
+    """
+    n = len(x)
+    m = len(y)
+    if not n or not m:
+        return None
+    count = n * m
+    if count <= MAX_SORTED_DIFFERENCES:
+        diffs = sorted(a - b for a in x for b in y)
+        select = diffs.__getitem__
+    else:
+        sorted_x = sorted(x)
+        sorted_y = sorted(y, reverse=True)
+        select = lambda k: _select_difference(sorted_x, sorted_y, k)
+    if count % 2:
+        estimate = select(count // 2)
+    else:
+        estimate = (select(count // 2 - 1) + select(count // 2)) / 2.0
+    # Number of differences below the interval.
+    c = int(math.floor(n * m / 2.0 - Z_CONFIDENCE *
+                       math.sqrt(n * m * (n + m + 1) / 12.0)))
+    c = max(0, min(c, (count - 1) // 2))
+    return (estimate, select(c), select(count - 1 - c))
@@ -0,0 +1,91 @@
+#!/usr/bin/python
+
+# Copyright 2015 Google Inc.
+#
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+Test bench_stats.
+"""
+
+import bench_stats
+import random
+import unittest
+
+
+class MannWhitneyUTest(unittest.TestCase):
+
+    def test_empty_sample(self):
+        self.assertEqual(bench_stats.mann_whitney_u([], [1.0]), (0.0, 1.0))
+        self.assertEqual(bench_stats.mann_whitney_u([1.0], []), (0.0, 1.0))
+
+    def test_all_tied(self):
+        u, p_value = bench_stats.mann_whitney_u([2.0] * 5, [2.0] * 7)
+        self.assertEqual(u, 17.5)
+        self.assertEqual(p_value, 1.0)
+
+    def test_separated_samples(self):
+        x = [float(i) for i in range(10)]
+        y = [float(i) for i in range(100, 110)]
+        u, p_value = bench_stats.mann_whitney_u(x, y)
+        self.assertEqual(u, 0.0)
+        self.assertTrue(p_value < 0.001)
+
+    def test_same_distribution(self):
+        x = [1.0, 3.0, 5.0, 7.0, 9.0]
+        y = [2.0, 4.0, 6.0, 8.0, 10.0]
+        _, p_value = bench_stats.mann_whitney_u(x, y)
+        self.assertTrue(p_value > 0.5)
+
+
+class HodgesLehmannTest(unittest.TestCase):
+
+    def test_empty_sample(self):
+        self.assertEqual(bench_stats.hodges_lehmann_interval([], [1.0]), None)
+
+    def test_shift(self):
+        x = [10.0, 11.0, 12.0, 13.0, 14.0]
+        y = [v - 3.0 for v in x]
+        estimate, lower, upper = bench_stats.hodges_lehmann_interval(x, y)
+        self.assertEqual(estimate, 3.0)
+        self.assertTrue(lower <= 3.0 <= upper)
+
+    def test_single_values(self):
+        self.assertEqual(bench_stats.hodges_lehmann_interval([5.0], [2.0]),
+                         (3.0, 3.0, 3.0))
+
+    def test_selection_matches_sorting(self):
+        """The selection used for large samples gives exactly the values of
+        sorting all differences, ties included."""
+        rand = random.Random(1)
+        for _ in range(200):
+            x = [round(rand.gauss(10, 2), rand.choice((0, 1, 3)))
+                 for _ in range(rand.randint(1, 30))]
+            y = [round(rand.gauss(11, 2), rand.choice((0, 1, 3)))
+                 for _ in range(rand.randint(1, 30))]
+            diffs = sorted(a - b for a in x for b in y)
+            sorted_x = sorted(x)
+            sorted_y = sorted(y, reverse=True)
+            for k in set([0, len(diffs) // 2, len(diffs) - 1,
+                          rand.randrange(len(diffs))]):
+                self.assertEqual(
+                    bench_stats._select_difference(sorted_x, sorted_y, k),
+                    diffs[k])
+
+    def test_large_samples(self):
+        rand = random.Random(2)
+        x = [rand.gauss(10, 1) for _ in range(200)]
+        y = [rand.gauss(12, 1) for _ in range(200)]
+        self.assertTrue(len(x) * len(y) > bench_stats.MAX_SORTED_DIFFERENCES)
+        diffs = sorted(a - b for a in x for b in y)
+        count = len(diffs)
+        estimate, lower, upper = bench_stats.hodges_lehmann_interval(x, y)
+        self.assertEqual(estimate,
+                         (diffs[count // 2 - 1] + diffs[count // 2]) / 2.0)
+        self.assertTrue(lower < estimate < upper)
+        self.assertTrue(lower < -1.5 and upper > -2.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
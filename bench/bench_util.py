@@ -4,15 +4,50 @@ Created on May 19, 2011
 @author: bungeman
 '''
 
+import itertools
+import json
+import multiprocessing
 import os
 import re
 import math
+import sys
+
+from array import array
 
 # bench representation algorithm constant names
 ALGORITHM_AVERAGE = 'avg'
 ALGORITHM_MEDIAN = 'med'
 ALGORITHM_MINIMUM = 'min'
 ALGORITHM_25TH_PERCENTILE = '25th'
+ALGORITHM_75TH_PERCENTILE = '75th'
+ALGORITHM_90TH_PERCENTILE = '90th'
+ALGORITHM_TRIMMED_MEAN = 'trim'
+
+# Fraction of values dropped from each end for ALGORITHM_TRIMMED_MEAN.
+TRIMMED_MEAN_CUT = 0.1
+
+# Version of the parsed data layout. Bump whenever parse() would return
+# different data points for the same input, so that cached results of older
+# parsers (see bench_cache.py) are not reused.
+PARSER_VERSION = 5
+
+# Suffix of bench data files holding nanobench JSON output.
+JSON_FILE_SUFFIX = '.json'
+# Size of the chunks in which JSON bench data files are read.
+JSON_READ_CHUNK_BYTES = 64 * 1024
+# Metrics of nanobench JSON output matching representation algorithms.
+# Without a representation, JSON_DEFAULT_METRIC is used. Other
+# representations are computed from the per-iteration times of
+# JSON_SAMPLES_KEY, where a config has them.
+JSON_MEDIAN_METRIC = 'median_ms'
+JSON_DEFAULT_METRIC = 'min_ms'
+JSON_METRICS = {
+    ALGORITHM_MEDIAN: JSON_MEDIAN_METRIC,
+    ALGORITHM_MINIMUM: JSON_DEFAULT_METRIC,
+}
+JSON_SAMPLES_KEY = 'samples'
+# Suffix of the time metrics of nanobench JSON output.
+JSON_TIME_METRIC_SUFFIX = '_ms'
 
 # Regular expressions used throughout.
 PER_SETTING_RE = '([^\s=]+)(?:=(\S+))?'
@@ -68,6 +103,150 @@ class BenchDataPoint:
                    str(self.settings),
                )
 
+class BenchDataStore(object):
+    """Columnar container of bench data points.
+
+    Bench, config, time type and tile layout strings are interned, settings
+    dictionaries are kept once in a shared table, and times, per-tile values
+    and per-iteration times live in flat array('d') buffers. Indexing or
+    iterating yields BenchDataPointView objects, which have the same
+    attributes as BenchDataPoint.
+    """
+    def __init__(self, points=None):
+        self._strings = {}
+        # per-point columns
+        self.benches = []
+        self.configs = []
+        self.time_types = []
+        self.tile_layouts = []
+        self.times = array('d')
+        self.settings_ids = array('l')
+        # values of point i are values[offsets[i]:offsets[i + 1]]
+        self.per_tile_offsets = array('l', [0])
+        self.per_tile_values = array('d')
+        self.per_iter_offsets = array('l', [0])
+        self.per_iter_values = array('d')
+        # distinct settings dictionaries, referenced by settings_ids
+        self.settings_table = []
+        self._settings_index = {}
+        self._last_settings = None
+        self._last_settings_id = None
+        if points:
+            self.extend(points)
+
+    def _intern(self, string):
+        return self._strings.setdefault(string, string)
+
+    def _settings_id(self, settings):
+        # Parsed points of one file share a settings dictionary, so checking
+        # identity first avoids hashing it for every point.
+        if settings is self._last_settings:
+            return self._last_settings_id
+        key = frozenset(settings.iteritems())
+        settings_id = self._settings_index.get(key)
+        if settings_id is None:
+            settings_id = len(self.settings_table)
+            self.settings_table.append(settings)
+            self._settings_index[key] = settings_id
+        self._last_settings = settings
+        self._last_settings_id = settings_id
+        return settings_id
+
+    def append(self, bench, config, time_type, time, settings,
+               tile_layout='', per_tile_values=(), per_iter_time=()):
+        """Adds one data point; arguments are as for BenchDataPoint."""
+        self.benches.append(self._intern(bench))
+        self.configs.append(self._intern(config))
+        self.time_types.append(self._intern(time_type))
+        self.tile_layouts.append(self._intern(tile_layout))
+        self.times.append(time)
+        self.settings_ids.append(self._settings_id(settings))
+        self.per_tile_values.extend(per_tile_values)
+        self.per_tile_offsets.append(len(self.per_tile_values))
+        self.per_iter_values.extend(per_iter_time)
+        self.per_iter_offsets.append(len(self.per_iter_values))
+
+    def add_point(self, point):
+        """Adds a BenchDataPoint (or a view of another store)."""
+        self.append(point.bench, point.config, point.time_type, point.time,
+                    point.settings, point.tile_layout, point.per_tile_values,
+                    point.per_iter_time)
+
+    def extend(self, points):
+        for point in points:
+            self.add_point(point)
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.times)
+        if index < 0 or index >= len(self.times):
+            raise IndexError('BenchDataStore index out of range')
+        return BenchDataPointView(self, index)
+
+    def __iter__(self):
+        for index in xrange(len(self.times)):
+            yield BenchDataPointView(self, index)
+
+class BenchDataPointView(object):
+    """A single data point of a BenchDataStore.
+
+    Exposes the attributes of BenchDataPoint without copying the point out of
+    the store; per_tile_values and per_iter_time are built on access.
+    """
+    __slots__ = ('_store', '_index')
+
+    def __init__(self, store, index):
+        self._store = store
+        self._index = index
+
+    @property
+    def bench(self):
+        return self._store.benches[self._index]
+
+    @property
+    def config(self):
+        return self._store.configs[self._index]
+
+    @property
+    def time_type(self):
+        return self._store.time_types[self._index]
+
+    @property
+    def time(self):
+        return self._store.times[self._index]
+
+    @property
+    def settings(self):
+        return self._store.settings_table[self._store.settings_ids[self._index]]
+
+    @property
+    def tile_layout(self):
+        return self._store.tile_layouts[self._index]
+
+    @property
+    def per_tile_values(self):
+        offsets = self._store.per_tile_offsets
+        return self._store.per_tile_values[
+            offsets[self._index]:offsets[self._index + 1]].tolist()
+
+    @property
+    def per_iter_time(self):
+        offsets = self._store.per_iter_offsets
+        return self._store.per_iter_values[
+            offsets[self._index]:offsets[self._index + 1]].tolist()
+
+    def __repr__(self):
+        return "BenchDataPoint(%s, %s, %s, %s, %s)" % (
+                   str(self.bench),
+                   str(self.config),
+                   str(self.time_type),
+                   str(self.time),
+                   str(self.settings),
+               )
+
 class _ExtremeType(object):
     """Instances of this class compare greater or less than other objects."""
     def __init__(self, cmpr, rep):
@@ -86,6 +265,25 @@ class _ExtremeType(object):
 Max = _ExtremeType(1, "Max")
 Min = _ExtremeType(-1, "Min")
 
+# For percentiles, we use the value below which x% of values are found, which
+# allows for better detection of quantum behaviors. Maps representation to x.
+_PERCENTILES = {
+    ALGORITHM_MEDIAN: 0.5,
+    ALGORITHM_25TH_PERCENTILE: 0.25,
+    ALGORITHM_75TH_PERCENTILE: 0.75,
+    ALGORITHM_90TH_PERCENTILE: 0.9,
+}
+
+def _PercentileIndex(percentile, length):
+    """Returns the index of the given percentile in a sorted list."""
+    return int(round(percentile * length + 0.5)) - 1
+
+def _TrimmedMean(sorted_data):
+    """Returns the mean of sorted_data without its TRIMMED_MEAN_CUT tails."""
+    cut = int(TRIMMED_MEAN_CUT * len(sorted_data))
+    kept = sorted_data[cut:len(sorted_data) - cut]
+    return sum(kept) / len(kept)
+
 class _ListAlgorithm(object):
     """Algorithm for selecting the representation value from a given list.
     representation is one of the ALGORITHM_XXX representation types."""
@@ -100,22 +298,62 @@ class _ListAlgorithm(object):
             self._data.sort()
             if representation == ALGORITHM_MINIMUM:
                 self._rep = self._data[0]
+            elif representation == ALGORITHM_TRIMMED_MEAN:
+                self._rep = _TrimmedMean(self._data)
+            elif representation in _PERCENTILES:
+                self._rep = self._data[_PercentileIndex(
+                    _PERCENTILES[representation], self._len)]
             else:
-                # for percentiles, we use the value below which x% of values are
-                # found, which allows for better detection of quantum behaviors.
-                if representation == ALGORITHM_MEDIAN:
-                    x = int(round(0.5 * self._len + 0.5))
-                elif representation == ALGORITHM_25TH_PERCENTILE:
-                    x = int(round(0.25 * self._len + 0.5))
-                else:
-                    raise Exception("invalid representation algorithm %s!" %
-                                    representation)
-                self._rep = self._data[x - 1]
+                raise Exception("invalid representation algorithm %s!" %
+                                representation)
 
     def compute(self):
         return self._rep
 
-def _ParseAndStoreTimes(config_re_compiled, is_per_tile, line, bench,
+def compute_representations(values, offsets, representation=None):
+    """Computes the representation value of many series at once.
+
+    The series are given as a ragged array: values holds all series back to
+    back, and series i is values[offsets[i]:offsets[i + 1]], so offsets has one
+    more entry than there are series. Results match _ListAlgorithm on each
+    series, but the input is left unsorted and no per-series objects are made.
+    Each series is reduced by a single builtin call (sum, min or sorted), which
+    for the short series of bench logs beats partial selection in Python.
+
+    (array('d'), [int], str) -> array('d')
+    representation is one of the ALGORITHM_XXX types."""
+    if not representation:
+        representation = ALGORITHM_AVERAGE  # default algorithm
+    if (representation not in _PERCENTILES and
+        representation not in (ALGORITHM_AVERAGE, ALGORITHM_MINIMUM,
+                               ALGORITHM_TRIMMED_MEAN)):
+        raise Exception("invalid representation algorithm %s!" %
+                        representation)
+    reps = array('d')
+    bounds = zip(offsets[:-1], offsets[1:])
+    if representation == ALGORITHM_AVERAGE:
+        for start, end in bounds:
+            reps.append(sum(values[start:end]) / (end - start))
+    elif representation == ALGORITHM_MINIMUM:
+        for start, end in bounds:
+            reps.append(min(values[start:end]))
+    elif representation == ALGORITHM_TRIMMED_MEAN:
+        for start, end in bounds:
+            reps.append(_TrimmedMean(sorted(values[start:end])))
+    else:
+        percentile = _PERCENTILES[representation]
+        # Series of one bench usually share their length, so the selected
+        # index is computed once per distinct length.
+        indices = {}
+        for start, end in bounds:
+            length = end - start
+            k = indices.get(length)
+            if k is None:
+                k = indices[length] = _PercentileIndex(percentile, length)
+            reps.append(sorted(values[start:end])[k])
+    return reps
+
+def _ParseAndStoreTimes(config_re_compiled, is_per_tile, line,
                         value_dic, layout_dic):
     """Parses given bench time line with regex and adds data to value_dic.
 
@@ -124,9 +362,10 @@ def _ParseAndStoreTimes(config_re_compiled, is_per_tile, line, bench,
     is_per_tile: boolean indicating whether this is a per-tile bench.
         If so, we add tile layout into layout_dic as well.
     line: input string line to parse.
-    bench: name of bench for the time values.
-    value_dic: dictionary to store bench values. See bench_dic in parse() below.
-    layout_dic: dictionary to store tile layouts. See parse() for descriptions.
+    value_dic: dictionary to store values of the current bench. See
+        config_dic in iter_parse() below.
+    layout_dic: dictionary to store tile layouts of the current bench. See
+        iter_parse() for descriptions.
     """
 
     for config in config_re_compiled.finditer(line):
@@ -142,28 +381,112 @@ def _ParseAndStoreTimes(config_re_compiled, is_per_tile, line, bench,
             current_time_type = new_time.group(1)
             iters = [float(i) for i in
                      new_time.group(2).strip().split(',')]
-            value_dic.setdefault(bench, {}).setdefault(
-                current_config, {}).setdefault(current_time_type, []).append(
-                    iters)
-            layout_dic.setdefault(bench, {}).setdefault(
-                current_config, {}).setdefault(current_time_type, tile_layout)
-
-def parse_skp_bench_data(directory, revision, rep, default_settings=None):
+            value_dic.setdefault(current_config, {}).setdefault(
+                current_time_type, []).append(iters)
+            layout_dic.setdefault(current_config, {}).setdefault(
+                current_time_type, tile_layout)
+
+def _CreateBenchDataPoints(bench, settings, config_dic, layout_dic,
+                           representation):
+    """Yields a BenchDataPoint for each config and time type of one bench.
+
+    config_dic and layout_dic hold the values of a single bench, as collected
+    by _ParseAndStoreTimes(). The representations of all its series, the tiles
+    of per-tile configs and the iterations of the others, are computed in one
+    compute_representations() call.
+    """
+    # (config, time_type, index of the first series, number of series)
+    entries = []
+    values = array('d')
+    offsets = [0]
+    for config in config_dic:
+        for time_type in config_dic[config]:
+            all_iters = config_dic[config][time_type]
+            entries.append((config, time_type, len(offsets) - 1,
+                            len(all_iters)))
+            for iters in all_iters:
+                values.extend(iters)
+                offsets.append(len(values))
+    if not entries:
+        return
+    reps = compute_representations(values, offsets, representation)
+
+    for config, time_type, first, count in entries:
+        tile_layout = ''
+        per_tile_values = []  # empty for non-per-tile configs
+        per_iter_time = []  # empty for per-tile configs
+        bench_summary = None  # a single final bench value
+        if count > 1:
+            # per-tile config; one representation for each tile
+            per_tile_values = reps[first:first + count].tolist()
+            # use sum of each tile representation for total bench value
+            bench_summary = sum(per_tile_values)
+            # extract tile layout
+            tile_layout = layout_dic[config][time_type]
+        else:
+            # get the list of per-iteration values
+            per_iter_time = config_dic[config][time_type][0]
+            bench_summary = reps[first]
+        yield BenchDataPoint(
+            bench,
+            config,
+            time_type,
+            bench_summary,
+            settings,
+            tile_layout,
+            per_tile_values,
+            per_iter_time)
+
+def _ParseSkpBenchFile(args):
+    """Parses one skp bench file. Runs in pool workers, so takes one tuple.
+
+    args: tuple of (file path, settings dictionary, representation, cache),
+        where cache is a bench_cache.BenchCache or None. Files ending with
+        JSON_FILE_SUFFIX are read as nanobench JSON output.
+    Returns a list of BenchDataPoint objects.
+    """
+    path, settings, rep, cache = args
+    try:
+        if cache:
+            return cache.parse_file(path, settings, rep)
+        with open(path, 'r') as file_handle:
+            if path.endswith(JSON_FILE_SUFFIX):
+                return parse_json(settings, file_handle, rep)
+            return parse(settings, file_handle, rep)
+    except JSONMetricError as e:
+        print >> sys.stderr, 'Warning: skipping %s: %s' % (path, e)
+        return []
+
+def parse_skp_bench_data(directory, revision, rep, default_settings=None,
+                         store=None, processes=1, cache=None):
     """Parses all the skp bench data in the given directory.
 
+    Data files whose names end with JSON_FILE_SUFFIX hold nanobench JSON output
+    and skip the regex parser; see iter_parse_json(). Those that cannot give
+    the rep values are skipped with a warning.
+
     Args:
       directory: string of path to input data directory.
       revision: git hash revision that matches the data to process.
       rep: bench representation algorithm, see bench_util.py.
       default_settings: dictionary of other run settings. See writer.option() in
           bench/benchmain.cpp.
+      store: optional BenchDataStore to fill with the parsed data points. Lets
+          callers load data of many revisions into one compact container.
+      processes: number of worker processes parsing files concurrently. Data
+          points are merged in file name order whatever the number.
+      cache: optional bench_cache.BenchCache holding previously parsed files.
 
     Returns:
-      A list of BenchDataPoint objects.
+      A list of BenchDataPoint objects, or store if one is given.
     """
-    revision_data_points = []
+    if store is not None:
+        revision_data_points = store
+    else:
+        revision_data_points = []
     file_list = os.listdir(directory)
     file_list.sort()
+    jobs = []
     for bench_file in file_list:
         scalar_type = None
         # Scalar type, if any, is in the bench filename after 'scalar_'.
@@ -174,92 +497,258 @@ def parse_skp_bench_data(directory, revision, rep, default_settings=None):
         else:  # Skips non skp bench files.
             continue
 
-        with open('/'.join([directory, bench_file]), 'r') as file_handle:
-          settings = dict(default_settings or {})
-          settings['scalar'] = scalar_type
-          revision_data_points.extend(parse(settings, file_handle, rep))
+        settings = dict(default_settings or {})
+        settings['scalar'] = scalar_type
+        jobs.append(('/'.join([directory, bench_file]), settings, rep, cache))
+
+    if processes > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(processes, len(jobs)))
+        try:
+            # map() returns results in job order, keeping the merge
+            # deterministic.
+            file_data_points = pool.map(_ParseSkpBenchFile, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        file_data_points = itertools.imap(_ParseSkpBenchFile, jobs)
+    for data_points in file_data_points:
+        revision_data_points.extend(data_points)
 
     return revision_data_points
 
-# TODO(bensong): switch to reading JSON output when available. This way we don't
-# need the RE complexities.
-def parse(settings, lines, representation=None):
-    """Parses bench output into a useful data structure.
+def iter_parse(settings, lines, representation=None):
+    """Parses bench output, yielding data points as each bench finishes.
 
-    ({str:str}, __iter__ -> str) -> [BenchDataPoint]
-    representation is one of the ALGORITHM_XXX types."""
+    ({str:str}, __iter__ -> str) -> __iter__ -> BenchDataPoint
+    representation is one of the ALGORITHM_XXX types.
+
+    Only the values of the bench currently being read are kept in memory; its
+    data points are yielded as soon as the next bench starts. Points carry the
+    settings in effect when their bench started. Consecutive 'running bench'
+    lines of the same bench, e.g. one per config, are one run of it, but a
+    bench that is run again after another one yields a second set of points,
+    which is not merged with the first."""
 
-    benches = []
     current_bench = None
-    # [bench][config][time_type] -> [[per-iter values]] where per-tile config
-    # has per-iter value list for each tile [[<tile1_iter1>,<tile1_iter2>,...],
-    # [<tile2_iter1>,<tile2_iter2>,...],...], while non-per-tile config only
-    # contains one list of iterations [[iter1, iter2, ...]].
-    bench_dic = {}
-    # [bench][config][time_type] -> tile_layout
+    bench_settings = settings
+    # [config][time_type] -> [[per-iter values]] for current_bench, where
+    # per-tile config has per-iter value list for each tile
+    # [[<tile1_iter1>,<tile1_iter2>,...], [<tile2_iter1>,<tile2_iter2>,...],
+    # ...], while non-per-tile config only contains one list of iterations
+    # [[iter1, iter2, ...]].
+    config_dic = {}
+    # [config][time_type] -> tile_layout for current_bench
     layout_dic = {}
 
     for line in lines:
 
+        # Cheap substring checks decide which regexes can match this line, as
+        # most lines of a log only contain bench times.
+
         # see if this line is a settings line
-        settingsMatch = SETTINGS_RE_COMPILED.search(line)
-        if (settingsMatch):
-            settings = dict(settings)
-            for settingMatch in PER_SETTING_RE_COMPILED.finditer(settingsMatch.group(1)):
-                if (settingMatch.group(2)):
-                    settings[settingMatch.group(1)] = settingMatch.group(2)
-                else:
-                    settings[settingMatch.group(1)] = True
+        if 'skia bench:' in line:
+            settingsMatch = SETTINGS_RE_COMPILED.search(line)
+            if (settingsMatch):
+                settings = dict(settings)
+                for settingMatch in PER_SETTING_RE_COMPILED.finditer(
+                        settingsMatch.group(1)):
+                    if (settingMatch.group(2)):
+                        settings[settingMatch.group(1)] = settingMatch.group(2)
+                    else:
+                        settings[settingMatch.group(1)] = True
 
         # see if this line starts a new bench
-        new_bench = BENCH_RE_COMPILED.search(line)
-        if new_bench:
-            current_bench = new_bench.group(1)
-
-        # add configs on this line to the bench_dic
-        if current_bench:
+        if 'running bench' in line:
+            new_bench = BENCH_RE_COMPILED.search(line)
+            if new_bench and new_bench.group(1) != current_bench:
+                for point in _CreateBenchDataPoints(
+                        current_bench, bench_settings, config_dic, layout_dic,
+                        representation):
+                    yield point
+                current_bench = new_bench.group(1)
+                bench_settings = settings
+                config_dic = {}
+                layout_dic = {}
+
+        # add configs on this line to the config_dic
+        if current_bench and ':' in line:
             if line.startswith('  tile_') :
-                _ParseAndStoreTimes(TILE_RE_COMPILED, True, line, current_bench,
-                                    bench_dic, layout_dic)
+                _ParseAndStoreTimes(TILE_RE_COMPILED, True, line,
+                                    config_dic, layout_dic)
             else:
                 _ParseAndStoreTimes(CONFIG_RE_COMPILED, False, line,
-                                    current_bench, bench_dic, layout_dic)
-
-    # append benches to list
-    for bench in bench_dic:
-        for config in bench_dic[bench]:
-            for time_type in bench_dic[bench][config]:
-                tile_layout = ''
-                per_tile_values = []  # empty for non-per-tile configs
-                per_iter_time = []  # empty for per-tile configs
-                bench_summary = None  # a single final bench value
-                if len(bench_dic[bench][config][time_type]) > 1:
-                    # per-tile config; compute representation for each tile
-                    per_tile_values = [
-                        _ListAlgorithm(iters, representation).compute()
-                            for iters in bench_dic[bench][config][time_type]]
-                    # use sum of each tile representation for total bench value
-                    bench_summary = sum(per_tile_values)
-                    # extract tile layout
-                    tile_layout = layout_dic[bench][config][time_type]
-                else:
-                    # get the list of per-iteration values
-                    per_iter_time = bench_dic[bench][config][time_type][0]
-                    bench_summary = _ListAlgorithm(
-                        per_iter_time, representation).compute()
-                benches.append(BenchDataPoint(
-                    bench,
-                    config,
-                    time_type,
-                    bench_summary,
-                    settings,
-                    tile_layout,
-                    per_tile_values,
-                    per_iter_time))
-
-    return benches
-
-class LinearRegression:
+                                    config_dic, layout_dic)
+
+    for point in _CreateBenchDataPoints(
+            current_bench, bench_settings, config_dic, layout_dic,
+            representation):
+        yield point
+
+def parse(settings, lines, representation=None):
+    """Parses bench output into a useful data structure.
+
+    ({str:str}, __iter__ -> str) -> [BenchDataPoint]
+    representation is one of the ALGORITHM_XXX types."""
+
+    return list(iter_parse(settings, lines, representation))
+
+
+class _JSONStreamReader(object):
+    """Reads a JSON document from a file in chunks, one value at a time.
+
+    Objects can be walked member by member with iter_members(), so only the
+    values actually decoded with value() are held in memory.
+    """
+    def __init__(self, file_handle):
+        self._file = file_handle
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        """Reads another chunk into the buffer; returns False at end of file."""
+        if self._eof:
+            return False
+        chunk = self._file.read(JSON_READ_CHUNK_BYTES)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        """Returns the next non-whitespace character, or '' at end of file."""
+        while True:
+            while (self._pos < len(self._buffer) and
+                   self._buffer[self._pos] in ' \t\r\n'):
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError('Expected "%s" in JSON bench data at "%s"' % (
+                char, self._buffer[self._pos:self._pos + 20]))
+        self._pos += 1
+
+    def value(self):
+        """Decodes and returns the next complete JSON value."""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                if self._fill():
+                    continue
+                raise
+            # A value running up to the end of the buffer may be a truncated
+            # number; valid JSON always has a delimiter after it.
+            if end == len(self._buffer) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def iter_members(self):
+        """Yields the keys of the object at the current position. After each
+        key, the caller must consume its value with value() or
+        iter_members()."""
+        self._expect('{')
+        if self._peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self.value()
+            self._expect(':')
+            yield key
+            char = self._peek()
+            self._pos += 1
+            if char == '}':
+                return
+            if char != ',':
+                raise ValueError('Expected "," or "}" in JSON bench data')
+
+class JSONMetricError(Exception):
+    """nanobench JSON results lack the values of a representation."""
+    pass
+
+def _GetJSONTimes(metrics, metric, representation, bench, config):
+    """Returns (time, per-iteration times) of one nanobench config, or None if
+    the config holds no time at all.
+
+    time is the given metric, or if metric is None or missing, representation
+    computed from the samples."""
+    samples = metrics.get(JSON_SAMPLES_KEY)
+    if samples:
+        samples = [float(sample) for sample in samples]
+    if metric in metrics:
+        time = float(metrics[metric])
+        return time, samples or [time]
+    if samples:
+        time = compute_representations(array('d', samples), [0, len(samples)],
+                                       representation)[0]
+        return time, samples
+    for name in metrics:
+        if name.endswith(JSON_TIME_METRIC_SUFFIX):
+            raise JSONMetricError(
+                'nanobench JSON results of %s %s have neither %s nor %s' % (
+                    bench, config, metric or representation,
+                    JSON_SAMPLES_KEY))
+    return None
+
+def iter_parse_json(settings, file_handle, representation=None):
+    """Parses nanobench JSON results, yielding data points bench by bench.
+
+    ({str:str}, file) -> __iter__ -> BenchDataPoint
+    representation is one of the ALGORITHM_XXX types.
+
+    The format is the one of NanoJSONResultsWriter in bench/ResultsWriter.h.
+    Members of "key" and the other top-level properties are added to the
+    settings. As in iter_parse(), points carry the settings read before them
+    and share one dictionary until those change; properties that follow
+    "results" in the file only apply to later points. Each config yields a
+    point of time type '' (walltime). Its time is the metric matching
+    representation (see JSON_METRICS), or else representation computed from
+    the config's JSON_SAMPLES_KEY, which are also its per-iteration times.
+    Without samples, the metric is the single per-iteration time. A config
+    that has neither raises JSONMetricError, rather than all representations
+    collapsing to the same value."""
+
+    if not representation:
+        metric = JSON_DEFAULT_METRIC
+    else:
+        metric = JSON_METRICS.get(representation)
+    settings = dict(settings or {})
+    reader = _JSONStreamReader(file_handle)
+    for member in reader.iter_members():
+        if member == 'results':
+            for bench in reader.iter_members():
+                configs = reader.value()
+                for config in sorted(configs):
+                    times = _GetJSONTimes(configs[config], metric,
+                                          representation, bench, config)
+                    if times is None:  # e.g. the memory_usage meta bench
+                        continue
+                    yield BenchDataPoint(bench, config, '', times[0],
+                                         settings, per_iter_time=times[1])
+        elif member == 'key':
+            settings = dict(settings)
+            settings.update(reader.value())
+        else:
+            settings = dict(settings)
+            settings[member] = reader.value()
+
+def parse_json(settings, file_handle, representation=None):
+    """Parses nanobench JSON results into a list of BenchDataPoint objects.
+
+    See iter_parse_json()."""
+    return list(iter_parse_json(settings, file_handle, representation))
+
+class LinearRegression(object):
     """Linear regression data based on a set of data points.
 
     ([(Number,Number)])
@@ -286,6 +775,17 @@ class LinearRegression:
             Sxy += x*y
             Syy += y*y
 
+        self._fit(n, Sx, Sy, Sxx, Sxy, Syy, min_x, max_x)
+
+    @classmethod
+    def from_sums(cls, n, Sx, Sy, Sxx, Sxy, Syy, min_x, max_x):
+        """Creates the regression of n points from their sufficient
+        statistics: the sums of x, y, x*x, x*y and y*y, and the x range."""
+        regression = cls.__new__(cls)
+        regression._fit(n, Sx, Sy, Sxx, Sxy, Syy, min_x, max_x)
+        return regression
+
+    def _fit(self, n, Sx, Sy, Sxx, Sxy, Syy, min_x, max_x):
         denom = n*Sxx - Sx*Sx
         if (denom != 0.0):
             B = (n*Sxy - Sx*Sy) / denom
@@ -321,24 +821,117 @@ class LinearRegression:
 
     def find_min_slope(self):
         """Finds the minimal slope given one standard deviation."""
-        slope = self.slope
-        intercept = self.intercept
-        error = self.serror
-        regr_start = self.min_x
-        regr_end = self.max_x
-        regr_width = regr_end - regr_start
-
-        if slope < 0:
-            lower_left_y = slope*regr_start + intercept - error
-            upper_right_y = slope*regr_end + intercept + error
-            return min(0, (upper_right_y - lower_left_y) / regr_width)
-
-        elif slope > 0:
-            upper_left_y = slope*regr_start + intercept + error
-            lower_right_y = slope*regr_end + intercept - error
-            return max(0, (lower_right_y - upper_left_y) / regr_width)
-
-        return 0
+        return _MinSlope(self.slope, self.intercept, self.serror, self.min_x,
+                         self.max_x)
+
+def _MinSlope(slope, intercept, error, regr_start, regr_end):
+    """Returns LinearRegression.find_min_slope() of a fitted line."""
+    regr_width = regr_end - regr_start
+
+    if slope < 0:
+        lower_left_y = slope*regr_start + intercept - error
+        upper_right_y = slope*regr_end + intercept + error
+        return min(0, (upper_right_y - lower_left_y) / regr_width)
+
+    elif slope > 0:
+        upper_left_y = slope*regr_start + intercept + error
+        lower_right_y = slope*regr_end + intercept - error
+        return max(0, (lower_right_y - upper_left_y) / regr_width)
+
+    return 0
+
+class BatchLinearRegression(object):
+    """Linear regressions of many series at once, e.g. the time of every bench
+    against revision, kept as sufficient statistics.
+
+    Each series has its count and sums of x, y, x*x, x*y and y*y, and its x
+    range, stored in array('d') columns indexed by series. Adding a revision
+    updates every series in O(1) each, so the regressions of all benches can
+    be refreshed per commit without refitting their histories.
+    """
+    def __init__(self, keys=()):
+        self.keys = []
+        self.indexes = {}  # key -> index into the columns
+        self.n = array('d')
+        self.sx = array('d')
+        self.sy = array('d')
+        self.sxx = array('d')
+        self.sxy = array('d')
+        self.syy = array('d')
+        self.min_x = array('d')
+        self.max_x = array('d')
+        for key in keys:
+            self.index(key)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def index(self, key):
+        """Returns the index of the series key, adding it if new."""
+        index = self.indexes.get(key)
+        if index is None:
+            index = self.indexes[key] = len(self.keys)
+            self.keys.append(key)
+            for column in (self.n, self.sx, self.sy, self.sxx, self.sxy,
+                           self.syy):
+                column.append(0.0)
+            self.min_x.append(float('inf'))
+            self.max_x.append(float('-inf'))
+        return index
+
+    def add(self, index, x, y):
+        """Adds point (x, y) to the series at index."""
+        self.n[index] += 1
+        self.sx[index] += x
+        self.sy[index] += y
+        self.sxx[index] += x*x
+        self.sxy[index] += x*y
+        self.syy[index] += y*y
+        if x < self.min_x[index]:
+            self.min_x[index] = x
+        if x > self.max_x[index]:
+            self.max_x[index] = x
+
+    def add_revision(self, x, values):
+        """Adds the point (x, values[i]) to each series i.
+
+        values: a sequence of y values aligned with the series indexes, with
+          None or NaN for series without a value at x. Series beyond its
+          length are left unchanged.
+        """
+        add = self.add
+        for index, y in enumerate(values):
+            if y is not None and y == y:  # NaN != NaN
+                add(index, x, y)
+
+    def add_rows(self, xs, rows):
+        """Adds a 2-D block of points: row j holds the values of all series at
+        xs[j], as for add_revision()."""
+        for x, values in zip(xs, rows):
+            self.add_revision(x, values)
+
+    def regression(self, key):
+        """Returns the LinearRegression of series key."""
+        index = self.indexes[key]
+        return LinearRegression.from_sums(
+            self.n[index], self.sx[index], self.sy[index], self.sxx[index],
+            self.sxy[index], self.syy[index], self.min_x[index],
+            self.max_x[index])
+
+    def min_slopes(self):
+        """Returns an array('d') of LinearRegression.find_min_slope() of every
+        series with at least two points, and 0 for the others."""
+        slopes = array('d', [0.0]) * len(self.keys)
+        for index in xrange(len(self.keys)):
+            n = self.n[index]
+            if n < 2:
+                continue
+            regression = LinearRegression.from_sums(
+                n, self.sx[index], self.sy[index], self.sxx[index],
+                self.sxy[index], self.syy[index], self.min_x[index],
+                self.max_x[index])
+            slopes[index] = regression.find_min_slope()
+        return slopes
 
 def CreateRevisionLink(revision_number):
     """Returns HTML displaying the given revision number and linking to
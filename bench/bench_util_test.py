@@ -0,0 +1,187 @@
+#!/usr/bin/python
+
+# Copyright 2015 Google Inc.
+#
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+Test bench_util.
+"""
+
+import StringIO
+import bench_util
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+
+def make_series(num_series, num_revisions, seed=0):
+    """Returns (revisions, rows) of bench times, as for add_rows(), with
+    missing values as None or NaN."""
+    rand = random.Random(seed)
+    revisions = sorted(rand.sample(xrange(1000, 2000), num_revisions))
+    trends = [(rand.uniform(1, 100), rand.uniform(-0.1, 0.1))
+              for _ in range(num_series)]
+    rows = []
+    for revision in revisions:
+        row = []
+        for base, slope in trends:
+            if rand.random() < 0.2:
+                row.append(rand.choice([None, float('nan')]))
+            else:
+                row.append(base + slope * (revision - 1000) +
+                           rand.gauss(0, 1))
+        rows.append(row)
+    return revisions, rows
+
+
+def points_of(revisions, rows, index):
+    return [(revision, row[index]) for revision, row in zip(revisions, rows)
+            if row[index] is not None and row[index] == row[index]]
+
+
+class BatchLinearRegressionTest(unittest.TestCase):
+
+    def test_matches_linear_regression(self):
+        revisions, rows = make_series(50, 30)
+        batch = bench_util.BatchLinearRegression(range(50))
+        batch.add_rows(revisions, rows)
+        slopes = batch.min_slopes()
+        self.assertEqual(len(slopes), 50)
+        for index in range(50):
+            expected = bench_util.LinearRegression(
+                points_of(revisions, rows, index))
+            regression = batch.regression(index)
+            for attribute in ('slope', 'intercept', 'serror', 'min_x',
+                              'max_x'):
+                self.assertAlmostEqual(getattr(regression, attribute),
+                                       getattr(expected, attribute))
+            self.assertAlmostEqual(slopes[index], expected.find_min_slope())
+
+    def test_incremental_matches_batch(self):
+        revisions, rows = make_series(20, 40, seed=1)
+        batch = bench_util.BatchLinearRegression(range(20))
+        batch.add_rows(revisions, rows)
+        incremental = bench_util.BatchLinearRegression()
+        for revision, row in zip(revisions, rows):
+            for key in range(len(row)):
+                incremental.index(key)
+            incremental.add_revision(revision, row)
+        self.assertEqual(list(incremental.min_slopes()),
+                         list(batch.min_slopes()))
+
+    def test_too_few_points(self):
+        batch = bench_util.BatchLinearRegression(['none', 'one', 'two'])
+        batch.add_revision(1, [None, 5.0, 1.0])
+        batch.add_revision(2, [float('nan'), None, 3.0])
+        self.assertEqual(list(batch.min_slopes()), [0.0, 0.0, 2.0])
+
+    def test_keys(self):
+        batch = bench_util.BatchLinearRegression(['a', 'b'])
+        self.assertEqual(batch.index('b'), 1)
+        self.assertEqual(batch.index('c'), 2)
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(batch.keys, ['a', 'b', 'c'])
+
+
+class IterParseTest(unittest.TestCase):
+
+    def _parse(self, lines):
+        # Points of one bench run come in no particular order.
+        points = []
+        run = []
+        for point in bench_util.iter_parse({}, lines):
+            if run and run[-1][0] != point.bench:
+                points.extend(sorted(run))
+                run = []
+            run.append((point.bench, point.config, point.time,
+                        point.settings.get('scale')))
+        return points + sorted(run)
+
+    def test_settings_of_bench_start(self):
+        self.assertEqual(self._parse([
+            'skia bench: scale=1\n',
+            'running bench [640 480] bitmap\n',
+            '  8888:  msecs = 1.00\n',
+            'skia bench: scale=2\n',
+            'running bench [640 480] rects\n',
+            '  8888:  msecs = 2.00\n']),
+            [('bitmap', '8888', 1.0, '1'), ('rects', '8888', 2.0, '2')])
+
+    def test_repeated_bench(self):
+        # Lines of a bench in a row are one run, a later run gives points of
+        # its own.
+        self.assertEqual(self._parse([
+            'running bench [640 480] bitmap\n',
+            '  8888:  msecs = 1.00\n',
+            'running bench [640 480] bitmap\n',
+            '  gpu:  msecs = 3.00\n',
+            'running bench [640 480] rects\n',
+            '  8888:  msecs = 2.00\n',
+            'running bench [640 480] bitmap\n',
+            '  8888:  msecs = 4.00\n']),
+            [('bitmap', '8888', 1.0, None), ('bitmap', 'gpu', 3.0, None),
+             ('rects', '8888', 2.0, None), ('bitmap', '8888', 4.0, None)])
+
+
+class ParseJSONTest(unittest.TestCase):
+    """Parses nanobench JSON results with the representation the tools use by
+    default."""
+
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_dir)
+
+    def _write(self, file_name, content):
+        with open(os.path.join(self._temp_dir, file_name), 'w') as f:
+            f.write(content)
+
+    def _parse(self, representation):
+        stderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+        try:
+            points = bench_util.parse_skp_bench_data(
+                self._temp_dir, 'abc', representation)
+            return points, sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+
+    def test_samples(self):
+        self._write('bench_abc_data_nano.json', json.dumps({
+            'results': {'desk_site0.skp_1000_1000': {
+                '8888': {'min_ms': 1.0, 'samples': [4.0, 1.0, 3.0, 2.0]},
+                'meta': {'memory_usage_mb': 12}}}}))
+        points, warnings = self._parse(bench_util.ALGORITHM_25TH_PERCENTILE)
+        self.assertEqual(warnings, '')
+        [point] = points
+        self.assertEqual(point.time, bench_util.compute_representations(
+            [4.0, 1.0, 3.0, 2.0], [0, 4],
+            bench_util.ALGORITHM_25TH_PERCENTILE)[0])
+        self.assertEqual(point.per_iter_time, [4.0, 1.0, 3.0, 2.0])
+        [point] = self._parse(bench_util.ALGORITHM_MINIMUM)[0]
+        self.assertEqual(point.time, 1.0)
+
+    def test_missing_metric_skips_file(self):
+        # nanobench only writes min_ms.
+        self._write('bench_abc_data_nano.json', json.dumps({
+            'results': {'desk_site0.skp_1000_1000': {
+                '8888': {'min_ms': 1.0}}}}))
+        self._write('bench_abc_data_skp_multi_4',
+                    'running bench [1000 1000] desk_site1.skp\n'
+                    '  simple_viewport_1000x1000:  msecs = 2.00,3.00\n')
+        points, warnings = self._parse(bench_util.ALGORITHM_25TH_PERCENTILE)
+        self.assertEqual([point.bench for point in points], ['desk_site1.skp'])
+        self.assertTrue('bench_abc_data_nano.json' in warnings)
+        self.assertEqual(
+            [point.time for point in self._parse(None)[0]], [1.0, 2.5])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,11 +3,14 @@ Created on May 16, 2011
 
 @author: bungeman
 '''
+import bench_cache
 import bench_util
+import compiled_expectations
 import getopt
 import httplib
 import itertools
 import json
+import multiprocessing
 import os
 import re
 import sys
@@ -41,19 +44,41 @@ def usage():
     print '-e <file> file containing expected bench builder values/ranges.'
     print '   Will raise exception if actual bench values are out of range.'
     print '   See bench_expectations_<builder>.txt for data format / examples.'
+    print '   Files compiled by gen_bench_expectations.py are read lazily, and'
+    print '   cannot be combined with other -e files.'
     print '-r <revision> the git commit hash or svn revision for checking '
     print '   bench values.'
-
-
-class Label:
+    print '-j <processes> number of processes used to parse bench data files.'
+    print '   Defaults to 1.'
+    print '--no-cache do not use or update the parsed bench data cache.'
+    print '--manifest <file> checks many builders at once instead of -b, -d,'
+    print '   -e and -r. The file holds a JSON list of objects with the keys'
+    print '   "builder", "directory", "expectations", "revision" and optionally'
+    print '   "representation". -j then sets the number of builders checked'
+    print '   concurrently.'
+    print '--report <file> where --manifest writes its JSON report. Defaults to'
+    print '   stdout.'
+
+
+class Label(object):
     """The information in a label.
 
-    (str, str, str, str, {str:str})"""
-    def __init__(self, bench, config, time_type, settings):
+    (str, str, str, str, {str:str}[, frozenset])
+    Labels are used as dictionary keys, so the comparison key and its hash are
+    computed once, from the settings at construction. settings_key, the
+    frozenset of the settings items, can be passed by callers that make many
+    labels with equal settings, to build it only once."""
+    __slots__ = ('bench', 'config', 'time_type', 'settings', 'key', '_hash')
+
+    def __init__(self, bench, config, time_type, settings, settings_key=None):
         self.bench = bench
         self.config = config
         self.time_type = time_type
         self.settings = settings
+        if settings_key is None:
+            settings_key = frozenset(settings.iteritems())
+        self.key = (bench, config, time_type, settings_key)
+        self._hash = hash(self.key)
 
     def __repr__(self):
         return "Label(%s, %s, %s, %s)" % (
@@ -72,16 +97,18 @@ class Label:
                )
 
     def __eq__(self, other):
-        return (self.bench == other.bench and
-                self.config == other.config and
-                self.time_type == other.time_type and
-                self.settings == other.settings)
+        if not isinstance(other, Label):
+            return NotImplemented
+        return self._hash == other._hash and self.key == other.key
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
 
     def __hash__(self):
-        return (hash(self.bench) ^
-                hash(self.config) ^
-                hash(self.time_type) ^
-                hash(frozenset(self.settings.iteritems())))
+        return self._hash
 
 def create_bench_dict(revision_data_points):
     """Convert current revision data into a dictionary of line data.
@@ -95,9 +122,16 @@ def create_bench_dict(revision_data_points):
           values = the corresponding bench value
     """
     bench_dict = {}
+    # Points of a revision mostly carry equal settings, so their frozen form
+    # is only rebuilt when the settings differ in value from the last ones.
+    last_settings = None
+    settings_key = None
     for point in revision_data_points:
+        if point.settings != last_settings:
+            last_settings = dict(point.settings)
+            settings_key = frozenset(last_settings.iteritems())
         point_name = Label(point.bench,point.config,point.time_type,
-                           point.settings)
+                           last_settings, settings_key)
         if point_name not in bench_dict:
             bench_dict[point_name] = point.time
         else:
@@ -105,24 +139,115 @@ def create_bench_dict(revision_data_points):
 
     return bench_dict
 
+def parse_expectation_key(bench_entry, platform_entry):
+    """Splits the first two fields of an expectation line into a key.
+
+    Args:
+      bench_entry: string of <Bench>_<BmpConfig>_<TimeType>, where the bench
+        is an skp name ending with '.skp'.
+      platform_entry: string of <Platform>-<Alg>.
+
+    Returns:
+      a tuple of (bench, config, time_type, platform, alg) strings, matching
+      expectation_key() of the data point label, or None if the entries are
+      not of that form, e.g. for a bench that is not an skp.
+    """
+    if '.skp_' not in bench_entry or '-' not in platform_entry:
+        return None
+    bench, config_and_time_type = bench_entry.split('.skp_', 1)
+    if '_' not in config_and_time_type:
+        return None
+    config, time_type = config_and_time_type.rsplit('_', 1)
+    platform, alg = platform_entry.rsplit('-', 1)
+    return (bench + '.skp', config, time_type, platform, alg)
+
+def expectation_key(label, platform, alg):
+    """Returns the expectations dictionary key of a Label."""
+    return (label.bench, label.config, label.time_type, platform, alg)
+
 def read_expectations(expectations, filename):
-    """Reads expectations data from file and put in expectations dict."""
-    for expectation in open(filename).readlines():
+    """Reads expectations data from file and put in expectations dict.
+
+    Keys are tuples of (bench, config, time_type, platform, alg), see
+    parse_expectation_key(). Lines with other keys can match no bench data,
+    so they are skipped with a warning."""
+    for line_number, expectation in enumerate(open(filename).readlines(), 1):
         elements = expectation.strip().split(',')
         if not elements[0] or elements[0].startswith('#'):
             continue
         if len(elements) != 5:
             raise Exception("Invalid expectation line format: %s" %
                             expectation)
-        bench_entry = elements[0] + ',' + elements[1]
+        bench_entry = parse_expectation_key(elements[0], elements[1])
+        if bench_entry is None:
+            print >> sys.stderr, ('Warning: skipping expectation %s,%s at '
+                                  '%s:%d, not an skp bench' % (
+                                      elements[0], elements[1], filename,
+                                      line_number))
+            continue
         if bench_entry in expectations:
             raise Exception("Dup entries for bench expectation %s" %
-                            bench_entry)
-        # [<Bench_BmpConfig_TimeType>,<Platform-Alg>] -> (LB, UB, EXPECTED)
+                            (elements[0] + ',' + elements[1]))
+        # (Bench, BmpConfig, TimeType, Platform, Alg) -> (LB, UB, EXPECTED)
         expectations[bench_entry] = (float(elements[LB_IDX]),
                                      float(elements[UB_IDX]),
                                      float(elements[EXPECTED_IDX]))
 
+def find_out_of_range(lines, expectations, key_suffix):
+    """Finds the bench results that are outside of their expected range.
+
+    Args:
+      lines: dictionary mapping Label objects to the bench values.
+      expectations: dictionary returned by read_expectations(), or any mapping
+        with the same keys and values.
+      key_suffix: string of <Platform>-<Alg> containing the bot platform and the
+        bench representation algorithm.
+
+    Returns:
+      a tuple of (slower, faster) lists, each holding a dictionary per bench
+      out of range, sorted by decreasing off_ratio (ratio of actual to expected
+      value). Dictionaries have the keys bench, config, time_type, value,
+      expected, lower_bound, upper_bound and off_ratio.
+    """
+    platform, alg = key_suffix.rsplit('-', 1)
+    slower = []
+    faster = []
+    for line in lines:
+        key = expectation_key(line, platform, alg)
+        if key not in expectations:
+            continue
+        this_bench_value = lines[line]
+        this_min, this_max, this_expected = expectations[key]
+        if this_bench_value < this_min or this_bench_value > this_max:
+            off_ratio = this_bench_value / this_expected
+            record = {'bench': line.bench,
+                      'config': line.config,
+                      'time_type': line.time_type,
+                      'value': this_bench_value,
+                      'expected': this_expected,
+                      'lower_bound': this_min,
+                      'upper_bound': this_max,
+                      'off_ratio': off_ratio}
+            if off_ratio > 1:  # Bench is slower.
+                slower.append(record)
+            else:
+                faster.append(record)
+    for records in (slower, faster):
+        records.sort(key=lambda record: record['off_ratio'], reverse=True)
+    return (slower, faster)
+
+def load_expectations(filename):
+    """Returns the expectations of a text or compiled expectations file.
+
+    Text files are parsed with read_expectations() into a dictionary, while
+    compiled files are mapped lazily as compiled_expectations.
+    CompiledExpectations, which can be used in the same way."""
+    if compiled_expectations.is_compiled(filename):
+        return compiled_expectations.CompiledExpectations(filename)
+    expectations = {}
+    read_expectations(expectations, filename)
+    return expectations
+
 def check_expectations(lines, expectations, key_suffix):
     """Check if any bench results are outside of expected range.
 
@@ -131,7 +256,8 @@ def check_expectations(lines, expectations, key_suffix):
 
     Args:
       lines: dictionary mapping Label objects to the bench values.
-      expectations: dictionary returned by read_expectations().
+      expectations: dictionary returned by read_expectations(), or any mapping
+        with the same keys and values such as returned by load_expectations().
       key_suffix: string of <Platform>-<Alg> containing the bot platform and the
         bench representation algorithm.
 
@@ -142,41 +268,30 @@ def check_expectations(lines, expectations, key_suffix):
       Exception containing bench data that are out of range, if any.
     """
     # The platform for this bot, to pass to the dashboard plot.
-    platform = key_suffix[ : key_suffix.rfind('-')]
-    # Tuple of dictionaries recording exceptions that are slower and faster,
-    # respectively. Each dictionary maps off_ratio (ratio of actual to expected)
-    # to a list of corresponding exception messages.
-    exceptions = ({}, {})
-    for line in lines:
-        line_str = str(line)
-        line_str = line_str[ : line_str.find('_{')]
-        # Extracts bench and config from line_str, which is in the format
-        # <bench-picture-name>.skp_<config>_
-        bench, config = line_str.strip('_').split('.skp_')
-        bench_platform_key = line_str + ',' + key_suffix
-        if bench_platform_key not in expectations:
-            continue
-        this_bench_value = lines[line]
-        this_min, this_max, this_expected = expectations[bench_platform_key]
-        if this_bench_value < this_min or this_bench_value > this_max:
-            off_ratio = this_bench_value / this_expected
-            exception = 'Bench %s out of range [%s, %s] (%s vs %s, %s%%).' % (
-                bench_platform_key, this_min, this_max, this_bench_value,
-                this_expected, (off_ratio - 1) * 100)
-            exception += '\n' + '~'.join([
-                DASHBOARD_URL_PREFIX, bench, platform, config])
-            if off_ratio > 1:  # Bench is slower.
-                exceptions[SLOWER].setdefault(off_ratio, []).append(exception)
-            else:
-                exceptions[FASTER].setdefault(off_ratio, []).append(exception)
+    platform = key_suffix.rsplit('-', 1)[0]
+    # Tuple of lists of exceptions that are slower and faster, respectively.
+    out_of_range = find_out_of_range(lines, expectations, key_suffix)
     outputs = []
     for i in [SLOWER, FASTER]:
-      if exceptions[i]:
-          ratios = exceptions[i].keys()
-          ratios.sort(reverse=True)
+      if out_of_range[i]:
           li = []
-          for ratio in ratios:
-              li.extend(exceptions[i][ratio])
+          for record in out_of_range[i]:
+              bench_platform_key = '%s_%s_%s,%s' % (
+                  record['bench'], record['config'], record['time_type'],
+                  key_suffix)
+              # The dashboard names benches without the '.skp' suffix, and
+              # configs of non-walltime benches with the time type appended.
+              bench = record['bench'][:-len('.skp')]
+              config = '_'.join(filter(None, [record['config'],
+                                              record['time_type']]))
+              exception = (
+                  'Bench %s out of range [%s, %s] (%s vs %s, %s%%).' % (
+                      bench_platform_key, record['lower_bound'],
+                      record['upper_bound'], record['value'],
+                      record['expected'], (record['off_ratio'] - 1) * 100))
+              exception += '\n' + '~'.join([
+                  DASHBOARD_URL_PREFIX, bench, platform, config])
+              li.append(exception)
           header = '%s benches got slower (sorted by %% difference):' % len(li)
           if i == FASTER:
               header = header.replace('slower', 'faster')
@@ -189,23 +304,91 @@ def check_expectations(lines, expectations, key_suffix):
         sys.stderr.write('\n'.join(['Exception:'] + outputs + ['\n']))
         exit(1)
 
+# Expectations of all batch entries, keyed by expectations file name. Set in
+# each batch worker process by _InitBatchWorker().
+_batch_expectations = {}
+
+def _InitBatchWorker(expectations_by_file):
+    global _batch_expectations
+    _batch_expectations = expectations_by_file
+
+def _CheckBatchEntry(args):
+    """Checks one builder of a batch manifest. Runs in pool workers, so takes
+    one tuple.
+
+    args: tuple of (manifest entry, bench_cache.BenchCache or None).
+    Returns the report dictionary of the entry, see check_batch().
+    """
+    entry, cache = args
+    rep = entry.get('representation', '25th')
+    platform_and_alg = entry['builder'] + '-' + rep
+    data_points = bench_util.parse_skp_bench_data(
+        entry['directory'], entry['revision'], rep,
+        store=bench_util.BenchDataStore(), cache=cache)
+    slower, faster = find_out_of_range(
+        create_bench_dict(data_points),
+        _batch_expectations[entry['expectations']], platform_and_alg)
+    return {'builder': entry['builder'],
+            'revision': entry['revision'],
+            'representation': rep,
+            'slower': slower,
+            'faster': faster}
+
+def check_batch(manifest, processes=1, cache=None):
+    """Checks the bench data of many builders against their expectations.
+
+    Args:
+      manifest: list of dictionaries with the keys builder, directory,
+        expectations (file name) and revision, and optionally representation
+        (defaults to 25th). See the options of the same meaning in usage().
+      processes: number of builders checked concurrently.
+      cache: optional bench_cache.BenchCache of parsed bench data.
+
+    Returns:
+      a list with a dictionary per manifest entry, in manifest order, with the
+      keys builder, revision, representation, and slower and faster as
+      returned by find_out_of_range().
+    """
+    # Each expectations file is read once, however many builders use it.
+    expectations_by_file = {}
+    for entry in manifest:
+        if entry['expectations'] not in expectations_by_file:
+            expectations_by_file[entry['expectations']] = load_expectations(
+                entry['expectations'])
+    jobs = [(entry, cache) for entry in manifest]
+    if processes > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(processes, len(jobs)),
+                                    _InitBatchWorker, (expectations_by_file,))
+        try:
+            return pool.map(_CheckBatchEntry, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    _InitBatchWorker(expectations_by_file)
+    return [_CheckBatchEntry(job) for job in jobs]
+
 
 def main():
     """Parses command line and checks bench expectations."""
     try:
         opts, _ = getopt.getopt(sys.argv[1:],
-                                "a:b:d:e:r:",
-                                "default-setting=")
+                                "a:b:d:e:j:r:",
+                                ["default-setting=", "no-cache", "manifest=",
+                                 "report="])
     except getopt.GetoptError, err:
         print str(err)
         usage()
         sys.exit(2)
 
     directory = None
-    bench_expectations = {}
+    expectation_files = []
     rep = '25th'  # bench representation algorithm, default to 25th
     rev = None  # git commit hash or svn revision number
     bot = None
+    processes = 1
+    cache = bench_cache.BenchCache()
+    manifest = None
+    report = None
 
     try:
         for option, value in opts:
@@ -216,9 +399,17 @@ def main():
             elif option == "-d":
                 directory = value
             elif option == "-e":
-                read_expectations(bench_expectations, value)
+                expectation_files.append(value)
+            elif option == "-j":
+                processes = int(value)
             elif option == "-r":
                 rev = value
+            elif option == "--no-cache":
+                cache = None
+            elif option == "--manifest":
+                manifest = value
+            elif option == "--report":
+                report = value
             else:
                 usage()
                 assert False, "unhandled option"
@@ -226,13 +417,41 @@ def main():
         usage()
         sys.exit(2)
 
+    if manifest:
+        with open(manifest) as manifest_file:
+            results = check_batch(json.load(manifest_file), processes, cache)
+        if report:
+            with open(report, 'w') as report_file:
+                json.dump({'builders': results}, report_file, indent=2,
+                          sort_keys=True)
+        else:
+            json.dump({'builders': results}, sys.stdout, indent=2,
+                      sort_keys=True)
+            print
+        if any(result['slower'] or result['faster'] for result in results):
+            exit(1)
+        return
+
     if directory is None or bot is None or rev is None:
         usage()
         sys.exit(2)
 
+    if (len(expectation_files) > 1 and
+        any(map(compiled_expectations.is_compiled, expectation_files))):
+        usage()
+        sys.exit(2)
+    if len(expectation_files) == 1:
+        bench_expectations = load_expectations(expectation_files[0])
+    else:
+        bench_expectations = {}
+        for expectation_file in expectation_files:
+            read_expectations(bench_expectations, expectation_file)
+
     platform_and_alg = bot + '-' + rep
 
-    data_points = bench_util.parse_skp_bench_data(directory, rev, rep)
+    data_points = bench_util.parse_skp_bench_data(
+        directory, rev, rep, store=bench_util.BenchDataStore(),
+        processes=processes, cache=cache)
 
     bench_dict = create_bench_dict(data_points)
 
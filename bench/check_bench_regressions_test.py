@@ -0,0 +1,77 @@
+#!/usr/bin/python
+
+# Copyright 2015 Google Inc.
+#
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+Test check_bench_regressions.
+"""
+
+import StringIO
+import check_bench_regressions
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+
+PLATFORM = 'Perf-Ubuntu12-ShuttleA-GTX660-x86-Release'
+
+
+class ReadExpectationsTest(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._temp_dir, 'bench_expectations.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_dir)
+
+    def _read(self, content):
+        with open(self._path, 'w') as file_handle:
+            file_handle.write(content)
+        expectations = {}
+        stderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+        try:
+            check_bench_regressions.read_expectations(expectations,
+                                                      self._path)
+            return expectations, sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+
+    def test_parse_key(self):
+        self.assertEqual(
+            check_bench_regressions.parse_expectation_key(
+                'desk_gmail.skp_simple_viewport_1000x1000_gpu_c',
+                PLATFORM + '-25th'),
+            ('desk_gmail.skp', 'simple_viewport_1000x1000_gpu', 'c',
+             PLATFORM, '25th'))
+        for bench_entry, platform_entry in (
+                ('bitmap_8888_c', PLATFORM + '-25th'),
+                ('desk_gmail.skp_8888', PLATFORM + '-25th'),
+                ('desk_gmail.skp_8888_c', 'platform')):
+            self.assertEqual(check_bench_regressions.parse_expectation_key(
+                bench_entry, platform_entry), None)
+
+    def test_skips_other_keys(self):
+        expectations, warnings = self._read(
+            '# Bench expectations.\n'
+            'desk_gmail.skp_8888_,%(platform)s-25th,10.0,9.0,11.0\n'
+            'bitmap_8888_c,%(platform)s-25th,1.0,0.5,1.5\n'
+            'desk_yahoo.skp_gpu_c,%(platform)s-25th,20.0,18.0,22.0\n' % {
+                'platform': PLATFORM})
+        self.assertEqual(expectations, {
+            ('desk_gmail.skp', '8888', '', PLATFORM, '25th'):
+                (9.0, 11.0, 10.0),
+            ('desk_yahoo.skp', 'gpu', 'c', PLATFORM, '25th'):
+                (18.0, 22.0, 20.0)})
+        self.assertTrue('bitmap_8888_c' in warnings)
+        self.assertTrue('%s:3' % self._path in warnings)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,216 @@
+'''
+Compact binary form of bench expectations files.
+
+bench_expectations_<builder>.txt files stay the format for review and
+interchange. They can also be compiled: a sorted table of keys followed by
+arrays of expected values and bounds, which check_bench_regressions.py
+memory-maps and binary-searches without parsing the whole file. Compiled files
+are made from the text files, e.g. hand-edited ones, with
+
+  compiled_expectations.py <text expectations file> <compiled file>
+
+or by gen_bench_expectations.py, which compiles the text file it writes, so
+both files always hold the same values.
+
+File layout (little-endian):
+  header:      8-byte MAGIC, uint32 entry count n, uint32 key blob size
+  key offsets: n + 1 uint32 offsets of each key into the key blob
+  key blob:    keys joined with KEY_SEPARATOR, sorted bytewise
+  padding:     zero bytes up to a multiple of 8
+  values:      n float64 expected values, then n lower bounds, then n upper
+               bounds
+'''
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+from array import array
+
+MAGIC = 'SKBEXP1\n'
+
+# Separates the (bench, config, time_type, platform, alg) fields of a key.
+KEY_SEPARATOR = '\x1f'
+
+_HEADER = struct.Struct('<8sII')
+_OFFSET = struct.Struct('<I')
+_VALUE = struct.Struct('<d')
+
+
+def _encode_key(key):
+    return KEY_SEPARATOR.join(key)
+
+
+def is_compiled(filename):
+    """Returns whether filename holds compiled expectations."""
+    with open(filename, 'rb') as file_handle:
+        return file_handle.read(len(MAGIC)) == MAGIC
+
+
+def write_compiled_expectations(filename, expectations):
+    """Writes expectations in the compiled format.
+
+    Args:
+      filename: path of the output file, replaced atomically.
+      expectations: dictionary mapping (bench, config, time_type, platform,
+        alg) tuples to (lower_bound, upper_bound, expected) tuples, as filled
+        by check_bench_regressions.read_expectations().
+    """
+    encoded = sorted((_encode_key(key), value)
+                     for key, value in expectations.iteritems())
+    offsets = array('I', [0])
+    blob = []
+    for key, _ in encoded:
+        blob.append(key)
+        offsets.append(offsets[-1] + len(key))
+    blob = ''.join(blob)
+    expected = array('d', [value[2] for _, value in encoded])
+    lower_bounds = array('d', [value[0] for _, value in encoded])
+    upper_bounds = array('d', [value[1] for _, value in encoded])
+    if sys.byteorder == 'big':
+        for values in (offsets, expected, lower_bounds, upper_bounds):
+            values.byteswap()
+
+    header_size = _HEADER.size + len(offsets) * _OFFSET.size + len(blob)
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, temp_path = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as file_handle:
+            file_handle.write(_HEADER.pack(MAGIC, len(encoded), len(blob)))
+            file_handle.write(offsets.tostring())
+            file_handle.write(blob)
+            file_handle.write('\0' * (-header_size % _VALUE.size))
+            for values in (expected, lower_bounds, upper_bounds):
+                file_handle.write(values.tostring())
+        os.rename(temp_path, filename)
+    except:
+        os.remove(temp_path)
+        raise
+
+
+def compile_expectations_file(text_filename, filename):
+    """Compiles the text expectations file text_filename into filename.
+
+    The values are those check_bench_regressions.py reads from the text file,
+    so lookups in both files give identical results.
+    """
+    # Imported here, as check_bench_regressions imports this module.
+    import check_bench_regressions
+    expectations = {}
+    check_bench_regressions.read_expectations(expectations, text_filename)
+    write_compiled_expectations(filename, expectations)
+
+
+class CompiledExpectations(object):
+    """Read-only mapping over a compiled expectations file.
+
+    Keys and values are as in the dictionary filled by
+    check_bench_regressions.read_expectations(). The file is memory-mapped and
+    entries are found by binary search, so only the pages touched by lookups
+    are read. Pickling keeps only the file name; the file is mapped again when
+    unpickled, e.g. in a worker process.
+    """
+    def __init__(self, filename):
+        self._open(filename)
+
+    def _open(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as file_handle:
+            self._map = mmap.mmap(file_handle.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        magic, self._count, blob_size = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise Exception('Not a compiled expectations file: %s' % filename)
+        self._offsets_start = _HEADER.size
+        self._blob_start = (self._offsets_start +
+                            (self._count + 1) * _OFFSET.size)
+        values_start = self._blob_start + blob_size
+        values_start += -values_start % _VALUE.size
+        self._values_start = values_start
+
+    def __getstate__(self):
+        return self.filename
+
+    def __setstate__(self, filename):
+        self._open(filename)
+
+    def close(self):
+        self._map.close()
+
+    def __len__(self):
+        return self._count
+
+    def _key_at(self, index):
+        start = _OFFSET.unpack_from(
+            self._map, self._offsets_start + index * _OFFSET.size)[0]
+        end = _OFFSET.unpack_from(
+            self._map, self._offsets_start + (index + 1) * _OFFSET.size)[0]
+        return self._map[self._blob_start + start:self._blob_start + end]
+
+    def _value_at(self, column, index):
+        return _VALUE.unpack_from(
+            self._map, self._values_start +
+            (column * self._count + index) * _VALUE.size)[0]
+
+    def _find(self, key):
+        """Returns the index of key, or -1."""
+        encoded = _encode_key(key)
+        low = 0
+        high = self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key_at(middle) < encoded:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._count and self._key_at(low) == encoded:
+            return low
+        return -1
+
+    def _entry(self, index):
+        # Columns are stored as expected, lower bound, upper bound.
+        return (self._value_at(1, index), self._value_at(2, index),
+                self._value_at(0, index))
+
+    def __contains__(self, key):
+        return self._find(key) >= 0
+
+    def __getitem__(self, key):
+        index = self._find(key)
+        if index < 0:
+            raise KeyError(key)
+        return self._entry(index)
+
+    def get(self, key, default=None):
+        index = self._find(key)
+        if index < 0:
+            return default
+        return self._entry(index)
+
+    def __iter__(self):
+        for index in xrange(self._count):
+            yield tuple(self._key_at(index).split(KEY_SEPARATOR))
+
+    def iteritems(self):
+        for index in xrange(self._count):
+            yield (tuple(self._key_at(index).split(KEY_SEPARATOR)),
+                   self._entry(index))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compiles a bench expectations file for '
+                    'check_bench_regressions.py.')
+    parser.add_argument('text_file',
+                        help='the bench expectations file to compile.')
+    parser.add_argument('compiled_file',
+                        help='the compiled file to write.')
+    args = parser.parse_args()
+    compile_expectations_file(args.text_file, args.compiled_file)
+
+
+if __name__ == '__main__':
+    main()
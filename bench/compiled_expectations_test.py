@@ -0,0 +1,139 @@
+#!/usr/bin/python
+
+# Copyright 2015 Google Inc.
+#
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+Test compiled_expectations.
+"""
+
+import check_bench_regressions
+import compiled_expectations
+import os
+import pickle
+import random
+import shutil
+import tempfile
+import unittest
+
+
+def make_expectations(count, seed=0):
+    rand = random.Random(seed)
+    expectations = {}
+    for i in range(count):
+        key = ('bench_%d.skp' % rand.randrange(count * 10),
+               rand.choice(['simple_viewport_1000x1000',
+                            'simple_viewport_1000x1000_gpu']),
+               rand.choice(['', 'c']),
+               'Perf-Ubuntu12-ShuttleA-GTX660-x86-Release',
+               '25th')
+        expected = rand.uniform(1, 100)
+        expectations[key] = (expected - rand.uniform(0, 10),
+                             expected + rand.uniform(0, 10), expected)
+    return expectations
+
+
+def write_text_expectations(path, expectations, value_format):
+    """Writes expectations as gen_bench_expectations.py does, with values
+    formatted by value_format."""
+    with open(path, 'w') as text_file:
+        for (bench, config, time_type, platform, alg), (lower, upper,
+                                                        expected) in (
+                sorted(expectations.iteritems())):
+            text_file.write(('%s_%s_%s,%s-%s,' + ','.join([value_format] * 3) +
+                             '\n') % (bench, config, time_type, platform, alg,
+                                      expected, lower, upper))
+
+
+class CompiledExpectationsTest(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._temp_dir, 'bench_expectations.bin')
+        self._text_path = os.path.join(self._temp_dir,
+                                       'bench_expectations.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_dir)
+
+    def _compile(self, expectations):
+        compiled_expectations.write_compiled_expectations(self._path,
+                                                          expectations)
+        return compiled_expectations.CompiledExpectations(self._path)
+
+    def test_round_trip(self):
+        expectations = make_expectations(500)
+        compiled = self._compile(expectations)
+        self.assertTrue(compiled_expectations.is_compiled(self._path))
+        self.assertEqual(len(compiled), len(expectations))
+        self.assertEqual(dict(compiled.iteritems()), expectations)
+        self.assertEqual(sorted(compiled), sorted(expectations))
+        for key, value in expectations.iteritems():
+            self.assertTrue(key in compiled)
+            self.assertEqual(compiled[key], value)
+            self.assertEqual(compiled.get(key), value)
+        compiled.close()
+
+    def test_missing_keys(self):
+        expectations = make_expectations(50)
+        compiled = self._compile(expectations)
+        first = min(expectations)
+        last = max(expectations)
+        for key in (('', '', '', '', ''),
+                    first[:4] + ('med',),
+                    ('zzz',) + last[1:],
+                    first[:1] + ('simple_viewport_1000x1000_angle',) +
+                    first[2:]):
+            self.assertFalse(key in compiled)
+            self.assertEqual(compiled.get(key, 'default'), 'default')
+            self.assertRaises(KeyError, compiled.__getitem__, key)
+        compiled.close()
+
+    def test_empty(self):
+        compiled = self._compile({})
+        self.assertEqual(len(compiled), 0)
+        self.assertEqual(list(compiled), [])
+        self.assertFalse(('a', 'b', 'c', 'd', 'e') in compiled)
+        compiled.close()
+
+    def test_pickle(self):
+        expectations = make_expectations(20)
+        compiled = pickle.loads(pickle.dumps(self._compile(expectations)))
+        self.assertEqual(dict(compiled.iteritems()), expectations)
+        compiled.close()
+
+    def test_matches_text_expectations(self):
+        expectations = make_expectations(100)
+        write_text_expectations(self._text_path, expectations, '%r')
+        self.assertFalse(compiled_expectations.is_compiled(self._text_path))
+        text_expectations = check_bench_regressions.load_expectations(
+            self._text_path)
+        self.assertEqual(text_expectations, expectations)
+        compiled = self._compile(text_expectations)
+        self.assertEqual(dict(compiled.iteritems()), text_expectations)
+        compiled.close()
+
+    def test_compile_text_file(self):
+        # Values rounded by '%s', as gen_bench_expectations.py writes them,
+        # with a comment and a blank line as in hand-edited files.
+        write_text_expectations(self._text_path, make_expectations(100),
+                                '%s')
+        with open(self._text_path, 'a') as text_file:
+            text_file.write('\n# Edited by hand.\n')
+        compiled_expectations.compile_expectations_file(self._text_path,
+                                                        self._path)
+        text_expectations = check_bench_regressions.load_expectations(
+            self._text_path)
+        compiled = check_bench_regressions.load_expectations(self._path)
+        self.assertTrue(isinstance(compiled,
+                                   compiled_expectations.CompiledExpectations))
+        self.assertEqual(len(compiled), len(text_expectations))
+        for key, value in text_expectations.iteritems():
+            self.assertEqual(compiled[key], value)
+        compiled.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,8 +6,13 @@
 """ Generate bench_expectations file from a given set of bench data files. """
 
 import argparse
+import bench_cache
+import bench_data_fetcher
 import bench_util
+import compiled_expectations
+import hashlib
 import json
+import multiprocessing
 import os
 import re
 import sys
@@ -20,6 +25,13 @@ ERR_RATIO = 0.08  # Further widens the range by the ratio of average value.
 ERR_UB = 1.0  # Adds an absolute upper error to cope with small benches.
 ERR_LB = 1.5
 
+# Parameters of the robust range estimator, see robust_ranges().
+ROBUST_HISTORY_COMMITS = 10  # Uses samples of at most this many commits back.
+ROBUST_DECAY = 0.8  # Weight ratio of samples one commit further back.
+ROBUST_QUANTILES = (0.05, 0.95)  # Weighted quantiles the range must include.
+ROBUST_MAD_SCALE = 1.4826  # Makes the MAD estimate the standard deviation.
+ROBUST_MAD_RATIO = 4.0  # Range half-width in scaled MADs around the median.
+
 # List of bench configs to monitor. Ignore all other configs.
 CONFIGS_TO_INCLUDE = ['simple_viewport_1000x1000',
                       'simple_viewport_1000x1000_angle',
@@ -38,7 +50,13 @@ CONFIGS_TO_INCLUDE = ['simple_viewport_1000x1000',
 ENTRIES_TO_EXCLUDE = [
                      ]
 
-_GS_CLOUD_FORMAT = 'http://storage.googleapis.com/chromium-skia-gm/perfdata/%s/%s'
+# Suffix of the file next to the output file in which --incremental keeps the
+# digest of the builder's input files and the input digest and values of each
+# expectation.
+DIGESTS_FILE_SUFFIX = '.digests'
+
+# Bump when the digests file or the inputs of its digests change.
+DIGESTS_VERSION = 2
 
 def compute_ranges(benches, more_benches=None):
   """Given a list of bench numbers, calculate the alert range.
@@ -62,12 +80,167 @@ def compute_ranges(benches, more_benches=None):
           maximum + diff*RANGE_RATIO_UPPER + avg*ERR_RATIO + ERR_UB]
 
 
-def create_expectations_dict(revision_data_points, builder, extra_data=None):
+def spread_ranges(series):
+  """Range estimator widening the spread of the current commit's samples.
+
+  Args:
+    series: a list of (benches, more_benches) tuples, as the arguments of
+      compute_ranges().
+
+  Returns:
+    a list of float [lower_bound, upper_bound] per element of series.
+  """
+  return [compute_ranges(benches, more_benches)
+          for benches, more_benches in series]
+
+
+def _weighted_quantiles(samples, num_groups, quantiles):
+  """Computes weighted quantiles of many groups of samples at once.
+
+  Args:
+    samples: a list of (group, value, weight) tuples sorted by group and
+      value, with groups numbered from 0 to num_groups - 1.
+    num_groups: the number of groups.
+    quantiles: a sorted list of floats in [0, 1].
+
+  Returns:
+    a list with, for each group, the list of its values at quantiles, or None
+    if the group has no samples.
+  """
+  totals = [0.0] * num_groups
+  for group, _, weight in samples:
+    totals[group] += weight
+  results = [None] * num_groups
+  current = None
+  for group, value, weight in samples:
+    if group != current:
+      current = group
+      cumulative = 0.0
+      found = []
+      targets = [q * totals[group] for q in quantiles]
+      results[group] = found
+    cumulative += weight
+    while len(found) < len(targets) and cumulative >= targets[len(found)]:
+      found.append(value)
+  return results
+
+
+def robust_ranges(series):
+  """Range estimator using the recent history of each bench.
+
+  The per-iteration samples of the current commit and of the commits at most
+  ROBUST_HISTORY_COMMITS back are pooled, each weighted by
+  ROBUST_DECAY to the power of its number of commits back. The range is the
+  weighted median plus or minus ROBUST_MAD_RATIO scaled weighted median
+  absolute deviations, extended to include the ROBUST_QUANTILES and widened
+  by the same error terms as compute_ranges(). One noisy commit therefore
+  moves the range much less than with spread_ranges().
+
+  All benches are estimated together: their samples are sorted in a single
+  pass for the quantiles and another for the deviations.
+
+  Args:
+    series: a list of (benches, more_benches) tuples, as the arguments of
+      compute_ranges().
+
+  Returns:
+    a list of float [lower_bound, upper_bound] per element of series.
+  """
+  samples = []
+  for group, (benches, more_benches) in enumerate(series):
+    samples.extend((group, value, 1.0) for value in benches)
+    for idx, values in more_benches or []:
+      if idx <= ROBUST_HISTORY_COMMITS:
+        weight = ROBUST_DECAY ** idx
+        samples.extend((group, value, weight) for value in values)
+  samples.sort()
+  quantiles = _weighted_quantiles(
+      samples, len(series), [ROBUST_QUANTILES[0], 0.5, ROBUST_QUANTILES[1]])
+
+  deviations = [(group, abs(value - quantiles[group][1]), weight)
+                for group, value, weight in samples]
+  deviations.sort()
+  mads = _weighted_quantiles(deviations, len(series), [0.5])
+
+  ranges = []
+  for group, group_quantiles in enumerate(quantiles):
+    if group_quantiles is None:
+      # Nothing to estimate from; fails as compute_ranges() does.
+      ranges.append(compute_ranges(*series[group]))
+      continue
+    low, median, high = group_quantiles
+    mad = mads[group][0]
+    width = ROBUST_MAD_RATIO * ROBUST_MAD_SCALE * mad
+    ranges.append([min(low, median - width) - median*ERR_RATIO - ERR_LB,
+                   max(high, median + width) + median*ERR_RATIO + ERR_UB])
+  return ranges
+
+
+# Range estimators selectable with --estimator. Each takes a list of
+# (benches, more_benches) tuples, as the arguments of compute_ranges(), and
+# returns a list of [lower_bound, upper_bound] per tuple, so that estimators
+# can process all benches of a builder in one batch.
+RANGE_ESTIMATORS = {
+    'spread': spread_ranges,
+    'robust': robust_ranges,
+}
+DEFAULT_ESTIMATOR = 'spread'
+
+# Default --max_commits of each estimator: robust weighs up to
+# ROBUST_HISTORY_COMMITS commits of history, which must be loaded for it.
+DEFAULT_MAX_COMMITS = {
+    'spread': 1,
+    'robust': ROBUST_HISTORY_COMMITS,
+}
+
+
+def index_extra_data(extra_data):
+  """Indexes the per-iteration times of earlier commits by bench key.
+
+  Args:
+    extra_data: an iterable of (idx, data points) tuples, where idx is the
+      number of commits before the current one that the data points are at.
+
+  Returns:
+    a dictionary mapping (bench, config, time_type) to a list of
+    (idx, per_iter_time) tuples, in the order of extra_data. Only walltime
+    points of CONFIGS_TO_INCLUDE with per-iteration times are indexed.
+  """
+  extras_by_key = {}
+  for idx, dataset in extra_data:
+    for data in dataset:
+      if data.time_type or data.config not in CONFIGS_TO_INCLUDE:
+        continue
+      per_iter_time = data.per_iter_time
+      if per_iter_time:
+        extras_by_key.setdefault(
+            (data.bench, data.config, data.time_type), []).append(
+                (idx, per_iter_time))
+  return extras_by_key
+
+
+def _input_digest(point, extras):
+  """Returns a digest of the inputs of the expectation of a data point."""
+  return hashlib.sha1(repr((point.time, point.per_iter_time,
+                            extras))).hexdigest()
+
+
+def create_expectations_dict(revision_data_points, builder, extra_data=None,
+                             estimator=DEFAULT_ESTIMATOR, previous=None,
+                             digests=None):
   """Convert list of bench data points into a dictionary of expectations data.
 
   Args:
     revision_data_points: a list of BenchDataPoint objects.
     builder: string of the corresponding buildbot builder name.
+    extra_data: an iterable of (idx, data points) tuples of earlier commits,
+      see index_extra_data(). They are joined to the current points by key in
+      a single pass, so any number of commits can be used.
+    estimator: name of the range estimator in RANGE_ESTIMATORS to use.
+    previous: an optional dictionary mapping keys as below to (digest, values)
+      tuples of an earlier run with the same estimator. Values of keys whose
+      input digest is unchanged are reused instead of estimated again.
+    digests: an optional dictionary, filled with the input digest of each key.
 
   Returns:
     a dictionary of this form:
@@ -75,6 +248,9 @@ def create_expectations_dict(revision_data_points, builder, extra_data=None):
         values = list of float [expected, lower_bound, upper_bound] for the key.
   """
   bench_dict = {}
+  keys = []
+  series = []
+  extras_by_key = index_extra_data(extra_data or [])
   for point in revision_data_points:
     if (point.time_type or  # Not walltime which has time_type ''
         not point.config in CONFIGS_TO_INCLUDE):
@@ -89,16 +265,26 @@ def create_expectations_dict(revision_data_points, builder, extra_data=None):
       continue
     key = (point.config, point.bench)
 
-    extras = []
-    for idx, dataset in extra_data:
-      for data in dataset:
-        if (data.bench == point.bench and data.config == point.config and
-              data.time_type == point.time_type and data.per_iter_time):
-          extras.append((idx, data.per_iter_time))
+    extras = extras_by_key.get((point.bench, point.config, point.time_type),
+                               [])
 
     if key in bench_dict:
       raise Exception('Duplicate bench entry: ' + str(key))
-    bench_dict[key] = [point.time] + compute_ranges(point.per_iter_time, extras)
+    if previous is not None or digests is not None:
+      digest = _input_digest(point, extras)
+      if digests is not None:
+        digests[key] = digest
+      if previous is not None and key in previous:
+        previous_digest, previous_values = previous[key]
+        if previous_digest == digest:
+          bench_dict[key] = list(previous_values)
+          continue
+    bench_dict[key] = [point.time]
+    keys.append(key)
+    series.append((point.per_iter_time, extras))
+
+  for key, bench_range in zip(keys, RANGE_ESTIMATORS[estimator](series)):
+    bench_dict[key].extend(bench_range)
 
   return bench_dict
 
@@ -123,22 +309,279 @@ def get_file_suffixes(commit_hash, directory):
       if name.startswith(prefix)]
 
 
-def download_bench_data(builder, commit_hash, suffixes, directory):
-  """Downloads data, returns the number successfully downloaded"""
-  cur_files = os.listdir(directory)
-  count = 0
-  for suffix in suffixes:
-    file_name = 'bench_'+commit_hash+'_data_'+suffix
-    if file_name in cur_files:
-      continue
+def download_bench_data(builder, commit_hashes, suffixes, directory,
+                        fetcher=None):
+  """Downloads data of all commits concurrently.
+
+  Args:
+    builder: string of the buildbot builder name.
+    commit_hashes: a list of commit hashes, or a single one.
+    suffixes: a list of bench data file suffixes.
+    directory: the directory to download into; existing files are kept.
+    fetcher: a bench_data_fetcher.BenchDataFetcher, by default fetching from
+      Google Storage.
+
+  Returns:
+    the number of files of the commit in directory after downloading,
+    whether downloaded now or before, or a list of those numbers per commit if
+    commit_hashes is a list.
+  """
+  if fetcher is None:
+    fetcher = bench_data_fetcher.BenchDataFetcher(
+        bench_data_fetcher.HttpBackend())
+  single_commit = isinstance(commit_hashes, basestring)
+  if single_commit:
+    commit_hashes = [commit_hashes]
+  requests = [(builder, 'bench_'+commit_hash+'_data_'+suffix, directory)
+              for commit_hash in commit_hashes for suffix in suffixes]
+  fetcher.fetch(requests)
+  present = [os.path.exists(os.path.join(directory, file_name))
+             for _, file_name, directory in requests]
+  counts = [sum(present[idx*len(suffixes):(idx + 1)*len(suffixes)])
+            for idx in range(len(commit_hashes))]
+  if single_commit:
+    return counts[0]
+  return counts
+
+
+def digest_parameters(max_commits, back_track):
+  """Returns the parameters besides bench data that expectations depend on,
+  as they are kept in digests files."""
+  return {'parser_version': bench_util.PARSER_VERSION,
+          'range_ratio_upper': RANGE_RATIO_UPPER,
+          'range_ratio_lower': RANGE_RATIO_LOWER,
+          'err_ratio': ERR_RATIO,
+          'err_ub': ERR_UB,
+          'err_lb': ERR_LB,
+          'robust_history_commits': ROBUST_HISTORY_COMMITS,
+          'robust_decay': ROBUST_DECAY,
+          'robust_quantiles': list(ROBUST_QUANTILES),
+          'robust_mad_scale': ROBUST_MAD_SCALE,
+          'robust_mad_ratio': ROBUST_MAD_RATIO,
+          'configs': CONFIGS_TO_INCLUDE,
+          'excluded': ENTRIES_TO_EXCLUDE,
+          'max_commits': max_commits,
+          'back_track': back_track}
+
+
+def input_files_digest(input_dir, commit_hashes):
+  """Returns a digest of the names and contents of the bench data files of
+  commit_hashes in input_dir.
+
+  It is taken before downloading, so it covers the files of earlier commits
+  that a previous run downloaded. Files uploaded since for commits that a
+  previous run found nothing of are only seen once other inputs change.
+  """
+  names = [name for name in os.listdir(input_dir)
+           if not name.endswith(bench_data_fetcher.PART_SUFFIX)]
+  digest = hashlib.sha1()
+  for commit_hash in commit_hashes:
+    prefix = 'bench_' + commit_hash + '_data'
+    for name in sorted(name for name in names if name.startswith(prefix)):
+      file_digest = hashlib.sha1()
+      with open(os.path.join(input_dir, name), 'rb') as file_handle:
+        for chunk in iter(lambda: file_handle.read(
+            bench_cache.READ_CHUNK_BYTES), ''):
+          file_digest.update(chunk)
+      digest.update('%s\0%s\0' % (name, file_digest.hexdigest()))
+  return digest.hexdigest()
+
+
+def read_digests(filename, builder, representation, estimator, parameters):
+  """Reads the digests file written by write_digests().
+
+  Returns:
+    a tuple of (input files digest, previous argument of
+    create_expectations_dict()), or None if the file does not exist or was
+    written with other parameters.
+  """
+  try:
+    with open(filename) as file_handle:
+      content = json.load(file_handle)
+  except (IOError, ValueError):
+    return None
+  if (content.get('version') != DIGESTS_VERSION or
+      content.get('builder') != builder or
+      content.get('representation') != representation or
+      content.get('estimator') != estimator or
+      content.get('parameters') != json.loads(json.dumps(parameters))):
+    return None
+  previous = {}
+  for config, bench, digest, values in content['entries']:
+    previous[(config, bench)] = (digest, values)
+  return content['inputs'], previous
+
+
+def write_digests(filename, builder, representation, estimator, parameters,
+                  inputs_digest, expectations_dict, digests):
+  """Writes the digest of the input files, and the input digest and values of
+  each expectation to filename."""
+  entries = [[config, bench, digests[(config, bench)],
+              expectations_dict[(config, bench)]]
+             for config, bench in sorted(expectations_dict)]
+  temp_path = filename + '.tmp'
+  with open(temp_path, 'w') as file_handle:
+    json.dump({'version': DIGESTS_VERSION,
+               'builder': builder,
+               'representation': representation,
+               'estimator': estimator,
+               'parameters': parameters,
+               'inputs': inputs_digest,
+               'entries': entries}, file_handle)
+  os.rename(temp_path, filename)
+
+
+def generate_expectations(args, builder, input_dir, git_revision, output_file,
+                          compiled_output_file=None, processes=1):
+  """Computes the expectations of one builder and writes them out.
+
+  Args:
+    args: the parsed command line, for the options shared by all builders.
+    builder, input_dir, git_revision, output_file, compiled_output_file: as
+      the command line options of the same names.
+    processes: the number of processes used to parse bench data files.
+
+  Returns:
+    a tuple of (number of expectations, number of them estimated again),
+    which differ only with --incremental. Nothing is estimated again if the
+    input files and parameters are those of the previous run.
+  """
+  parent_commits = get_parent_commits(git_revision, args.back_track)
+  print "Using commits: {}".format(parent_commits)
+  suffixes = get_file_suffixes(git_revision, input_dir)
+  print "Using suffixes: {}".format(suffixes)
+
+  previous = None
+  digests = None
+  digests_file = output_file + DIGESTS_FILE_SUFFIX
+  if args.incremental:
+    digests = {}
+    parameters = digest_parameters(args.max_commits, args.back_track)
+    inputs_digest = input_files_digest(input_dir,
+                                       [git_revision] + parent_commits)
+    outputs = [output_file]
+    if compiled_output_file:
+      outputs.append(compiled_output_file)
+    if all(os.path.exists(path) for path in outputs):
+      previous_run = read_digests(digests_file, builder,
+                                  args.representation_alg, args.estimator,
+                                  parameters)
+      if previous_run is not None:
+        previous_inputs_digest, previous = previous_run
+        if previous_inputs_digest == inputs_digest:
+          print 'Inputs of %s unchanged, keeping %s' % (builder, output_file)
+          return (len(previous), 0)
+
+  cache = None if args.no_cache else bench_cache.BenchCache()
+
+  data_points = bench_util.parse_skp_bench_data(
+      input_dir, git_revision, args.representation_alg,
+      store=bench_util.BenchDataStore(), processes=processes, cache=cache)
+
+  # TODO(kelvinly): Find a better approach to than directly copying from
+  # the GS server?
+  if args.source_dir:
+    backend = bench_data_fetcher.LocalDirectoryBackend(args.source_dir)
+  else:
+    backend = bench_data_fetcher.HttpBackend()
+  fetcher = bench_data_fetcher.BenchDataFetcher(backend, args.fetch_threads)
+  # Files already in input_dir count as well as downloaded ones, so that
+  # repeated runs on the same directory use the same history.
+  num_files_before = len(os.listdir(input_dir))
+  downloaded_commits = []
+  for idx, (commit, num_downloaded) in enumerate(zip(
+      parent_commits, download_bench_data(
+          builder, parent_commits, suffixes, input_dir, fetcher))):
+    # The log of git_revision starts with git_revision itself.
+    if num_downloaded > 0 and commit != git_revision:
+      downloaded_commits.append((num_downloaded, idx, commit))
+  if digests is not None and len(os.listdir(input_dir)) != num_files_before:
+    # Keeps the digest of the files as the next run finds them.
+    inputs_digest = input_files_digest(input_dir,
+                                       [git_revision] + parent_commits)
+
+  if len(downloaded_commits) < args.max_commits:
+    print ('Less than desired number of commits found. Please increase'
+          '--back_track in later runs')
+  trunc_commits = sorted(downloaded_commits, reverse=True)[:args.max_commits]
+  # Loaded lazily: create_expectations_dict() keeps only the indexed series
+  # of each commit, so one commit's data is in memory at a time.
+  extra_data = ((idx, bench_util.parse_skp_bench_data(
+                     input_dir, commit, args.representation_alg,
+                     store=bench_util.BenchDataStore(),
+                     processes=processes, cache=cache))
+                for _, idx, commit in trunc_commits)
+
+  expectations_dict = create_expectations_dict(
+      data_points, builder, extra_data, args.estimator, previous, digests)
+
+  out_lines = []
+  keys = expectations_dict.keys()
+  keys.sort()
+  for (config, bench) in keys:
+    (expected, lower_bound, upper_bound) = expectations_dict[(config, bench)]
+    out_lines.append('%(bench)s_%(config)s_,%(builder)s-%(representation)s,'
+        '%(expected)s,%(lower_bound)s,%(upper_bound)s' % {
+            'bench': bench,
+            'config': config,
+            'builder': builder,
+            'representation': args.representation_alg,
+            'expected': expected,
+            'lower_bound': lower_bound,
+            'upper_bound': upper_bound})
+
+  with open(output_file, 'w') as file_handle:
+    file_handle.write('\n'.join(out_lines))
+  if digests is not None:
+    write_digests(digests_file, builder, args.representation_alg,
+                  args.estimator, parameters, inputs_digest,
+                  expectations_dict, digests)
+
+  if compiled_output_file:
+    # Compiled from the text file, so that both hold the values as rounded
+    # there.
+    compiled_expectations.compile_expectations_file(output_file,
+                                                    compiled_output_file)
+
+  reused = 0
+  if previous:
+    reused = sum(1 for key, values in expectations_dict.iteritems()
+                 if key in previous and previous[key][0] == digests[key])
+  return (len(expectations_dict), len(expectations_dict) - reused)
+
+
+def _GenerateBatchEntry(args):
+  """Generates the expectations of one builder of a manifest. Runs in pool
+  workers, so takes one tuple of (parsed command line, manifest entry).
+  """
+  options, entry = args
+  return generate_expectations(
+      options, entry['builder'], entry['input_dir'], entry['git_revision'],
+      entry['output_file'], entry.get('compiled_output_file'))
+
+
+def generate_batch(args, manifest, processes=1):
+  """Generates the expectations of many builders.
+
+  Args:
+    args: the parsed command line, for the options shared by all builders.
+    manifest: a list of dictionaries with the keys builder, input_dir,
+      git_revision and output_file, and optionally compiled_output_file, of
+      the same meaning as the command line options.
+    processes: the number of builders processed concurrently.
+
+  Returns:
+    the list of results of generate_expectations() in manifest order.
+  """
+  jobs = [(args, entry) for entry in manifest]
+  if processes > 1 and len(jobs) > 1:
+    pool = multiprocessing.Pool(min(processes, len(jobs)))
     try:
-      src = urllib2.urlopen(_GS_CLOUD_FORMAT % (builder, file_name))
-      with open(os.path.join(directory, file_name), 'w') as dest:
-        dest.writelines(src)
-        count += 1
-    except urllib2.HTTPError:
-      pass
-  return count
+      return pool.map(_GenerateBatchEntry, jobs)
+    finally:
+      pool.close()
+      pool.join()
+  return [_GenerateBatchEntry(job) for job in jobs]
 
 
 def main():
@@ -149,74 +592,86 @@ def main():
         '-a', '--representation_alg', default='25th',
         help='bench representation algorithm to use, see bench_util.py.')
     parser.add_argument(
-        '-b', '--builder', required=True,
+        '-b', '--builder',
         help='name of the builder whose bench ranges we are computing.')
     parser.add_argument(
-        '-d', '--input_dir', required=True,
+        '-d', '--input_dir',
         help='a directory containing bench data files.')
     parser.add_argument(
-        '-o', '--output_file', required=True,
+        '-o', '--output_file',
         help='file path and name for storing the output bench expectations.')
     parser.add_argument(
-        '-r', '--git_revision', required=True,
+        '-c', '--compiled_output_file', required=False,
+        help='file path and name for also storing the bench expectations in '
+             'the compiled format read lazily by check_bench_regressions.py.')
+    parser.add_argument(
+        '-r', '--git_revision',
         help='the git hash to indicate the revision of input data to use.')
     parser.add_argument(
-        '-t', '--back_track', required=False, default=10,
+        '-t', '--back_track', required=False, default=10, type=int,
         help='the number of commit hashes backwards to look to include' +
              'in the calculations.')
     parser.add_argument(
-        '-m', '--max_commits', required=False, default=1,
-        help='the number of commit hashes to include in the calculations.')
+        '-m', '--max_commits', required=False, type=int,
+        help='the number of commit hashes to include in the calculations. '
+             'Defaults to %s for the spread estimator and %s for robust, '
+             'whose history is limited to these commits.' % (
+                 DEFAULT_MAX_COMMITS['spread'], DEFAULT_MAX_COMMITS['robust']))
+    parser.add_argument(
+        '-e', '--estimator', default=DEFAULT_ESTIMATOR,
+        choices=sorted(RANGE_ESTIMATORS.keys()),
+        help='the bench range estimator to use: spread widens the range of '
+             'the current commit, robust also weighs the samples of the '
+             'commits loaded with --max_commits (within --back_track) by '
+             'recency.')
+    parser.add_argument(
+        '-j', '--processes', type=int, default=1,
+        help='the number of processes used to parse bench data files, or '
+             'with --manifest the number of builders processed '
+             'concurrently.')
+    parser.add_argument(
+        '--no-cache', action='store_true',
+        help='do not use or update the parsed bench data cache.')
+    parser.add_argument(
+        '--fetch_threads', type=int,
+        default=bench_data_fetcher.DEFAULT_NUM_THREADS,
+        help='the number of concurrent downloads of earlier bench data.')
+    parser.add_argument(
+        '--source_dir', required=False,
+        help='a directory of <builder>/bench_* files to copy earlier bench '
+             'data from instead of downloading it from Google Storage.')
+    parser.add_argument(
+        '--incremental', action='store_true',
+        help='reuse the expectations of the previous run on the output file '
+             'for benches whose input data did not change, or keep the '
+             'output as it is if no input file changed.')
+    parser.add_argument(
+        '--manifest', required=False,
+        help='a JSON file listing builders to process instead of -b, -d, -o, '
+             '-c and -r: a list of objects with the keys "builder", '
+             '"input_dir", "git_revision", "output_file" and optionally '
+             '"compiled_output_file".')
     args = parser.parse_args()
-
-    builder = args.builder
-
-    data_points = bench_util.parse_skp_bench_data(
-        args.input_dir, args.git_revision, args.representation_alg)
-
-    parent_commits = get_parent_commits(args.git_revision, args.back_track)
-    print "Using commits: {}".format(parent_commits)
-    suffixes = get_file_suffixes(args.git_revision, args.input_dir)
-    print "Using suffixes: {}".format(suffixes)
-
-    # TODO(kelvinly): Find a better approach to than directly copying from
-    # the GS server?
-    downloaded_commits = []
-    for idx, commit in enumerate(parent_commits):
-      num_downloaded = download_bench_data(
-          builder, commit, suffixes, args.input_dir)
-      if num_downloaded > 0:
-        downloaded_commits.append((num_downloaded, idx, commit))
-
-    if len(downloaded_commits) < args.max_commits:
-      print ('Less than desired number of commits found. Please increase'
-            '--back_track in later runs')
-    trunc_commits = sorted(downloaded_commits, reverse=True)[:args.max_commits]
-    extra_data = []
-    for _, idx, commit in trunc_commits:
-      extra_data.append((idx, bench_util.parse_skp_bench_data(
-          args.input_dir, commit, args.representation_alg)))
-
-    expectations_dict = create_expectations_dict(data_points, builder,
-                                                 extra_data)
-
-    out_lines = []
-    keys = expectations_dict.keys()
-    keys.sort()
-    for (config, bench) in keys:
-      (expected, lower_bound, upper_bound) = expectations_dict[(config, bench)]
-      out_lines.append('%(bench)s_%(config)s_,%(builder)s-%(representation)s,'
-          '%(expected)s,%(lower_bound)s,%(upper_bound)s' % {
-              'bench': bench,
-              'config': config,
-              'builder': builder,
-              'representation': args.representation_alg,
-              'expected': expected,
-              'lower_bound': lower_bound,
-              'upper_bound': upper_bound})
-
-    with open(args.output_file, 'w') as file_handle:
-      file_handle.write('\n'.join(out_lines))
+    if args.max_commits is None:
+      args.max_commits = DEFAULT_MAX_COMMITS[args.estimator]
+
+    if args.manifest:
+      with open(args.manifest) as manifest_file:
+        manifest = json.load(manifest_file)
+      for entry, (total, estimated) in zip(
+          manifest, generate_batch(args, manifest, args.processes)):
+        print '%s: %d expectations, %d estimated' % (
+            entry['builder'], total, estimated)
+      return
+
+    for option in ('builder', 'input_dir', 'output_file', 'git_revision'):
+      if getattr(args, option) is None:
+        parser.error('--%s is required without --manifest' % option)
+    total, estimated = generate_expectations(
+        args, args.builder, args.input_dir, args.git_revision,
+        args.output_file, args.compiled_output_file, args.processes)
+    if args.incremental:
+      print '%d expectations, %d estimated' % (total, estimated)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+
+# Copyright 2015 Google Inc.
+#
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+Test gen_bench_expectations.
+"""
+
+import argparse
+import check_bench_regressions
+import gen_bench_expectations
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+
+BUILDER = 'Perf-Ubuntu12-ShuttleA-GTX660-x86-Release'
+COMMITS = ['c%d' % i for i in range(6)]  # Newest first, as in a git log.
+SUFFIX = 'skp_multi_4'
+
+
+def make_bench_log(seed):
+  """Returns a bench log of walltimes with per-iteration samples."""
+  rand = random.Random(seed)
+  lines = ['skia bench: alpha=0xFF scale=1 rotate=0 dither=default\n']
+  for bench in range(20):
+    lines.append('running bench [1000 1000] desk_site%d.skp\n' % bench)
+    for config in ('simple_viewport_1000x1000',
+                   'simple_viewport_1000x1000_gpu'):
+      lines.append('  %s:  msecs = %s\n' % (config, ','.join(
+          '%.2f' % rand.gauss(10 + bench, 1) for _ in range(8))))
+  return ''.join(lines)
+
+
+class GenerateExpectationsTest(unittest.TestCase):
+
+  def setUp(self):
+    self._temp_dir = tempfile.mkdtemp()
+    self._input_dir = os.path.join(self._temp_dir, 'input')
+    self._source_dir = os.path.join(self._temp_dir, 'source')
+    os.makedirs(self._input_dir)
+    os.makedirs(os.path.join(self._source_dir, BUILDER))
+    for seed, commit in enumerate(COMMITS):
+      directory = self._input_dir if commit == COMMITS[0] else os.path.join(
+          self._source_dir, BUILDER)
+      with open(os.path.join(directory, 'bench_%s_data_%s' % (
+          commit, SUFFIX)), 'w') as file_handle:
+        file_handle.write(make_bench_log(seed))
+    self._get_parent_commits = gen_bench_expectations.get_parent_commits
+    gen_bench_expectations.get_parent_commits = lambda start, num: COMMITS
+
+  def tearDown(self):
+    gen_bench_expectations.get_parent_commits = self._get_parent_commits
+    shutil.rmtree(self._temp_dir)
+
+  def _generate(self, output_name, incremental=False,
+                compiled_output_file=None):
+    args = argparse.Namespace(
+        representation_alg='25th', back_track=len(COMMITS),
+        estimator='robust',
+        max_commits=gen_bench_expectations.DEFAULT_MAX_COMMITS['robust'],
+        no_cache=True, source_dir=self._source_dir, fetch_threads=2,
+        incremental=incremental)
+    output_file = os.path.join(self._temp_dir, output_name)
+    gen_bench_expectations.generate_expectations(
+        args, BUILDER, self._input_dir, COMMITS[0], output_file,
+        compiled_output_file)
+    with open(output_file) as file_handle:
+      return file_handle.read()
+
+  def test_repeated_runs_use_downloaded_history(self):
+    first = self._generate('first.txt')
+    self.assertEqual(self._generate('second.txt'), first)
+    # The history of earlier commits is used.
+    shutil.rmtree(self._source_dir)
+    for commit in COMMITS[1:]:
+      os.remove(os.path.join(self._input_dir, 'bench_%s_data_%s' % (
+          commit, SUFFIX)))
+    self.assertNotEqual(self._generate('no_history.txt'), first)
+
+  def test_incremental_matches_full_run(self):
+    full = self._generate('full.txt')
+    self.assertEqual(self._generate('incremental.txt', incremental=True),
+                     full)
+    self.assertEqual(self._generate('incremental.txt', incremental=True),
+                     full)
+
+  def test_compiled_output_matches_text(self):
+    compiled_path = os.path.join(self._temp_dir, 'expectations.bin')
+    self._generate('expectations.txt', compiled_output_file=compiled_path)
+    text = check_bench_regressions.load_expectations(
+        os.path.join(self._temp_dir, 'expectations.txt'))
+    compiled = check_bench_regressions.load_expectations(compiled_path)
+    self.assertTrue(text)
+    self.assertEqual(dict(compiled.iteritems()), text)
+    compiled.close()
+
+
+if __name__ == '__main__':
+  unittest.main()
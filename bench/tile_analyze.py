@@ -8,15 +8,20 @@
 
 __author__ = 'bensong@google.com (Ben Chen)'
 
+import bench_cache
 import bench_util
-import boto
+import calendar
+import json
 import math
 import optparse
 import os
 import re
 import shutil
+import sys
+import tempfile
+import time
 
-from oauth2_plugin import oauth2_plugin
+from array import array
 
 # The default platform to analyze. Used when OPTION_PLATFORM flag is not set.
 DEFAULT_PLATFORM = 'Nexus10_4-1_Float_Bench_32'
@@ -25,9 +30,6 @@ DEFAULT_PLATFORM = 'Nexus10_4-1_Float_Bench_32'
 GOOGLE_STORAGE_URI_SCHEME = 'gs'
 URI_BUCKET = 'chromium-skia-gm'
 
-# Maximum number of rows of tiles to track for viewport covering.
-MAX_TILE_ROWS = 8
-
 # Constants for optparse.
 USAGE_STRING = 'USAGE: %s [options]'
 HOWTO_STRING = """
@@ -52,6 +54,20 @@ OPTION_PLATFORM_SHORT = '-p'
 # Bench representation algorithm flag.
 OPTION_REPRESENTATION_ALG = '--algorithm'
 OPTION_REPRESENTATION_ALG_SHORT = '-a'
+# Flag for disabling the parsed bench data cache and the object index.
+OPTION_NO_CACHE = '--no-cache'
+# Flag for reading a local copy of the Google Storage bucket.
+OPTION_STORAGE_DIR = '--storage_dir'
+# Flags for writing the report to files.
+OPTION_OUTPUT = '--output'
+OPTION_JSON_DIR = '--json_dir'
+# Flags for analyzing tile time trends over a range of revisions.
+OPTION_TREND = '--trend'
+OPTION_TREND_THRESHOLD = '--threshold'
+
+# Default relative change of a tile's time between consecutive revisions above
+# which the trend mode flags the tile.
+TREND_THRESHOLD = 0.2
 
 # Bench representation algorithm. See trunk/bench/bench_util.py.
 REPRESENTATION_ALG = bench_util.ALGORITHM_25TH_PERCENTILE
@@ -65,6 +81,15 @@ VIEWPORT_FILE_NAME_INDICATOR = '_viewport_'
 # Regular expression for matching format '<integer>x<integer>'.
 DIMENSIONS_RE = '(\d+)x(\d+)'
 
+# File caching the Google Storage object index between runs.
+OBJECT_INDEX_FILE = os.path.join(bench_cache.DEFAULT_CACHE_DIR,
+                                 'tile_analyze_index.json')
+# Bump when the layout of the object index file changes.
+OBJECT_INDEX_VERSION = 2
+# The bench files of a revision are uploaded within this time. A listing taken
+# sooner after the upload of matching objects may lack some of them.
+OBJECT_UPLOAD_WINDOW_SECONDS = 60 * 60
+
 # HTML and JS output templates.
 HTML_PREFIX = """
 <html><head><script type="text/javascript" src="https://www.google.com/jsapi">
@@ -79,39 +104,256 @@ HTML_SUFFIX = '</body></html>'
 BAR_CHART_TEMPLATE = ('<img src="https://chart.googleapis.com/chart?chxr=0,0,'
     '300&chxt=x&chbh=15,0&chs=600x150&cht=bhg&chco=80C65A,224499,FF0000,0A8C8A,'
     'EBB671,DE091A,000000,00ffff&chds=a&chdl=%s&chd=t:%s" /><br>\n')
+# Subdirectory of --json_dir holding the JSON data file of each section.
+JSON_DATA_DIR = 'data'
+# Static viewer of --json_dir reports. It lists the sections of index.json and
+# loads the data file of a section only when it is opened.
+JSON_VIEWER_HTML = """<html><head><style>
+td { padding: 2px 6px; text-align: right; }
+</style><script type="text/javascript">
+function load(url, callback) {
+  var request = new XMLHttpRequest();
+  request.onload = function() { callback(JSON.parse(request.responseText)); };
+  request.open("GET", url);
+  request.send();
+}
+function matrixTable(matrix) {
+  var max = 0;
+  matrix.forEach(function(row) { row.forEach(function(v) {
+    max = Math.max(max, v); }); });
+  var html = "<table>";
+  matrix.forEach(function(row) {
+    html += "<tr>";
+    row.forEach(function(v) {
+      var shade = max ? Math.round(255 - 200 * v / max) : 255;
+      html += "<td style='background:rgb(255," + shade + "," + shade + ")'>" +
+              v + "</td>";
+    });
+    html += "</tr>";
+  });
+  return html + "</table>";
+}
+function render(element, data) {
+  var html = "";
+  (data.configs || []).forEach(function(config) {
+    html += "<p>" + config.config + " (" + config.layout + "): " +
+            config.sum + "</p>";
+    if (config.matrix) {
+      html += "viewport tile sum: " + config.viewport_tile_sum +
+              ", max when scrolling: " + config.max_scroll_sum +
+              matrixTable(config.matrix);
+    }
+  });
+  if (data.counts) {
+    html += "<p>flagged changes per tile</p>" + matrixTable(data.counts);
+  }
+  if (data.changes) {
+    html += "<table border=1><tr><th>from</th><th>to</th><th>tile</th>" +
+            "<th>old</th><th>new</th></tr>";
+    data.changes.forEach(function(c) {
+      html += "<tr><td>" + c[0] + "</td><td>" + c[1] + "</td><td>[" + c[2] +
+              "," + c[3] + "]</td><td>" + c[4] + "</td><td>" + c[5] +
+              "</td></tr>";
+    });
+    html += "</table>";
+  }
+  element.innerHTML = html;
+}
+window.onload = function() {
+  load("index.json", function(index) {
+    document.getElementById("title").innerHTML = index.title;
+    var list = document.getElementById("sections");
+    index.sections.forEach(function(section) {
+      var item = document.createElement("div");
+      var link = document.createElement("a");
+      var content = document.createElement("div");
+      link.href = "#";
+      link.textContent = section.name;
+      link.onclick = function() {
+        if (content.innerHTML) {
+          content.innerHTML = "";
+        } else {
+          load(section.file, function(data) { render(content, data); });
+        }
+        return false;
+      };
+      item.appendChild(link);
+      item.appendChild(content);
+      list.appendChild(item);
+    });
+  });
+};
+</script></head><body><div id="title"></div><div id="sections"></div>
+</body></html>
+"""
 DRAW_OPTIONS = ('{passThroughBlack:false,useRowLabels:false,cellWidth:30,'
                 'cellHeight:30}')
 TABLE_OPTIONS = '{showRowNumber:true,firstRowNumber:" ",sort:"disable"}'
 
-def GetFiles(rev, bench_dir, platform):
+class GoogleStorageBackend(object):
+  """Lists and reads objects of the Google Storage bucket."""
+  def __init__(self, bucket=URI_BUCKET):
+    # Imported here, so that local bench data can be analyzed without the
+    # Google Storage libraries, see HOWTO_STRING.
+    import boto
+    from oauth2_plugin import oauth2_plugin  # Registers OAuth2 with boto.
+    self._bucket = boto.storage_uri(
+        bucket, GOOGLE_STORAGE_URI_SCHEME).get_bucket()
+
+  def ListObjects(self, prefix):
+    """Yields (name, size, etag, modification time) of the objects whose names
+    start with prefix.
+    """
+    import boto.utils
+    for obj in self._bucket.list(prefix=prefix):
+      mtime = boto.utils.parse_ts(obj.last_modified)
+      yield (obj.name, obj.size, obj.etag, calendar.timegm(mtime.timetuple()))
+
+  def ReadObject(self, name):
+    return self._bucket.get_key(name).get_contents_as_string()
+
+class LocalDirectoryBackend(object):
+  """Lists and reads files of a local directory laid out like the bucket,
+  e.g. as copied with gsutil. Object names are paths relative to root, with
+  '/' separators.
+  """
+  def __init__(self, root):
+    self.root = root
+
+  def ListObjects(self, prefix):
+    """Yields (name, size, etag, modification time) of the files whose names
+    start with prefix. The etag is derived from the modification time and size.
+    """
+    for dir_path, _, file_names in os.walk(self.root):
+      relative_dir = os.path.relpath(dir_path, self.root)
+      for file_name in file_names:
+        if relative_dir == os.curdir:
+          name = file_name
+        else:
+          name = '/'.join(relative_dir.split(os.sep) + [file_name])
+        if not name.startswith(prefix):
+          continue
+        stat = os.stat(os.path.join(dir_path, file_name))
+        yield (name, stat.st_size, '%d-%d' % (stat.st_mtime, stat.st_size),
+               stat.st_mtime)
+
+  def ReadObject(self, name):
+    with open(os.path.join(self.root, *name.split('/'))) as file_handle:
+      return file_handle.read()
+
+class ObjectIndex(object):
+  """Index of the (name, size, etag, modification time) of bucket objects
+  under some prefixes.
+
+  Listing a prefix of the bucket is much faster than scanning it, but still
+  takes a round trip per page of results. The index keeps the listings in
+  index_file between runs: Find() answers from the index when it has matching
+  objects that were all uploaded at least OBJECT_UPLOAD_WINDOW_SECONDS before
+  the listing, so that objects of the same upload cannot be missing from it.
+  Otherwise it lists the prefix again and updates the index with the new,
+  changed and deleted objects.
+  """
+  def __init__(self, backend, index_file=None):
+    self.backend = backend
+    self.index_file = index_file
+    # prefix -> {'time': listing time, 'objects': {name: [size, etag, mtime]}}
+    self._prefixes = {}
+    if index_file and os.path.exists(index_file):
+      try:
+        with open(index_file) as file_handle:
+          content = json.load(file_handle)
+        if content.get('version') == OBJECT_INDEX_VERSION:
+          self._prefixes = content['prefixes']
+      except ValueError:
+        pass  # Rebuilt from listings.
+
+  def Refresh(self, prefix):
+    """Lists prefix again and updates the index.
+
+    Returns the list of names that are new or changed since the last listing.
+    """
+    # Taken before listing, as objects may be uploaded meanwhile.
+    listing_time = time.time()
+    old_objects = self._prefixes.get(prefix, {}).get('objects', {})
+    objects = {}
+    changed = []
+    for name, size, etag, mtime in self.backend.ListObjects(prefix):
+      objects[name] = [size, etag, mtime]
+      if old_objects.get(name, [None, None])[:2] != [size, etag]:
+        changed.append(name)
+    self._prefixes[prefix] = {'time': listing_time, 'objects': objects}
+    self._Save()
+    return changed
+
+  def Find(self, prefix, matches, refresh=True):
+    """Returns the sorted names of objects under prefix for which matches(name)
+    is true. If refresh is true, prefix is listed again unless the index has
+    matching objects uploaded long enough before it was listed.
+    """
+    names = self._Match(prefix, matches)
+    if refresh and not self._IsSettled(prefix, names):
+      self.Refresh(prefix)
+      names = self._Match(prefix, matches)
+    return names
+
+  def _Match(self, prefix, matches):
+    return sorted(name for name in
+                  self._prefixes.get(prefix, {}).get('objects', {})
+                  if matches(name))
+
+  def _IsSettled(self, prefix, names):
+    """Returns whether names are all uploaded OBJECT_UPLOAD_WINDOW_SECONDS
+    before the listing of prefix, so no object of their upload is missing.
+    """
+    if not names:
+      return False
+    listing = self._prefixes[prefix]
+    return (max(listing['objects'][name][2] for name in names) +
+            OBJECT_UPLOAD_WINDOW_SECONDS <= listing['time'])
+
+  def _Save(self):
+    if not self.index_file:
+      return
+    index_dir = os.path.dirname(os.path.abspath(self.index_file))
+    if not os.path.isdir(index_dir):
+      os.makedirs(index_dir)
+    fd, temp_path = tempfile.mkstemp('.tmp', dir=index_dir)
+    with os.fdopen(fd, 'w') as file_handle:
+      json.dump({'version': OBJECT_INDEX_VERSION,
+                 'prefixes': self._prefixes}, file_handle)
+    os.rename(temp_path, self.index_file)
+
+def IsBenchFileOfInterest(name, rev, platform):
+  """Returns whether the object name is a tile or viewport bench file of the
+  given revision and platform.
+  """
+  return (name.startswith(GOOGLE_STORAGE_OBJECT_NAME_PREFIX) and
+          (name.find(TILING_FILE_NAME_INDICATOR) >= 0 or
+           name.find(VIEWPORT_FILE_NAME_INDICATOR) >= 0) and
+          name.find(platform) >= 0 and
+          name.find(BENCH_FILE_PREFIX_TEMPLATE % rev) >= 0)
+
+def GetFiles(rev, bench_dir, platform, index=None, refresh=True):
   """Reads in bench files of interest into a dictionary.
 
-  If bench_dir is not empty, tries to read in local bench files; otherwise check
-  Google Storage. Filters files by revision (rev) and platform, and ignores
-  non-tile, non-viewport bench files.
-  Outputs dictionary [filename] -> [file content].
+  If bench_dir is not empty, tries to read in local bench files; otherwise
+  looks them up in index, an ObjectIndex, which defaults to an uncached index
+  of Google Storage. Filters files by revision (rev) and platform, and ignores
+  non-tile, non-viewport bench files. refresh is passed on to index.Find().
+  Outputs dictionary [filename] -> [file content], which is empty only if
+  refresh is false.
   """
   file_dic = {}
   if not bench_dir:
-    uri = boto.storage_uri(URI_BUCKET, GOOGLE_STORAGE_URI_SCHEME)
-    # The boto API does not allow prefix/wildcard matching of Google Storage
-    # objects. And Google Storage has a flat structure instead of being
-    # organized in directories. Therefore, we have to scan all objects in the
-    # Google Storage bucket to find the files we need, which is slow.
-    # The option of implementing prefix matching as in gsutil seems to be
-    # overkill, but gsutil does not provide an API ready for use. If speed is a
-    # big concern, we suggest copying bot bench data from Google Storage using
-    # gsutil and use --log_dir for fast local data reading.
-    for obj in uri.get_bucket():
-      # Filters out files of no interest.
-      if (not obj.name.startswith(GOOGLE_STORAGE_OBJECT_NAME_PREFIX) or
-          (obj.name.find(TILING_FILE_NAME_INDICATOR) < 0 and
-           obj.name.find(VIEWPORT_FILE_NAME_INDICATOR) < 0) or
-          obj.name.find(platform) < 0 or
-          obj.name.find(BENCH_FILE_PREFIX_TEMPLATE % rev) < 0):
-        continue
-      file_dic[
-          obj.name[obj.name.rfind('/') + 1 : ]] = obj.get_contents_as_string()
+    if index is None:
+      index = ObjectIndex(GoogleStorageBackend())
+    # Bench files of a platform are stored under its builder's directory, so
+    # only that prefix of the bucket is listed.
+    names = index.Find(GOOGLE_STORAGE_OBJECT_NAME_PREFIX + platform,
+                       lambda name: IsBenchFileOfInterest(name, rev, platform),
+                       refresh)
+    for name in names:
+      file_dic[name[name.rfind('/') + 1 : ]] = index.backend.ReadObject(name)
   else:
     for f in os.listdir(bench_dir):
       if (not os.path.isfile(os.path.join(bench_dir, f)) or
@@ -121,41 +363,125 @@ def GetFiles(rev, bench_dir, platform):
         continue
       file_dic[f] = open(os.path.join(bench_dir, f)).read()
 
-  if not file_dic:
+  if not file_dic and refresh:
     raise Exception('No bench file found in "%s" or Google Storage.' %
                     bench_dir)
 
   return file_dic
 
-def GetTileMatrix(layout, tile_size, values, viewport):
+def ParseDimensions(dimensions):
+  """Returns [w, h] of a string of format <w>x<h>."""
+  return [int(i) for i in dimensions.split('x')]
+
+class TileGrid(object):
+  """Per-tile bench values of a tile layout, with a summed-area table for
+  summing the values of any rectangle of tiles in constant time.
+
+  Rows may be as many as the SKP is long; viewports anywhere in the grid are
+  covered, not only at its top-left corner.
+  """
+  def __init__(self, layout, values):
+    """layout: string of format <cols>x<rows>.
+    values: per-tile benches ordered row-by-row, starting from the top-left
+      tile. Missing trailing tiles count as 0.
+    """
+    [self.cols, self.rows] = ParseDimensions(layout)
+    self.values = array('d', values[:self.cols * self.rows])
+    self.values.extend([0.0] * (self.cols * self.rows - len(self.values)))
+    # sums[r * (cols + 1) + c] is the sum of the tiles above row r and left of
+    # column c.
+    stride = self.cols + 1
+    sums = array('d', [0.0]) * (stride * (self.rows + 1))
+    for row in xrange(self.rows):
+      row_sum = 0.0
+      base = row * self.cols
+      for col in xrange(self.cols):
+        row_sum += self.values[base + col]
+        sums[(row + 1) * stride + col + 1] = (sums[row * stride + col + 1] +
+                                               row_sum)
+    self._sums = sums
+
+  def Sum(self, col, row, cols, rows):
+    """Returns the sum of the cols x rows tiles from tile [col, row] on, clipped
+    to the grid.
+    """
+    stride = self.cols + 1
+    left = max(0, min(col, self.cols))
+    top = max(0, min(row, self.rows))
+    right = max(left, min(col + cols, self.cols))
+    bottom = max(top, min(row + rows, self.rows))
+    sums = self._sums
+    return (sums[bottom * stride + right] - sums[top * stride + right] -
+            sums[bottom * stride + left] + sums[top * stride + left])
+
+  def CoveringTiles(self, tile_size, viewport, offset=(0, 0)):
+    """Returns [col, row, cols, rows] of the tiles a viewport covers.
+
+    tile_size: [w, h] of a tile in pixels.
+    viewport: [w, h] of the viewport in pixels.
+    offset: [x, y] of the top-left corner of the viewport in pixels.
+    """
+    [tile_x, tile_y] = tile_size
+    col = offset[0] // tile_x
+    row = offset[1] // tile_y
+    end_col = int(math.ceil((offset[0] + viewport[0]) * 1.0 / tile_x))
+    end_row = int(math.ceil((offset[1] + viewport[1]) * 1.0 / tile_y))
+    return [col, row, end_col - col, end_row - row]
+
+  def ViewportSums(self, tile_size, viewport, offsets):
+    """Returns an array('d') of the sums of the tiles covered by the viewport
+    at each of offsets, see CoveringTiles().
+    """
+    sums = array('d')
+    for offset in offsets:
+      sums.append(self.Sum(*self.CoveringTiles(tile_size, viewport, offset)))
+    return sums
+
+  def ScrollSums(self, tile_size, viewport):
+    """Returns an array('d') of the sums of the tiles covered by the viewport
+    scrolled down the grid one tile row at a time, from the top until it
+    covers the last row.
+    """
+    [_, _, cols, rows] = self.CoveringTiles(tile_size, viewport)
+    return array('d', [self.Sum(0, row, cols, rows)
+                       for row in xrange(max(1, self.rows - rows + 1))])
+
+  def Matrix(self, covered=None):
+    """Returns the values as a list of rows, with tiles outside covered, a
+    [col, row, cols, rows] rectangle of tiles, set to 0.
+    """
+    if covered is None:
+      covered = [0, 0, self.cols, self.rows]
+    [col, row, cols, rows] = covered
+    matrix = []
+    for y in xrange(self.rows):
+      base = y * self.cols
+      if row <= y < row + rows:
+        matrix.append([self.values[base + x] if col <= x < col + cols else 0
+                       for x in xrange(self.cols)])
+      else:
+        matrix.append([0] * self.cols)
+    return matrix
+
+def GetTileMatrix(layout, tile_size, values, viewport, offset='0x0'):
   """For the given tile layout and per-tile bench values, returns a matrix of
   bench values with tiles outside the given viewport set to 0.
 
-  layout, tile_size and viewport are given in string of format <w>x<h>, where
-  <w> is viewport width or number of tile columns, and <h> is viewport height or
-  number of tile rows. We truncate tile rows to MAX_TILE_ROWS to adjust for very
-  long skp's.
+  layout, tile_size, viewport and offset are given in string of format <w>x<h>,
+  where <w> is viewport width or number of tile columns, and <h> is viewport
+  height or number of tile rows. offset is the position of the top-left corner
+  of the viewport in pixels. All tile rows are kept, however long the skp.
 
   values: per-tile benches ordered row-by-row, starting from the top-left tile.
 
   Returns [sum, matrix] where sum is the total bench tile time that covers the
   viewport, and matrix is used for visualizing the tiles.
   """
-  [tile_cols, tile_rows] = [int(i) for i in layout.split('x')]
-  [tile_x, tile_y] = [int(i) for i in tile_size.split('x')]
-  [viewport_x, viewport_y] = [int(i) for i in viewport.split('x')]
-  viewport_cols = int(math.ceil(viewport_x * 1.0 / tile_x))
-  viewport_rows = int(math.ceil(viewport_y * 1.0 / tile_y))
-  truncated_tile_rows = min(tile_rows, MAX_TILE_ROWS)
-
-  viewport_tile_sum = 0
-  matrix = [[0 for y in range(tile_cols)] for x in range(truncated_tile_rows)]
-  for y in range(min(viewport_cols, tile_cols)):
-    for x in range(min(truncated_tile_rows, viewport_rows)):
-      matrix[x][y] = values[x * tile_cols + y]
-      viewport_tile_sum += values[x * tile_cols + y]
-
-  return [viewport_tile_sum, matrix]
+  grid = TileGrid(layout, values)
+  covered = grid.CoveringTiles(ParseDimensions(tile_size),
+                               ParseDimensions(viewport),
+                               ParseDimensions(offset))
+  return [grid.Sum(*covered), grid.Matrix(covered)]
 
 def GetTileVisCodes(suffix, matrix):
   """Generates and returns strings of [js_codes, row1, row2] which are codes for
@@ -180,25 +506,21 @@ def GetTileVisCodes(suffix, matrix):
 
   return [this_js, table_row1, table_row2]
 
-def OutputTileAnalysis(rev, representation_alg, bench_dir, platform):
-  """Reads skp bench data and outputs tile vs. viewport analysis for the given
-  platform.
-
-  Ignores data with revisions other than rev. If bench_dir is not empty, read
-  from the local directory instead of Google Storage.
-  Uses the provided representation_alg for calculating bench representations.
+def GetBenchDic(file_dic, representation_alg, cache=None):
+  """Parses the bench files of file_dic, as returned by GetFiles().
 
-  Returns (js_codes, body_codes): strings of js/html codes for stats and
-  visualization.
+  Returns dictionary [bench][config] -> [layout, [values]], where layout is the
+  tile layout and values the per-tile benches of tile configs, and layout is
+  the viewport size and values the single bench of viewport configs.
   """
-  js_codes = ''
-  body_codes = ('}</script></head><body>'
-                '<h3>PLATFORM: %s REVISION: %s</h3><br>' % (platform, rev))
-  bench_dic = {}  # [bench][config] -> [layout, [values]]
-  file_dic = GetFiles(rev, bench_dir, platform)
+  bench_dic = {}
   for f in file_dic:
-    for point in bench_util.parse('', file_dic[f].split('\n'),
-                                  representation_alg):
+    if cache:
+      data_points = cache.parse('', file_dic[f], representation_alg)
+    else:
+      data_points = bench_util.parse('', file_dic[f].splitlines(True),
+                                     representation_alg)
+    for point in data_points:
       if point.time_type:  # Ignores non-walltime time_type.
         continue
       bench = point.bench.replace('.skp', '')
@@ -209,15 +531,165 @@ def OutputTileAnalysis(rev, representation_alg, bench_dir, platform):
       else:  # Stores per-tile benches.
         bench_dic.setdefault(bench, {})[config] = [
           point.tile_layout, point.per_tile_values]
-  benches = bench_dic.keys()
-  benches.sort()
-  for bench in benches:
-    body_codes += '<h4>%s</h4><br><table><tr>' % bench
-    heat_plots = ''  # For table row of heatmap plots.
-    table_plots = ''  # For table row of data table plots.
+  return bench_dic
+
+def GetTileSeries(revs, representation_alg, bench_dir, platform, cache=None,
+                  index=None):
+  """Reads the per-tile benches of many revisions.
+
+  Revisions without bench files are skipped. When reading from index, its
+  listing is refreshed once for all revisions.
+
+  Returns (found_revs, series): found_revs lists the revisions read, in the
+  order of revs, and series maps (bench, config) of tile configs to
+  [layout, num_tiles, values]. values is an array('d') of len(found_revs) rows
+  of num_tiles per-tile benches, with NaN rows for revisions that lack the
+  config or have another layout than the first revision that has it.
+  """
+  if not bench_dir:
+    if index is None:
+      index = ObjectIndex(GoogleStorageBackend())
+    index.Refresh(GOOGLE_STORAGE_OBJECT_NAME_PREFIX + platform)
+  found_revs = []
+  series = {}
+  nan = float('nan')
+  for rev in revs:
+    file_dic = GetFiles(rev, bench_dir, platform, index, refresh=False)
+    if not file_dic:
+      continue
+    row = len(found_revs)
+    found_revs.append(rev)
+    for bench, configs in GetBenchDic(
+        file_dic, representation_alg, cache).iteritems():
+      for config, (layout, values) in configs.iteritems():
+        if not config.startswith('tile_') or not values:
+          continue
+        if (bench, config) not in series:
+          series[(bench, config)] = [layout, len(values), array('d')]
+        [series_layout, num_tiles, series_values] = series[(bench, config)]
+        # Pads the revisions that lacked this config.
+        series_values.extend(
+            [nan] * (row * num_tiles - len(series_values)))
+        if layout == series_layout and len(values) == num_tiles:
+          series_values.extend(values)
+        else:
+          series_values.extend([nan] * num_tiles)
+  for _, num_tiles, values in series.itervalues():
+    values.extend([nan] * (len(found_revs) * num_tiles - len(values)))
+  return found_revs, series
+
+def ComputeTileDeltas(values, num_tiles, threshold):
+  """Computes the changes of per-tile benches between consecutive rows.
+
+  values: array('d') of rows of num_tiles per-tile benches, as in the series
+  returned by GetTileSeries().
+  threshold: relative change above which a tile is flagged.
+
+  Returns (deltas, flagged): deltas is an array('d') of one row less than
+  values, with NaN where either row lacks the tile, and flagged lists the
+  (row, tile, old value, new value) of changes over threshold, where row is
+  the row of the new value.
+  """
+  deltas = array('d', values[num_tiles:])
+  flagged = []
+  for i in xrange(len(deltas)):
+    old = values[i]
+    new = deltas[i]
+    deltas[i] = new - old
+    # NaN compares false, so rows lacking the tile are never flagged.
+    if old > 0 and abs(new - old) > threshold * old:
+      flagged.append((i / num_tiles + 1, i % num_tiles, old, new))
+  return deltas, flagged
+
+def IterTileTrend(found_revs, series, threshold=TREND_THRESHOLD):
+  """Yields a report section per tile config with changes over threshold.
+
+  found_revs, series: as returned by GetTileSeries().
+
+  Each section is a tuple of (name, js_codes, body_codes, data), where data is
+  the dictionary written by JsonReportWriter, with the bench, config and
+  layout, counts, the matrix of the number of flagged changes of each tile,
+  and changes, a list of [from rev, to rev, tile column, tile row, old value,
+  new value] lists.
+  """
+  for (bench, config) in sorted(series):
+    [layout, num_tiles, values] = series[(bench, config)]
+    _, flagged = ComputeTileDeltas(values, num_tiles, threshold)
+    if not flagged:
+      continue
+    tile_cols = num_tiles
+    if re.search(DIMENSIONS_RE, layout):
+      tile_cols = ParseDimensions(layout)[0]
+    counts = [0] * num_tiles
+    changes = []
+    rows = []
+    for row, tile, old, new in flagged:
+      counts[tile] += 1
+      change = [found_revs[row - 1], found_revs[row], tile % tile_cols,
+                tile / tile_cols, old, new]
+      changes.append(change)
+      rows.append('<tr><td>%s</td><td>%s</td><td>[%d,%d]</td><td>%s</td>'
+                  '<td>%s</td><td>%+.1f%%</td></tr>' % tuple(
+                      change + [(new - old) * 100.0 / old]))
+    matrix = [counts[i:i + tile_cols] for i in range(0, num_tiles, tile_cols)]
+    [this_js, row1, row2] = GetTileVisCodes(config + '_' + bench, matrix)
+    body_codes = ''.join(
+        ['<h4>%s %s</h4><br><table><tr>' % (bench, config), row1,
+         '</tr><tr>', row2, '</tr></table><table border=1>'
+         '<tr><th>from</th><th>to</th><th>tile</th><th>old</th>'
+         '<th>new</th><th>change</th></tr>'] + rows + ['</table><br>'])
+    yield ('%s %s' % (bench, config), this_js, body_codes,
+           {'bench': bench, 'config': config, 'layout': layout,
+            'counts': matrix, 'changes': changes})
+
+def OutputTileTrend(revs, representation_alg, bench_dir, platform,
+                    threshold=TREND_THRESHOLD, cache=None, index=None):
+  """Reads per-tile bench data of revisions revs and outputs the tiles whose
+  time changed by more than threshold between consecutive revisions.
+
+  Arguments are as for OutputTileAnalysis() and GetTileSeries().
+
+  Returns (js_codes, body_codes): strings of js/html codes with, per tile
+  config, a heatmap of the number of flagged changes of each tile and a table
+  of the flagged changes.
+  """
+  found_revs, series = GetTileSeries(revs, representation_alg, bench_dir,
+                                     platform, cache, index)
+  js_codes = []
+  body_codes = ['}</script></head><body>',
+                GetTrendTitle(platform, found_revs)]
+  for _, this_js, this_body, _ in IterTileTrend(found_revs, series, threshold):
+    js_codes.append(this_js)
+    body_codes.append(this_body)
+  return (''.join(js_codes), ''.join(body_codes))
+
+def GetTrendTitle(platform, found_revs):
+  return '<h3>PLATFORM: %s REVISIONS: %s</h3><br>' % (
+      platform, ', '.join(str(rev) for rev in found_revs))
+
+def GetAnalysisTitle(platform, rev):
+  return '<h3>PLATFORM: %s REVISION: %s</h3><br>' % (platform, rev)
+
+def IterTileAnalysis(bench_dic):
+  """Yields a report section per bench of bench_dic, as returned by
+  GetBenchDic(), that has viewport data.
+
+  Each section is a tuple of (name, js_codes, body_codes, data), where data is
+  the dictionary written by JsonReportWriter, with the bench, viewport and
+  configs, a list of dictionaries with the config, layout and sum of its
+  values, and for tile configs the viewport_tile_sum, max_scroll_sum and the
+  matrix of tile values.
+  """
+  for bench in sorted(bench_dic):
+    heat_plots = []  # For table row of heatmap plots.
+    table_plots = []  # For table row of data table plots.
+    js_codes = []
     # For bar plot legends and values in URL string.
-    legends = ''
-    values = ''
+    legends = []
+    values = []
+    # Maximum tile time covered by the viewport while scrolling the whole skp.
+    scroll_notes = []
+    configs = []
     keys = bench_dic[bench].keys()
     keys.sort()
     if not keys[-1].startswith('viewport'):  # No viewport to analyze; skip.
@@ -227,6 +699,7 @@ def OutputTileAnalysis(rev, representation_alg, bench_dir, platform):
       viewport = bench_dic[bench][keys[-1]][0]
     for config in keys:
       [layout, value_li] = bench_dic[bench][config]
+      config_data = {'config': config, 'layout': layout, 'sum': sum(value_li)}
       if config.startswith('tile_'):  # For per-tile data, visualize tiles.
         tile_size = config.split('_')[1]
         if (not re.search(DIMENSIONS_RE, layout) or
@@ -235,18 +708,115 @@ def OutputTileAnalysis(rev, representation_alg, bench_dir, platform):
           continue  # Skip unrecognized formats.
         [viewport_tile_sum, matrix] = GetTileMatrix(
             layout, tile_size, value_li, viewport)
-        values += '%s|' % viewport_tile_sum
+        values.append('%s|' % viewport_tile_sum)
+        max_scroll_sum = max(TileGrid(layout, value_li).ScrollSums(
+            ParseDimensions(tile_size), ParseDimensions(viewport)))
+        scroll_notes.append('%s: %s<br>' % (config, max_scroll_sum))
         [this_js, row1, row2] = GetTileVisCodes(config + '_' + bench, matrix)
-        heat_plots += row1
-        table_plots += row2
-        js_codes += this_js
+        heat_plots.append(row1)
+        table_plots.append(row2)
+        js_codes.append(this_js)
+        config_data.update({'viewport_tile_sum': viewport_tile_sum,
+                            'max_scroll_sum': max_scroll_sum,
+                            'matrix': matrix})
       else:  # For viewport data, there is only one element in value_li.
-        values += '%s|' % sum(value_li)
-      legends += '%s:%s|' % (config, sum(value_li))
-    body_codes += (heat_plots + '</tr><tr>' + table_plots + '</tr></table>' +
-                   '<br>' + BAR_CHART_TEMPLATE % (legends[:-1], values[:-1]))
+        values.append('%s|' % sum(value_li))
+      legends.append('%s:%s|' % (config, sum(value_li)))
+      configs.append(config_data)
+    body_codes = ['<h4>%s</h4><br><table><tr>' % bench] + heat_plots + [
+        '</tr><tr>'] + table_plots + [
+        '</tr></table><br>',
+        BAR_CHART_TEMPLATE % (''.join(legends)[:-1], ''.join(values)[:-1])]
+    if scroll_notes:
+      body_codes += ['Max viewport tile time when scrolling:<br>'] + scroll_notes
+    yield (bench, ''.join(js_codes), ''.join(body_codes),
+           {'bench': bench, 'viewport': viewport, 'configs': configs})
+
+def OutputTileAnalysis(rev, representation_alg, bench_dir, platform,
+                       cache=None, index=None):
+  """Reads skp bench data and outputs tile vs. viewport analysis for the given
+  platform.
+
+  Ignores data with revisions other than rev. If bench_dir is not empty, read
+  from the local directory instead of Google Storage.
+  Uses the provided representation_alg for calculating bench representations.
+  If cache (a bench_cache.BenchCache) is given, parsed files are looked up in
+  and added to it. index is the ObjectIndex used instead of Google Storage, see
+  GetFiles().
 
-  return (js_codes, body_codes)
+  Returns (js_codes, body_codes): strings of js/html codes for stats and
+  visualization.
+  """
+  bench_dic = GetBenchDic(GetFiles(rev, bench_dir, platform, index),
+                          representation_alg, cache)
+  js_codes = []
+  body_codes = ['}</script></head><body>', GetAnalysisTitle(platform, rev)]
+  for _, this_js, this_body, _ in IterTileAnalysis(bench_dic):
+    js_codes.append(this_js)
+    body_codes.append(this_body)
+  return (''.join(js_codes), ''.join(body_codes))
+
+class HtmlReportWriter(object):
+  """Writes a report page section by section as sections are computed.
+
+  Each section carries its own script, run once the visualization libraries
+  are loaded, so nothing is held back until the end of the page.
+  """
+  def __init__(self, out):
+    self.out = out
+
+  def Begin(self, title):
+    self.out.write(HTML_PREFIX + '}</script></head><body>' + title)
+
+  def WriteSection(self, name, js_codes, body_codes, data):
+    self.out.write(body_codes)
+    if js_codes:
+      self.out.write('<script type="text/javascript">google.setOnLoadCallback('
+                     'function(){%s});</script>\n' % js_codes)
+    self.out.flush()
+
+  def End(self):
+    self.out.write(HTML_SUFFIX + '\n')
+    self.out.flush()
+
+class JsonReportWriter(object):
+  """Writes a report as one JSON data file per section, plus an index.json
+  listing them and a static index.html viewer that loads sections on demand.
+  """
+  def __init__(self, directory):
+    self.directory = directory
+    self._sections = []
+
+  def Begin(self, title):
+    self._title = title
+    data_dir = os.path.join(self.directory, JSON_DATA_DIR)
+    if not os.path.isdir(data_dir):
+      os.makedirs(data_dir)
+
+  def WriteSection(self, name, js_codes, body_codes, data):
+    file_name = '%s/%d.json' % (JSON_DATA_DIR, len(self._sections))
+    with open(os.path.join(self.directory, file_name), 'w') as file_handle:
+      json.dump(data, file_handle)
+    self._sections.append({'name': name, 'file': file_name})
+
+  def End(self):
+    with open(os.path.join(self.directory, 'index.json'), 'w') as file_handle:
+      json.dump({'title': self._title, 'sections': self._sections},
+                file_handle)
+    with open(os.path.join(self.directory, 'index.html'), 'w') as file_handle:
+      file_handle.write(JSON_VIEWER_HTML)
+
+def WriteReport(title, sections, writers):
+  """Writes the (name, js_codes, body_codes, data) sections, as yielded by
+  IterTileAnalysis() or IterTileTrend(), to each of writers as they come.
+  """
+  for writer in writers:
+    writer.Begin(title)
+  for section in sections:
+    for writer in writers:
+      writer.WriteSection(*section)
+  for writer in writers:
+    writer.End()
 
 def main():
   """Parses flags and outputs expected Skia picture bench results."""
@@ -265,14 +835,71 @@ def main():
       dest='alg', default=REPRESENTATION_ALG,
       help=('Bench representation algorithm. '
             'Default to "%s".' % REPRESENTATION_ALG))
+  parser.add_option(OPTION_NO_CACHE,
+      dest='no_cache', action='store_true', default=False,
+      help=('Do not use or update the parsed bench data cache and the index '
+            'of Google Storage objects.'))
+  parser.add_option(OPTION_TREND,
+      dest='trend', default='',
+      help=('(Optional) revision range <first>:<last> to analyze the per-tile '
+            'time trends of, instead of a single revision.'))
+  parser.add_option(OPTION_TREND_THRESHOLD,
+      dest='threshold', type='float', default=TREND_THRESHOLD,
+      help=('Relative change of a tile time between consecutive revisions '
+            'flagged in %s mode. Default to %s.' % (OPTION_TREND,
+                                                    TREND_THRESHOLD)))
+  parser.add_option(OPTION_OUTPUT,
+      dest='output', default='',
+      help='(Optional) file to write the HTML report to, instead of stdout.')
+  parser.add_option(OPTION_JSON_DIR,
+      dest='json_dir', default='',
+      help=('(Optional) directory to also write the report to as JSON data '
+            'files per bench, with an index.html that views them.'))
+  parser.add_option(OPTION_STORAGE_DIR,
+      dest='storage_dir', default='',
+      help=('(Optional) local directory laid out like the Google Storage '
+            'bucket, to read instead of Google Storage.'))
   (options, args) = parser.parse_args()
-  if not (options.rev and options.rev.isdigit()):
+  trend_revs = None
+  if options.trend:
+    trend_range = options.trend.split(':')
+    if (len(trend_range) != 2 or not trend_range[0].isdigit() or
+        not trend_range[1].isdigit()):
+      parser.error('Please provide %s as <first>:<last>' % OPTION_TREND)
+      return
+    trend_revs = range(int(trend_range[0]), int(trend_range[1]) + 1)
+  elif not (options.rev and options.rev.isdigit()):
     parser.error('Please provide correct mandatory flag %s' % OPTION_REVISION)
     return
-  rev = int(options.rev)
-  (js_codes, body_codes) = OutputTileAnalysis(
-      rev, options.alg, options.log_dir, options.plat)
-  print HTML_PREFIX + js_codes + body_codes + HTML_SUFFIX
+  index = None
+  if not options.log_dir:
+    if options.storage_dir:
+      # Listing a local directory is fast enough without a cached index.
+      index = ObjectIndex(LocalDirectoryBackend(options.storage_dir))
+    else:
+      index = ObjectIndex(GoogleStorageBackend(),
+                          None if options.no_cache else OBJECT_INDEX_FILE)
+  cache = None if options.no_cache else bench_cache.BenchCache()
+  if trend_revs:
+    found_revs, series = GetTileSeries(
+        trend_revs, options.alg, options.log_dir, options.plat, cache, index)
+    title = GetTrendTitle(options.plat, found_revs)
+    sections = IterTileTrend(found_revs, series, options.threshold)
+  else:
+    rev = int(options.rev)
+    title = GetAnalysisTitle(options.plat, rev)
+    sections = IterTileAnalysis(GetBenchDic(
+        GetFiles(rev, options.log_dir, options.plat, index), options.alg,
+        cache))
+  out = open(options.output, 'w') if options.output else sys.stdout
+  try:
+    writers = [HtmlReportWriter(out)]
+    if options.json_dir:
+      writers.append(JsonReportWriter(options.json_dir))
+    WriteReport(title, sections, writers)
+  finally:
+    if options.output:
+      out.close()
 
 
 if '__main__' == __name__:
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+
+# Copyright 2015 Google Inc.
+#
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+Test tile_analyze.
+"""
+
+import random
+import tile_analyze
+import unittest
+
+
+def brute_force_sum(values, cols, rows, col, row, covered_cols, covered_rows):
+  """Sums the tiles of the rectangle one by one, clipped to the grid."""
+  total = 0.0
+  for y in range(max(0, row), min(rows, row + covered_rows)):
+    for x in range(max(0, col), min(cols, col + covered_cols)):
+      total += values[y * cols + x]
+  return total
+
+
+class TileGridTest(unittest.TestCase):
+
+  def setUp(self):
+    rand = random.Random(0)
+    self._cols = 4
+    self._rows = 25  # Longer than a viewport, as full-length SKPs are.
+    self._values = [float(rand.randint(0, 100))
+                    for _ in range(self._cols * self._rows)]
+    self._grid = tile_analyze.TileGrid('%dx%d' % (self._cols, self._rows),
+                                       self._values)
+
+  def test_sums_match_brute_force(self):
+    for row in range(-1, self._rows + 2):
+      for col in range(-1, self._cols + 2):
+        for rows in (0, 1, 3, self._rows + 5):
+          for cols in (0, 1, 2, self._cols + 5):
+            self.assertEqual(
+                self._grid.Sum(col, row, cols, rows),
+                brute_force_sum(self._values, self._cols, self._rows, col,
+                                row, cols, rows))
+
+  def test_missing_trailing_tiles(self):
+    grid = tile_analyze.TileGrid('3x2', [1.0, 2.0, 3.0, 4.0])
+    self.assertEqual(list(grid.values), [1.0, 2.0, 3.0, 4.0, 0.0, 0.0])
+    self.assertEqual(grid.Sum(0, 0, 3, 2), 10.0)
+
+  def test_covering_tiles(self):
+    self.assertEqual(
+        self._grid.CoveringTiles([256, 256], [1000, 1000]), [0, 0, 4, 4])
+    self.assertEqual(
+        self._grid.CoveringTiles([256, 256], [1000, 1000], [300, 600]),
+        [1, 2, 5, 5])
+    self.assertEqual(
+        self._grid.CoveringTiles([256, 256], [512, 512], [256, 512]),
+        [1, 2, 2, 2])
+
+  def test_viewport_sums(self):
+    offsets = [(0, 0), (100, 300), (256, 5000), (0, 256 * self._rows)]
+    sums = self._grid.ViewportSums([256, 256], [600, 700], offsets)
+    self.assertEqual(len(sums), len(offsets))
+    for offset, total in zip(offsets, sums):
+      covered = self._grid.CoveringTiles([256, 256], [600, 700], offset)
+      self.assertEqual(total, brute_force_sum(
+          self._values, self._cols, self._rows, *covered))
+
+  def test_scroll_sums(self):
+    sums = self._grid.ScrollSums([256, 256], [1000, 1000])
+    self.assertEqual(len(sums), self._rows - 3)
+    for row, total in enumerate(sums):
+      self.assertEqual(total, brute_force_sum(
+          self._values, self._cols, self._rows, 0, row, 4, 4))
+
+  def test_matrix(self):
+    matrix = self._grid.Matrix([1, 2, 2, 3])
+    self.assertEqual(len(matrix), self._rows)
+    for y, matrix_row in enumerate(matrix):
+      self.assertEqual(len(matrix_row), self._cols)
+      for x, value in enumerate(matrix_row):
+        if 1 <= x < 3 and 2 <= y < 5:
+          self.assertEqual(value, self._values[y * self._cols + x])
+        else:
+          self.assertEqual(value, 0)
+    self.assertEqual(sum(sum(matrix_row) for matrix_row in self._grid.Matrix()),
+                     sum(self._values))
+
+
+class GetTileMatrixTest(unittest.TestCase):
+
+  def test_viewport_at_offset(self):
+    values = [float(i) for i in range(12)]  # 2 columns by 6 rows.
+    total, matrix = tile_analyze.GetTileMatrix('2x6', '100x100', values,
+                                               '150x250', '0x250')
+    # Covers columns 0-1 of rows 2-4.
+    self.assertEqual(total, sum(values[4:10]))
+    self.assertEqual(matrix, [[0, 0], [0, 0], [4.0, 5.0], [6.0, 7.0],
+                              [8.0, 9.0], [0, 0]])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# Copyright (c) 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+""" Time serial vs. parallel loading of a synthetic skp bench data corpus. """
+
+import argparse
+import bench_util
+import os
+import random
+import shutil
+import tempfile
+import time
+
+# Revision used in the names of the synthetic bench data files.
+REVISION = 'deadbeef'
+
+# Configs written for each synthetic bench.
+CONFIGS = ['simple_viewport_1000x1000',
+           'simple_viewport_1000x1000_gpu',
+          ]
+
+# Tile layout of the synthetic per-tile configs, in columns and rows.
+TILE_COLS = 4
+TILE_ROWS = 8
+
+
+def _iter_times(count):
+  return ','.join('%.2f' % random.uniform(1.0, 50.0) for _ in range(count))
+
+
+def write_corpus(directory, num_files, num_benches, num_iters):
+  """Writes num_files bench_<REVISION>_data_* files into directory."""
+  for file_idx in range(num_files):
+    file_name = 'bench_%s_data_skp_scalar_1.%d_multi_4' % (REVISION, file_idx)
+    with open(os.path.join(directory, file_name), 'w') as file_handle:
+      file_handle.write('skia bench: scale=1 rotate=0 dither=default\n')
+      for bench_idx in range(num_benches):
+        file_handle.write('running bench [1000 1000] page_%d.skp\n' %
+                          bench_idx)
+        for config in CONFIGS:
+          file_handle.write('  %s:  cmsecs = %s  msecs = %s\n' % (
+              config, _iter_times(num_iters), _iter_times(num_iters)))
+        for tile in range(TILE_COLS * TILE_ROWS):
+          file_handle.write(
+              '  tile_256x256: tile [%d,%d] out of [%d,%d] <averaged>: '
+              'msecs = %s\n' % (tile % TILE_COLS, tile / TILE_COLS,
+                                TILE_COLS, TILE_ROWS, _iter_times(num_iters)))
+
+
+def time_loading(directory, rep, processes):
+  """Returns (seconds, number of data points) for one full load."""
+  start = time.time()
+  data_points = bench_util.parse_skp_bench_data(
+      directory, REVISION, rep, processes=processes)
+  return (time.time() - start, len(data_points))
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '-f', '--files', type=int, default=24,
+      help='number of synthetic bench data files.')
+  parser.add_argument(
+      '-b', '--benches', type=int, default=200,
+      help='number of benches per file.')
+  parser.add_argument(
+      '-i', '--iters', type=int, default=10,
+      help='number of per-iteration values per config and tile.')
+  parser.add_argument(
+      '-j', '--processes', type=int, default=4,
+      help='number of processes for the parallel run.')
+  parser.add_argument(
+      '-a', '--representation_alg', default='25th',
+      help='bench representation algorithm to use, see bench_util.py.')
+  args = parser.parse_args()
+
+  random.seed(0)
+  directory = tempfile.mkdtemp('bench_loading')
+  try:
+    write_corpus(directory, args.files, args.benches, args.iters)
+    serial_secs, serial_points = time_loading(
+        directory, args.representation_alg, 1)
+    parallel_secs, parallel_points = time_loading(
+        directory, args.representation_alg, args.processes)
+  finally:
+    shutil.rmtree(directory)
+
+  assert serial_points == parallel_points
+  print 'Loaded %d data points from %d files.' % (serial_points, args.files)
+  print 'serial:             %8.3fs' % serial_secs
+  print 'parallel (%2d procs): %8.3fs (%.2fx)' % (
+      args.processes, parallel_secs, serial_secs / parallel_secs)
+
+
+if __name__ == '__main__':
+  main()
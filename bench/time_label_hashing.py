@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# Copyright (c) 2015 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+""" Time check_bench_regressions Label hashing and expectation lookups. """
+
+import argparse
+import check_bench_regressions
+import time
+
+# Run settings shared by all labels, similar to those of the Perf bots.
+SETTINGS = dict(('setting_%d' % i, 'value_%d' % i) for i in range(12))
+
+PLATFORM = 'Perf-Ubuntu12-ShuttleA-GTX660-x86-Release'
+ALG = '25th'
+
+
+class LegacyLabel:
+  """Label as hashed before keys were precomputed, for comparison."""
+  def __init__(self, bench, config, time_type, settings):
+    self.bench = bench
+    self.config = config
+    self.time_type = time_type
+    self.settings = settings
+
+  def __str__(self):
+    return '%s_%s_%s_%s' % (self.bench, self.config, self.time_type,
+                            self.settings)
+
+  def __eq__(self, other):
+    return (self.bench == other.bench and
+            self.config == other.config and
+            self.time_type == other.time_type and
+            self.settings == other.settings)
+
+  def __hash__(self):
+    return (hash(self.bench) ^
+            hash(self.config) ^
+            hash(self.time_type) ^
+            hash(frozenset(self.settings.iteritems())))
+
+
+def make_names(num_labels):
+  return [('page_%d.skp' % (i / 4), 'simple_viewport_1000x1000_%d' % (i % 4),
+           '') for i in range(num_labels)]
+
+
+def time_legacy(names):
+  start = time.time()
+  lines = dict((LegacyLabel(b, c, t, SETTINGS), 1.0) for b, c, t in names)
+  expectations = dict(('%s_%s_%s,%s-%s' % (b, c, t, PLATFORM, ALG),
+                       (0.0, 2.0, 1.0)) for b, c, t in names)
+  found = 0
+  for line in lines:
+    line_str = str(line)
+    line_str = line_str[ : line_str.find('_{')]
+    if line_str + ',' + PLATFORM + '-' + ALG in expectations:
+      found += 1
+  return (time.time() - start, found)
+
+
+def time_current(names):
+  start = time.time()
+  settings_key = frozenset(SETTINGS.iteritems())
+  lines = dict((check_bench_regressions.Label(b, c, t, SETTINGS,
+                                              settings_key), 1.0)
+               for b, c, t in names)
+  expectations = dict(((b, c, t, PLATFORM, ALG), (0.0, 2.0, 1.0))
+                      for b, c, t in names)
+  found = 0
+  for line in lines:
+    if check_bench_regressions.expectation_key(
+        line, PLATFORM, ALG) in expectations:
+      found += 1
+  return (time.time() - start, found)
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '-n', '--labels', type=int, default=100000,
+      help='number of labels to hash and look up.')
+  args = parser.parse_args()
+
+  names = make_names(args.labels)
+  legacy_secs, legacy_found = time_legacy(names)
+  current_secs, current_found = time_current(names)
+  assert legacy_found == current_found == args.labels
+  print 'Hashed and looked up %d labels.' % args.labels
+  print 'string keys (legacy): %8.3fs' % legacy_secs
+  print 'structured keys:      %8.3fs (%.2fx)' % (
+      current_secs, legacy_secs / current_secs)
+
+
+if __name__ == '__main__':
+  main()
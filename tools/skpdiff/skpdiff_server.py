@@ -4,14 +4,19 @@
 from __future__ import print_function
 import argparse
 import BaseHTTPServer
+import httplib
 import json
+import multiprocessing
 import os
 import os.path
+import Queue
 import re
+import shutil
 import subprocess
 import sys
 import tempfile
-import urllib2
+import threading
+import time
 
 # Grab the script path because that is where all the static assets are
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -31,6 +36,10 @@ if TOOLS_DIR not in sys.path:
 GM_DIR = os.path.join(SKIA_ROOT_DIR, 'gm')
 if GM_DIR not in sys.path:
     sys.path.append(GM_DIR)
+BENCH_DIR = os.path.join(SKIA_ROOT_DIR, 'bench')
+if BENCH_DIR not in sys.path:
+    sys.path.append(BENCH_DIR)
+import bench_data_fetcher
 import gm_json
 import jsondiff
 
@@ -48,7 +57,39 @@ MIME_TYPE_MAP = {'': 'application/octet-stream',
 
 IMAGE_FILENAME_RE = re.compile(gm_json.IMAGE_FILENAME_PATTERN)
 
-SKPDIFF_INVOKE_FORMAT = '{} --jsonp=false -o {} -f {} {}'
+# Number of images downloaded concurrently by default.
+DEFAULT_DOWNLOAD_THREADS = 16
+
+# Seconds to wait on a stalled image download.
+DOWNLOAD_TIMEOUT_SECONDS = 60
+
+# Size of the chunks in which downloaded images are written to disk.
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+
+# Seconds between two progress reports of a batch of downloads.
+PROGRESS_INTERVAL_SECONDS = 2.0
+
+# Default directory of the image cache shared by all server sessions.
+DEFAULT_IMAGE_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.skpdiff',
+                                       'images')
+
+# Default maximum size of the image cache, in megabytes.
+DEFAULT_IMAGE_CACHE_SIZE_MB = 1024
+
+# Default file of the skpdiff results cache shared by all server sessions.
+DEFAULT_SKPDIFF_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.skpdiff',
+                                          'results.json')
+
+# Version of the skpdiff results cache file format. Files of other versions
+# are ignored.
+SKPDIFF_CACHE_VERSION = 1
+
+# Number of skpdiff processes run concurrently by default.
+DEFAULT_SKPDIFF_PROCESSES = multiprocessing.cpu_count()
+
+# Fields of skpdiff records that depend on where the images were, which are
+# set for each session rather than cached.
+SKPDIFF_PATH_FIELDS = ('commonName', 'baselinePath', 'testPath')
 
 
 def get_skpdiff_path(user_path=None):
@@ -89,33 +130,368 @@ def get_skpdiff_path(user_path=None):
     return skpdiff_path
 
 
-def download_file(url, output_path):
-    """Download the file at url and place it in output_path"""
-    reader = urllib2.urlopen(url)
-    with open(output_path, 'wb') as writer:
-        writer.write(reader.read())
-
-
-def download_gm_image(image_name, image_path, hash_val):
-    """Download the gm result into the given path.
+def get_gm_image_url(image_name, hash_val):
+    """Get the URL of a gm result.
 
     @param image_name The GM file name, for example imageblur_gpu.png.
-    @param image_path Path to place the image.
     @param hash_val   The hash value of the image.
     """
-    if hash_val is None:
-        return
-
     # Separate the test name from a image name
     image_match = IMAGE_FILENAME_RE.match(image_name)
     test_name = image_match.group(1)
 
     # Calculate the URL of the requested image
-    image_url = gm_json.CreateGmActualUrl(
+    return gm_json.CreateGmActualUrl(
         test_name, gm_json.JSONKEY_HASHTYPE_BITMAP_64BITMD5, hash_val)
 
-    # Download the image as requested
-    download_file(image_url, image_path)
+
+class ImageDownloader:
+    """Downloads many files concurrently.
+
+    A bounded number of threads each keep one persistent HTTP connection per
+    host, see bench_data_fetcher.KeepAliveConnections, and stream responses
+    to disk. Progress is reported as a running count rather than one line per
+    file.
+    """
+    def __init__(self, num_threads=DEFAULT_DOWNLOAD_THREADS,
+                 timeout=DOWNLOAD_TIMEOUT_SECONDS):
+        """
+        @param num_threads The maximum number of concurrent downloads.
+        @param timeout     Seconds to wait on a stalled connection.
+        """
+        self._num_threads = num_threads
+        self._connections = bench_data_fetcher.KeepAliveConnections(timeout)
+
+    def download(self, url, output_path):
+        """Download the file at url and place it in output_path. The file is
+        written under a temporary name first, so output_path is either
+        complete or absent.
+
+        @param url         The http or https URL to download.
+        @param output_path The path to write the file to.
+        """
+        response = self._connections.request(url)
+        try:
+            if response.status != httplib.OK:
+                response.read()
+                raise IOError('Could not download %s: HTTP %d %s' % (
+                    url, response.status, response.reason))
+            # The temporary name is unique so that concurrent servers sharing
+            # an image cache do not write to the same file.
+            fd, temp_path = tempfile.mkstemp(
+                suffix='.part', dir=os.path.dirname(output_path))
+            try:
+                with os.fdopen(fd, 'wb') as writer:
+                    shutil.copyfileobj(response, writer, DOWNLOAD_CHUNK_BYTES)
+                os.rename(temp_path, output_path)
+            except:
+                os.remove(temp_path)
+                raise
+        finally:
+            response.close()
+
+    def download_all(self, downloads):
+        """Download files concurrently, printing the progress periodically.
+
+        @param downloads A list of (url, output_path) tuples.
+        @return          Nothing. The first download error, if any, is raised
+                         once all the other downloads are done.
+        """
+        jobs = Queue.Queue()
+        for download in downloads:
+            jobs.put(download)
+        errors = []
+        done = [0]
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                try:
+                    url, output_path = jobs.get_nowait()
+                except Queue.Empty:
+                    return
+                error = None
+                try:
+                    self.download(url, output_path)
+                except Exception as e:
+                    error = e
+                with lock:
+                    done[0] += 1
+                    if error is not None:
+                        errors.append(error)
+
+        threads = [threading.Thread(target=worker)
+                   for _ in xrange(min(self._num_threads, len(downloads)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        alive_threads = threads
+        last_report = time.time()
+        while alive_threads:
+            alive_threads[0].join(PROGRESS_INTERVAL_SECONDS)
+            alive_threads = [thread for thread in alive_threads
+                             if thread.is_alive()]
+            if time.time() - last_report >= PROGRESS_INTERVAL_SECONDS:
+                last_report = time.time()
+                with lock:
+                    print('Attempted %d of %d images, %d failed' % (
+                        done[0], len(downloads), len(errors)))
+        print('Downloaded %d of %d images, %d failed' % (
+            len(downloads) - len(errors), len(downloads), len(errors)))
+        if errors:
+            raise errors[0]
+
+
+def link_or_copy(source_path, dest_path):
+    """Make dest_path a hard link to source_path, or a symbolic link if hard
+    links are not supported, or a copy if neither is.
+
+    @param source_path The path of the existing file.
+    @param dest_path   The path to create.
+    """
+    for link in (getattr(os, 'link', None), getattr(os, 'symlink', None)):
+        if link is None:
+            continue
+        try:
+            link(source_path, dest_path)
+            return
+        except OSError:
+            pass
+    shutil.copyfile(source_path, dest_path)
+
+
+class ImageCache:
+    """A persistent, content-addressed cache of GM images.
+
+    Images are stored as <cache_dir>/<hash type>/<hash value>.png, so an
+    image is downloaded once no matter how many sessions, devices or tests
+    refer to it. Sessions link the cached images into their own directories.
+    Linking an image marks it as used, and once the cache grows over its size
+    limit the least recently used images are evicted.
+    """
+    def __init__(self, cache_dir=DEFAULT_IMAGE_CACHE_DIR,
+                 max_bytes=DEFAULT_IMAGE_CACHE_SIZE_MB * 1024 * 1024):
+        """
+        @param cache_dir The directory holding the cached images.
+        @param max_bytes The size the cache is trimmed to by evict().
+        """
+        self._cache_dir = cache_dir
+        self._max_bytes = max_bytes
+
+    def get_path(self, hash_type, hash_val):
+        """Get the path of an image in the cache, creating the directory of
+        its hash type if needed. The image itself may not exist yet.
+
+        @param hash_type The hash type, for example bitmap-64bitMD5.
+        @param hash_val  The hash value of the image.
+        """
+        hash_dir = os.path.join(self._cache_dir, hash_type)
+        if not os.path.isdir(hash_dir):
+            try:
+                os.makedirs(hash_dir)
+            except OSError:
+                # Another server may have just created it.
+                if not os.path.isdir(hash_dir):
+                    raise
+        return os.path.join(hash_dir, '{}.png'.format(hash_val))
+
+    def link(self, hash_type, hash_val, output_path):
+        """Place the cached image at output_path and mark it as used.
+
+        @param hash_type   The hash type of the image.
+        @param hash_val    The hash value of the image.
+        @param output_path The path to link the image to.
+        """
+        cache_path = self.get_path(hash_type, hash_val)
+        os.utime(cache_path, None)
+        link_or_copy(cache_path, output_path)
+
+    def evict(self, keep=()):
+        """Remove the least recently used images until the cache fits in its
+        size limit. Images still hard linked from a session directory are not
+        removed, as that would free no space, but they count towards the
+        limit.
+
+        @param keep   Paths of cached images not to remove, such as those that
+                      may be symbolically linked by the current session.
+        @return       The number of images removed.
+        """
+        entries = []
+        total_bytes = 0
+        for root, dirs, files in os.walk(self._cache_dir):
+            for file_name in files:
+                if not file_name.endswith('.png'):
+                    continue
+                path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, stat.st_nlink,
+                                path))
+                total_bytes += stat.st_size
+
+        removed = 0
+        entries.sort()
+        for mtime, size, nlink, path in entries:
+            if total_bytes <= self._max_bytes:
+                break
+            if nlink > 1 or path in keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_bytes -= size
+            removed += 1
+        return removed
+
+
+class SkpdiffResultCache:
+    """A persistent cache of the skpdiff records of image pairs.
+
+    Records are keyed by the hashes of the baseline and test images and by the
+    metric set, i.e. the skpdiff differs that produced them. The fields in
+    SKPDIFF_PATH_FIELDS are not cached, since they depend on the session.
+    """
+    def __init__(self, cache_path=DEFAULT_SKPDIFF_CACHE_PATH):
+        """
+        @param cache_path The JSON file holding the cache, or None to keep the
+               cache in memory only.
+        """
+        self._cache_path = cache_path
+        self._records = {}
+        self._modified = False
+        if cache_path is None or not os.path.isfile(cache_path):
+            return
+        try:
+            with open(cache_path, 'rb') as cache_file:
+                contents = json.load(cache_file)
+        except ValueError:
+            print('Ignoring the corrupt skpdiff cache', cache_path)
+            return
+        if contents.get('version') == SKPDIFF_CACHE_VERSION:
+            self._records = contents['records']
+
+    @staticmethod
+    def _get_key(baseline_hash, test_hash, metric_set):
+        return '{}:{}:{}'.format(metric_set, baseline_hash, test_hash)
+
+    def get(self, baseline_hash, test_hash, metric_set):
+        """Get the cached record of an image pair, or None.
+
+        @param baseline_hash The hash value of the baseline image.
+        @param test_hash     The hash value of the test image.
+        @param metric_set    The differs of the record, as returned by
+               get_metric_set().
+        """
+        return self._records.get(
+            self._get_key(baseline_hash, test_hash, metric_set))
+
+    def put(self, baseline_hash, test_hash, metric_set, record):
+        """Cache the record of an image pair. See get() for the parameters."""
+        record = dict((field, value) for field, value in record.iteritems()
+                      if field not in SKPDIFF_PATH_FIELDS)
+        self._records[self._get_key(baseline_hash, test_hash,
+                                    metric_set)] = record
+        self._modified = True
+
+    def save(self):
+        """Write the cache to its file if it was modified. The file is
+        replaced atomically."""
+        if self._cache_path is None or not self._modified:
+            return
+        cache_dir = os.path.dirname(os.path.abspath(self._cache_path))
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as cache_file:
+                json.dump({'version': SKPDIFF_CACHE_VERSION,
+                           'records': self._records}, cache_file)
+            os.rename(temp_path, self._cache_path)
+        except:
+            os.remove(temp_path)
+            raise
+        self._modified = False
+
+
+def get_metric_set(differs):
+    """Get the name of the set of skpdiff differs used, for keying results.
+
+    @param differs The names of the differs given to skpdiff, or an empty list
+           if skpdiff uses all of them.
+    """
+    return ','.join(sorted(differs)) or 'all'
+
+
+def run_skpdiff(skpdiff_path, pairs, num_processes=DEFAULT_SKPDIFF_PROCESSES,
+                differs=()):
+    """Compare image pairs with skpdiff, split between concurrent processes.
+
+    Each process is given its own directories, in which the images of its
+    pairs are linked under names identifying the pair.
+
+    @param skpdiff_path  The path used to execute the skpdiff command.
+    @param pairs         A list of (baseline path, test path) tuples.
+    @param num_processes The maximum number of skpdiff processes to run.
+    @param differs       The names of the differs to use, or an empty list to
+                         use all of them.
+    @return              A list of the skpdiff records of pairs, with None for
+                         pairs skpdiff gave no record for.
+    """
+    records = [None] * len(pairs)
+    num_shards = min(max(num_processes, 1), len(pairs))
+    shards = []
+    try:
+        for shard_index in xrange(num_shards):
+            shard_dir = os.path.realpath(tempfile.mkdtemp('skpdiff_shard'))
+            baseline_dir = os.path.join(shard_dir, 'baseline')
+            test_dir = os.path.join(shard_dir, 'test')
+            os.mkdir(baseline_dir)
+            os.mkdir(test_dir)
+            output_path = os.path.join(shard_dir, 'skpdiff_output.json')
+
+            # skpdiff reports the real paths of the images, so pairs are
+            # identified by those rather than by the names of the links.
+            pair_indexes = {}
+            for pair_index in xrange(shard_index, len(pairs), num_shards):
+                baseline_path, test_path = pairs[pair_index]
+                link_name = '{}.png'.format(pair_index)
+                link_or_copy(baseline_path,
+                             os.path.join(baseline_dir, link_name))
+                link_or_copy(test_path, os.path.join(test_dir, link_name))
+                pair_indexes[(
+                    os.path.realpath(os.path.join(baseline_dir, link_name)),
+                    os.path.realpath(os.path.join(test_dir, link_name)))] = \
+                    pair_index
+
+            # The work is already split between processes, so each process
+            # runs a single thread.
+            args = [skpdiff_path, '--jsonp=false', '--threads', '1',
+                    '-o', output_path, '-f', baseline_dir, test_dir]
+            if differs:
+                args += ['-d'] + list(differs)
+            shards.append((shard_dir, output_path, pair_indexes,
+                           subprocess.Popen(args)))
+
+        for shard_dir, output_path, pair_indexes, process in shards:
+            if process.wait() != 0 or not os.path.isfile(output_path):
+                print('skpdiff failed on %d image pairs' % len(pair_indexes))
+                continue
+            with open(output_path, 'rb') as output_file:
+                for record in json.load(output_file)['records']:
+                    pair_index = pair_indexes.get((record['baselinePath'],
+                                                   record['testPath']))
+                    if pair_index is not None:
+                        records[pair_index] = record
+    finally:
+        for shard in shards:
+            if shard[3].poll() is None:
+                shard[3].kill()
+                shard[3].wait()
+            shutil.rmtree(shard[0], ignore_errors=True)
+    return records
 
 
 def get_image_set_from_skpdiff(skpdiff_records):
@@ -197,7 +573,10 @@ class GMInstance:
 
 class ExpectationsManager:
     def __init__(self, expectations_dir, expected_name, updated_name,
-                 skpdiff_path):
+                 skpdiff_path, download_threads=DEFAULT_DOWNLOAD_THREADS,
+                 image_cache=None,
+                 skpdiff_processes=DEFAULT_SKPDIFF_PROCESSES,
+                 skpdiff_differs=(), skpdiff_cache=None):
         """
         @param expectations_dir   The directory to traverse for results files.
                This should resemble expectations/gm in the Skia trunk.
@@ -207,11 +586,27 @@ class ExpectationsManager:
                Normally this matches --expectations-filename-output for the
                rebaseline.py tool.
         @param skpdiff_path       The path used to execute the skpdiff command.
+        @param download_threads   The number of images downloaded concurrently.
+        @param image_cache        The ImageCache to take images from, or None
+               to download all of them for this session only.
+        @param skpdiff_processes  The number of skpdiff processes run
+               concurrently.
+        @param skpdiff_differs    The names of the skpdiff differs to use, or
+               an empty list to use all of them.
+        @param skpdiff_cache      The SkpdiffResultCache to take the results of
+               image pairs from, or None to compare all of them.
         """
         self._expectations_dir = expectations_dir
         self._expected_name = expected_name
         self._updated_name = updated_name
         self._skpdiff_path = skpdiff_path
+        self._download_threads = download_threads
+        self._image_cache = image_cache
+        self._skpdiff_processes = skpdiff_processes
+        self._skpdiff_differs = skpdiff_differs
+        self._skpdiff_cache = skpdiff_cache
+        if skpdiff_cache is None:
+            self._skpdiff_cache = SkpdiffResultCache(None)
         self._generate_gm_comparison()
 
     def _generate_gm_comparison(self):
@@ -239,15 +634,11 @@ class ExpectationsManager:
         # file tree.
         self._download_expectation_images(expected_image_dir, actual_image_dir)
 
-        # Invoke skpdiff with our downloaded images and place its results in the
-        # temporary directory.
+        # Compare the downloaded images with skpdiff and place its results in
+        # the temporary directory.
         self._skpdiff_output_path = os.path.join(image_output_dir,
                                                 'skpdiff_output.json')
-        skpdiff_cmd = SKPDIFF_INVOKE_FORMAT.format(self._skpdiff_path,
-                                                   self._skpdiff_output_path,
-                                                   expected_image_dir,
-                                                   actual_image_dir)
-        os.system(skpdiff_cmd)
+        self._compare_expectation_images()
         self._load_skpdiff_output()
 
 
@@ -322,6 +713,62 @@ class ExpectationsManager:
                 record['isRebaselined'] = self.image_map[record['baselinePath']][1].is_rebaselined
 
 
+    def _compare_expectation_images(self):
+        """Write the skpdiff records of the downloaded images of the
+        _expectations array to the skpdiff output file. Only image pairs
+        missing from the skpdiff cache are compared by skpdiff.
+        """
+        metric_set = get_metric_set(self._skpdiff_differs)
+
+        # Gather the distinct image pairs that have no cached results.
+        pairs = {}
+        compared = set()
+        for expectation in self._expectations:
+            if (expectation.expected_hash is None or
+                    expectation.actual_hash is None):
+                continue
+            hashes = (expectation.expected_hash, expectation.actual_hash)
+            compared.add(hashes)
+            if (hashes not in pairs and
+                    self._skpdiff_cache.get(hashes[0], hashes[1],
+                                            metric_set) is None):
+                pairs[hashes] = (expectation.expected_image_path,
+                                 expectation.actual_image_path)
+
+        print('Comparing %d image pairs, %d found in the skpdiff cache' % (
+            len(pairs), len(compared) - len(pairs)))
+        if pairs:
+            pair_hashes = pairs.keys()
+            records = run_skpdiff(self._skpdiff_path,
+                                  [pairs[hashes] for hashes in pair_hashes],
+                                  self._skpdiff_processes,
+                                  self._skpdiff_differs)
+            for hashes, record in zip(pair_hashes, records):
+                if record is not None:
+                    self._skpdiff_cache.put(hashes[0], hashes[1], metric_set,
+                                            record)
+            self._skpdiff_cache.save()
+
+        # Give each expectation the record of its image pair, with the paths
+        # of this session. The common name is the one skpdiff gives images of
+        # the same name, which have no common prefix to shorten.
+        skpdiff_records = []
+        for expectation in self._expectations:
+            record = self._skpdiff_cache.get(expectation.expected_hash,
+                                             expectation.actual_hash,
+                                             metric_set)
+            if record is None:
+                continue
+            record = dict(record)
+            record['commonName'] = os.path.basename(
+                expectation.expected_image_path) + '.png'
+            record['baselinePath'] = expectation.expected_image_path
+            record['testPath'] = expectation.actual_image_path
+            skpdiff_records.append(record)
+
+        with open(self._skpdiff_output_path, 'wb') as skpdiff_output_file:
+            json.dump({'records': skpdiff_records}, skpdiff_output_file)
+
     def _download_expectation_images(self, expected_image_dir, actual_image_dir):
         """Download the expected and actual images for the _expectations array.
 
@@ -330,8 +777,14 @@ class ExpectationsManager:
         @param actual_image_dir   The directory to download actual images into.
         """
         image_map = {}
-
-        # Look through expectations and download their images.
+        hash_type = gm_json.JSONKEY_HASHTYPE_BITMAP_64BITMD5
+
+        # Look through expectations and gather the images to download. With an
+        # image cache, only images missing from it are downloaded, into the
+        # cache, and all images are linked from there afterwards.
+        downloads = []
+        links = []
+        cache_paths = set()
         for expectation in self._expectations:
             # Build appropriate paths to download the images into.
             expected_image_path = os.path.join(expected_image_dir,
@@ -342,17 +795,21 @@ class ExpectationsManager:
                                              expectation.device_name + '-' +
                                              expectation.image_name)
 
-            print('Downloading %s for device %s' % (
-                expectation.image_name, expectation.device_name))
-
-            # Download images
-            download_gm_image(expectation.image_name,
-                              expected_image_path,
-                              expectation.expected_hash)
-
-            download_gm_image(expectation.image_name,
-                              actual_image_path,
-                              expectation.actual_hash)
+            for image_path, hash_val in (
+                    (expected_image_path, expectation.expected_hash),
+                    (actual_image_path, expectation.actual_hash)):
+                if hash_val is None:
+                    continue
+                image_url = get_gm_image_url(expectation.image_name, hash_val)
+                if self._image_cache is None:
+                    downloads.append((image_url, image_path))
+                    continue
+                cache_path = self._image_cache.get_path(hash_type, hash_val)
+                if (cache_path not in cache_paths and
+                        not os.path.isfile(cache_path)):
+                    downloads.append((image_url, cache_path))
+                cache_paths.add(cache_path)
+                links.append((hash_val, image_path))
 
             # Annotate the expectations with where the images were downloaded
             # to.
@@ -363,6 +820,21 @@ class ExpectationsManager:
             image_map[expected_image_path] = (False, expectation)
             image_map[actual_image_path] = (True, expectation)
 
+        # Download the images concurrently.
+        if self._image_cache is None:
+            print('Downloading %d images' % len(downloads))
+        else:
+            print('Downloading %d images, %d found in the image cache' % (
+                len(downloads), len(cache_paths) - len(downloads)))
+        ImageDownloader(self._download_threads).download_all(downloads)
+
+        if self._image_cache is not None:
+            for hash_val, image_path in links:
+                self._image_cache.link(hash_type, hash_val, image_path)
+            removed = self._image_cache.evict(keep=cache_paths)
+            if removed:
+                print('Evicted %d images from the image cache' % removed)
+
         self.image_map = image_map
 
     def _set_expected_hash(self, device_name, image_name, hash_value):
@@ -555,6 +1027,55 @@ def main():
                         'defaults to out/Release/skpdiff or out/Default/skpdiff'
                         )
 
+    parser.add_argument('--download-threads', metavar='DOWNLOAD_THREADS',
+                        type=int,
+                        default=DEFAULT_DOWNLOAD_THREADS,
+                        help='number of images to download concurrently; ' +
+                        'defaults to %(default)s'
+                        )
+
+    parser.add_argument('--image-cache-dir', metavar='IMAGE_CACHE_DIR',
+                        default=DEFAULT_IMAGE_CACHE_DIR,
+                        help='the directory of the image cache shared by ' +
+                        'all sessions; defaults to %(default)s'
+                        )
+
+    parser.add_argument('--image-cache-size-mb', metavar='IMAGE_CACHE_SIZE_MB',
+                        type=int,
+                        default=DEFAULT_IMAGE_CACHE_SIZE_MB,
+                        help='the size the image cache is trimmed to, in ' +
+                        'megabytes; defaults to %(default)s'
+                        )
+
+    parser.add_argument('--no-image-cache', action='store_true',
+                        help='download images for this session only instead ' +
+                        'of using the image cache'
+                        )
+
+    parser.add_argument('--skpdiff-processes', metavar='SKPDIFF_PROCESSES',
+                        type=int,
+                        default=DEFAULT_SKPDIFF_PROCESSES,
+                        help='number of skpdiff processes to run ' +
+                        'concurrently; defaults to %(default)s'
+                        )
+
+    parser.add_argument('--skpdiff-differs', metavar='DIFFERS',
+                        default='',
+                        help='comma-separated names of the skpdiff differs ' +
+                        'to use; defaults to all of them'
+                        )
+
+    parser.add_argument('--skpdiff-cache', metavar='SKPDIFF_CACHE',
+                        default=DEFAULT_SKPDIFF_CACHE_PATH,
+                        help='the file caching the skpdiff results of image ' +
+                        'pairs; defaults to %(default)s'
+                        )
+
+    parser.add_argument('--no-skpdiff-cache', action='store_true',
+                        help='compare all image pairs instead of using the ' +
+                        'skpdiff cache'
+                        )
+
     args = vars(parser.parse_args())  # Convert args into a python dict
 
     # Make sure we have access to an skpdiff binary
@@ -569,10 +1090,28 @@ def main():
     print('expectations dir   :', args['expectations_dir'])
     print('skpdiff path       :', skpdiff_path)
 
+    image_cache = None
+    if not args['no_image_cache']:
+        print('image cache dir    :', args['image_cache_dir'])
+        image_cache = ImageCache(args['image_cache_dir'],
+                                 args['image_cache_size_mb'] * 1024 * 1024)
+
+    skpdiff_cache = None
+    if not args['no_skpdiff_cache']:
+        print('skpdiff cache      :', args['skpdiff_cache'])
+        skpdiff_cache = SkpdiffResultCache(args['skpdiff_cache'])
+    skpdiff_differs = [differ for differ in args['skpdiff_differs'].split(',')
+                       if differ]
+
     expectations_manager = ExpectationsManager(args['expectations_dir'],
                                                args['expected'],
                                                args['updated'],
-                                               skpdiff_path)
+                                               skpdiff_path,
+                                               args['download_threads'],
+                                               image_cache,
+                                               args['skpdiff_processes'],
+                                               skpdiff_differs,
+                                               skpdiff_cache)
 
     run_server(expectations_manager, port=args['port'])
 